@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Parser benchmark: PEG combinators vs the compiled grammar.
+
+Parses every program in tests/interpreter (repeated to get a
+reasonably big input) with both parsers and shows the timings.
+Expressions are parsed by the pratt parser which is the same
+for both, so the time spent there is shown separately.
+
+The compiled grammar was meant to be several times (TARGET) faster
+than the combinators. It is not: the grammar column is about 2-2.5x
+faster and parsing as a whole about 1.3-1.6x. The grammar column still
+includes work that is the same for both parsers (the loop of
+storm.parse(), converting tokens into values, building the nodes).
+
+    python benchmarks/parser.py [--repeat N] [--rounds N] [--packrat]
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+from catstorm import peg, storm
+from catstorm.grammar import PARSER, PROG, SKIP
+from catstorm.interpreter import Block
+from catstorm.lexer import lex_text
+from catstorm.log import logfilter
+from catstorm.pratt import pratt_parse1
+from catstorm.syntax_tree import pprint
+
+TESTS = Path(__file__).parent.parent / "tests" / "interpreter"
+# the speedup of the grammar the compiler was meant to reach
+TARGET = 3.0
+
+pratt_time = 0
+
+
+def timed_pratt_parse1(tokens):
+    global pratt_time
+    start = time.perf_counter()
+    try:
+        return pratt_parse1(tokens)
+    finally:
+        pratt_time += time.perf_counter() - start
+
+
+def measure_pratt(rule, seen=None):
+    """Make wrappers calling the pratt parser measure its time."""
+    seen = set() if seen is None else seen
+    if id(rule) in seen or not isinstance(rule, peg.Composer):
+        return
+    seen.add(id(rule))
+    if isinstance(rule, peg.Wrap) and rule.attr is pratt_parse1:
+        rule.attr = timed_pratt_parse1
+    for thing in rule.things:
+        measure_pratt(thing, seen)
+
+
+def corpus(repeat):
+    """Lexed programs, so that only the parser is measured."""
+    texts = [path.read_text() for path in sorted(TESTS.rglob("*.ls"))]
+    return [list(lex_text(text, skip=SKIP)) for text in texts * repeat]
+
+
+def bench(rule, programs):
+    """Returns total time, time spent in the pratt parser, parse trees."""
+    global pratt_time
+    storm.program = rule
+    pratt_time = 0
+    trees = []
+    start = time.perf_counter()
+    for lines in programs:
+        blk = Block()
+        storm.parse(lines, blk)
+        trees.append(blk)
+    return time.perf_counter() - start, pratt_time, trees
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=5, help="best of N runs")
+    parser.add_argument("--packrat", action="store_const", const=True, default=False)
+    args = parser.parse_args()
+    if args.packrat:
+        peg.packrat = 0
+    logfilter.default = False
+    measure_pratt(PROG)
+
+    print("parsing {} programs".format(len(corpus(args.repeat))))
+    print("{:<12} {:>10} {:>10} {:>10}".format("", "total", "pratt", "grammar"))
+    results = {}
+    for name, rule in [("combinators", PROG), ("compiled", PARSER)]:
+        timings = []
+        for _ in range(args.rounds):
+            # lex again: parse trees are memoized in tokens with --packrat
+            total, pratt, trees = bench(rule, corpus(args.repeat))
+            timings.append((total - pratt, total, pratt))
+        grammar, total, pratt = min(timings)
+        results[name] = total, grammar, [pprint(tree) for tree in trees]
+        print(
+            "{:<12} {:8.2f}ms {:8.2f}ms {:8.2f}ms".format(
+                name, total * 1000, pratt * 1000, grammar * 1000
+            )
+        )
+
+    (total1, grammar1, a), (total2, grammar2, b) = results.values()
+    print(
+        "{:<12} {:9.2f}x {:>10} {:9.2f}x".format(
+            "speedup", total1 / total2, "", grammar1 / grammar2
+        )
+    )
+    print(
+        "{:<12} {:9.2f}x {:>10} {:>10}".format(
+            "target", TARGET, "", "met" if grammar1 / grammar2 >= TARGET else "MISSED"
+        )
+    )
+    if a != b:
+        raise SystemExit("results are DIFFERENT")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark: wall time of `catstorm -r "1"` and the number
+of modules it imports.
+
+The time is measured relative to the startup of python itself
+(`python -c pass`, run in turns with catstorm), so the threshold
+holds on slower and faster machines. The limits are the measured
+baselines plus a margin for noise (see MAX_RATIO and MAX_MODULES).
+
+Fails if the ratio or the number of modules is over the limit, or
+if a module that is needed only with some flags (see SLOW_IMPORTS)
+is imported.
+
+    python benchmarks/startup.py [--runs N] [--max-ratio X] [--max-modules N]
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+COMMAND = [sys.executable, "-m", "catstorm.storm", "-r", "1"]
+PYTHON = [sys.executable, "-c", "pass"]
+
+# median time of COMMAND / median time of PYTHON: 6.9 measured, about 10
+# before the startup was sped up; the limit is the baseline + 15%
+MAX_RATIO = 8.0
+# 98 modules measured, 161 before; the limit is the baseline + 10%
+MAX_MODULES = 108
+
+# slow to import and not needed to run a program
+SLOW_IMPORTS = [
+    "concurrent.futures",
+    "inspect",
+    "logging",
+    "multiprocessing",
+    "zipfile",
+]
+
+COUNT_MODULES = """
+import sys
+sys.argv = ["catstorm", "-r", "1"]
+from catstorm import storm
+try:
+    storm.main()
+except SystemExit:
+    pass
+print(" ".join(sys.modules))
+"""
+
+
+def run_once(command=COMMAND):
+    start = time.perf_counter()
+    subprocess.run(command, cwd=ROOT, check=True, capture_output=True)
+    return time.perf_counter() - start
+
+
+def startup_output():
+    """Lines printed by catstorm -r 1, the last one lists the imported
+    modules (the ones before are the result of the expression).
+    """
+    cmd = [sys.executable, "-c", COUNT_MODULES]
+    result = subprocess.run(cmd, cwd=ROOT, check=True, capture_output=True, text=True)
+    return result.stdout.splitlines()
+
+
+def imported_modules():
+    return startup_output()[-1].split()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument(
+        "--max-ratio", type=float, default=MAX_RATIO, help="of python startup"
+    )
+    parser.add_argument("--max-modules", type=int, default=MAX_MODULES)
+    args = parser.parse_args()
+
+    run_once()  # warm up (and write __pycache__)
+    timings, python_timings = [], []
+    for _ in range(args.runs):
+        timings.append(run_once())
+        python_timings.append(run_once(PYTHON))
+    timings.sort()
+    median = statistics.median(timings) * 1000
+    python_median = statistics.median(python_timings) * 1000
+    ratio = median / python_median
+    modules = imported_modules()
+    slow = [name for name in SLOW_IMPORTS if name in modules]
+
+    print("{:<10} {:8.2f}ms".format("min", timings[0] * 1000))
+    print("{:<10} {:8.2f}ms".format("median", median))
+    print("{:<10} {:8.2f}ms".format("python", python_median))
+    print("{:<10} {:8.2f}x".format("ratio", ratio))
+    print("{:<10} {:8}".format("modules", len(modules)))
+    print("{:<10} {:>8}".format("slow", ", ".join(slow) or "-"))
+
+    errors = []
+    if ratio > args.max_ratio:
+        errors.append("%.2fx python startup > %.2fx" % (ratio, args.max_ratio))
+    if len(modules) > args.max_modules:
+        errors.append("%d modules > %d" % (len(modules), args.max_modules))
+    if slow:
+        errors.append("imported %s" % ", ".join(slow))
+    if errors:
+        raise SystemExit("startup regression: " + "; ".join(errors))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Compact representation of a rewritten tree (see --arena).
+
+Nodes are kept in flat typed arrays: the kind (class) of every node
+and its children, where a child is either the index of another node
+or a reference to the pool. The pool holds everything that is not
+a node: leaves (Var, Int, Str, ...), names, lists of arguments, etc.
+Equal immutable leaves and literals are put into the pool once.
+
+Nodes are added after their children, so the children of node i
+are children[starts[i]:starts[i + 1]]. A ListNode has an extra first
+child -- the dict with its attributes (e.g., catch_ret of Block).
+
+Objects are made from the arrays only when they are needed: Block is
+returned as ArenaBlock that creates its statements on the first use,
+so bodies of functions that are never called stay in the arrays.
+"""
+
+from array import array
+
+from .interpreter import Block, LazyBlock
+from .syntax_tree import ListNode, Node
+
+
+class Arena:
+    def __init__(self):
+        self.kinds = array("H")  # node -> kind
+        self.starts = array("I", [0])  # node -> index of the first child
+        self.children = array("i")  # node index or ~(pool index)
+        self.types = []  # kind -> class
+        self.type_kinds = {}  # class -> kind
+        self.pool = []
+        self.interned = {}  # key of the object -> pool index
+        self.top = array("i")  # top-level statements
+
+    def __len__(self):
+        return len(self.kinds)
+
+    # packing
+
+    def put(self, nodes):
+        """Add top-level statements (see storm.Pipe)."""
+        self.top.extend(self.add(node) for node in nodes)
+
+    def add(self, obj):
+        """Add node (recursively) and return reference to it."""
+        if isinstance(obj, LazyBlock):
+            raise TypeError("cannot add bodies that are not parsed yet")
+        cls = type(obj)
+        if isinstance(obj, Node):
+            refs = [self.add(getattr(obj, name)) for name in cls.fields]
+        elif isinstance(obj, ListNode):
+            refs = [self.literal(obj.__dict__)]
+            refs.extend(self.add(child) for child in obj)
+        else:
+            return self.literal(obj)
+        self.kinds.append(self.kind(cls))
+        self.children.extend(refs)
+        self.starts.append(len(self.children))
+        return len(self.kinds) - 1
+
+    def literal(self, obj):
+        key = _key(obj)
+        if key is None:
+            key = ("id", id(obj))  # the pool keeps obj, so the id is not reused
+        idx = self.interned.get(key)
+        if idx is None:
+            idx = self.interned[key] = len(self.pool)
+            self.pool.append(obj)
+        return ~idx
+
+    def root(self):
+        """Block with the top-level statements."""
+        self.kinds.append(self.kind(Block))
+        self.children.append(self.literal({"catch_ret": True}))
+        self.children.extend(self.top)
+        self.starts.append(len(self.children))
+        self.top = array("i")
+        self.interned.clear()  # not needed after packing
+        return ArenaBlock(self, len(self.kinds) - 1)
+
+    def kind(self, cls):
+        if cls not in self.type_kinds:
+            self.type_kinds[cls] = len(self.types)
+            self.types.append(cls)
+        return self.type_kinds[cls]
+
+    # unpacking
+
+    def node(self, ref):
+        """Make the object (children of lists are made as well)."""
+        if ref < 0:
+            return self.pool[~ref]
+        cls = self.types[self.kinds[ref]]
+        if cls is Block:
+            return ArenaBlock(self, ref)
+        refs = self.children[self.starts[ref] : self.starts[ref + 1]]
+        obj = cls.__new__(cls)
+        if issubclass(cls, ListNode):
+            state = dict(self.pool[~refs[0]])
+            list.extend(obj, map(self.node, refs[1:]))
+        else:
+            state = dict(zip(cls.fields, map(self.node, refs)))
+        setstate = getattr(obj, "__setstate__", None)
+        if setstate:
+            setstate(state)
+        else:
+            obj.__dict__.update(state)
+        return obj
+
+    def nbytes(self):
+        """Memory used by the arrays."""
+        arrays = self.kinds, self.starts, self.children, self.top
+        return sum(a.itemsize * len(a) for a in arrays)
+
+
+def _key(obj):
+    """Key to intern obj by, None if it cannot be shared."""
+    cls = type(obj)
+    if cls in (str, int, float, bool, type(None)):
+        return cls, obj
+    if cls is list or cls is dict:
+        items = tuple(obj.items() if cls is dict else obj)
+        try:
+            hash(items)
+        except TypeError:
+            return None
+        return cls, items
+    state = getattr(obj, "__dict__", None)
+    if state is not None and len(state) == 1 and "value" in state:
+        value = state["value"]
+        if type(value) in (str, int, float, bool):
+            return cls, type(value), value
+    return None
+
+
+class ArenaBlock(LazyBlock):
+    """Block that takes its statements from the arena on the first use."""
+
+    def __init__(self, arena, ref):
+        super().__init__()
+        self.arena = arena
+        self.ref = ref
+
+    def load(self):
+        if not self.loaded:
+            self.loaded = True
+            arena, ref = self.arena, self.ref
+            refs = arena.children[arena.starts[ref] : arena.starts[ref + 1]]
+            self.__dict__.update(arena.pool[~refs[0]])
+            self.extend(map(arena.node, refs[1:]))
+        return self
+
+    def __iter__(self):
+        self.load()
+        return super().__iter__()
+
+    def __len__(self):
+        self.load()
+        return super().__len__()
+
+    def __getitem__(self, idx):
+        self.load()
+        return super().__getitem__(idx)
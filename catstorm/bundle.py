@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Application bundles: a program and its modules in one zip archive.
+
+Every module is stored as its source and as rewritten trees, one entry
+per top-level statement. Bodies of top-level functions are separate
+entries that are unpickled on the first call, so starting a bundled
+program neither parses anything nor loads code that is never run.
+MANIFEST.json lists the modules and their entries.
+
+The archive starts with a "#!" line, so it can be run directly.
+If it was made by a different catstorm (see cache.stamp()),
+the trees are ignored and the sources are parsed instead.
+
+zipfile is imported only when a bundle is used, it's slow to import
+(see benchmarks/startup.py).
+"""
+
+import copy
+import json
+import os
+import pickle
+
+from . import cache
+from .interpreter import Block, Func, LazyBlock
+
+MANIFEST = "MANIFEST.json"
+SUFFIX = ".lsz"
+SHEBANG = b"#!/usr/bin/env catstorm\n"
+FORMAT = 1
+
+
+def module_name(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def write(path, main, modules):
+    """Write the bundle.
+    main -- name of the main module,
+    modules -- {name: (source, rewritten tree)}.
+    """
+    import zipfile
+
+    manifest = {"format": FORMAT, "stamp": cache.stamp(), "main": main}
+    manifest["modules"] = {}
+    with open(path, "wb") as f:
+        f.write(SHEBANG)
+        with zipfile.ZipFile(f, "w", zipfile.ZIP_DEFLATED) as zf:
+            for name, (source, tree) in modules.items():
+                zf.writestr(name + "/source.ls", source)
+                entries = []
+                for i, node in enumerate(tree):
+                    entry = "%s/%d" % (name, i)
+                    if isinstance(node, Func):
+                        zf.writestr(entry + ".body", dumps(node.body))
+                        node = copy.copy(node)
+                        node.body = Block()
+                    zf.writestr(entry, dumps(node))
+                    entries.append(entry)
+                manifest["modules"][name] = entries
+            zf.writestr(MANIFEST, json.dumps(manifest, indent=1))
+    mode = os.stat(path).st_mode
+    os.chmod(path, mode | (mode & 0o444) >> 2)
+
+
+def dumps(obj):
+    return pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def is_bundle(path):
+    with open(path, "rb") as f:
+        if f.read(len(SHEBANG)) != SHEBANG:
+            return False
+    import zipfile
+
+    return zipfile.is_zipfile(path)
+
+
+class Bundle:
+    """Opened bundle, entries are read from the archive on demand."""
+
+    def __init__(self, path):
+        import zipfile
+
+        self.path = path
+        self.zip = zipfile.ZipFile(path)
+        self.manifest = json.loads(self.zip.read(MANIFEST))
+        self.main = self.manifest["main"]
+        self.stale = (
+            self.manifest["format"] != FORMAT or self.manifest["stamp"] != cache.stamp()
+        )
+
+    def source(self, name):
+        return self.zip.read(name + "/source.ls").decode()
+
+    def module(self, name):
+        """Return Block with the top-level statements of the module
+        (None if the bundle is stale and the source has to be parsed).
+        """
+        if self.stale:
+            return None
+        tree = Block()
+        for entry in self.manifest["modules"][name]:
+            node = self.load(entry)
+            if isinstance(node, Func):
+                node.body = BundledBlock(self, entry + ".body")
+            tree.append(node)
+        return tree
+
+    def load(self, entry):
+        return pickle.loads(self.zip.read(entry))
+
+
+class BundledBlock(LazyBlock):
+    """Function body that is unpickled from the bundle on the first call."""
+
+    def __init__(self, bundle, entry):
+        super().__init__()
+        self.bundle = bundle
+        self.entry = entry
+
+    def load(self):
+        if not self.loaded:
+            self.loaded = True
+            self.extend(self.bundle.load(self.entry))
+        return self
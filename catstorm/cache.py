@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+On-disk cache of parsed and rewritten programs, like __pycache__.
+
+The rewritten Block of "dir/prog.ls" is pickled into
+"dir/__lscache__/prog.ls.pickle". The file starts with a line
+holding the key: a hash of the source and of the stamp (grammar,
+catstorm sources, python version), so a cached tree is used only
+when neither the program nor the interpreter has changed.
+"""
+
+import hashlib
+import os
+import pickle
+import sys
+
+CACHE_DIR = "__lscache__"
+FORMAT = 1
+
+_stamp = None
+
+
+def stamp():
+    """Hash of everything the cached tree depends on except the program."""
+    global _stamp
+    if _stamp is None:
+        from .grammar import PARSER
+
+        h = hashlib.sha1(
+            b"%d %s %s\n"
+            % (FORMAT, sys.implementation.cache_tag.encode(), PARSER.key.encode())
+        )
+        pkgdir = os.path.dirname(__file__)
+        for name in sorted(os.listdir(pkgdir)):
+            if name.endswith(".py"):
+                with open(os.path.join(pkgdir, name), "rb") as f:
+                    h.update(f.read())
+        _stamp = h.hexdigest()
+    return _stamp
+
+
+def source_key(source):
+    """Cache key of the source (bytes)."""
+    return hashlib.sha1(stamp().encode() + source).hexdigest()
+
+
+def cache_path(path):
+    dirname, basename = os.path.split(os.path.abspath(path))
+    return os.path.join(dirname, CACHE_DIR, basename + ".pickle")
+
+
+def load(path, key):
+    """Return cached tree of the program at path or None
+    if there is no cache or it is stale.
+    """
+    try:
+        with open(cache_path(path), "rb") as f:
+            if f.readline().rstrip() != key.encode():
+                return None
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+
+
+def store(path, key, tree):
+    """Save the tree, return False if it cannot be cached."""
+    try:
+        data = pickle.dumps(tree, protocol=pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, TypeError, AttributeError):
+        return False
+    cpath = cache_path(path)
+    tmp = "%s.%d" % (cpath, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(cpath), exist_ok=True)
+        with open(tmp, "wb") as f:
+            f.write(key.encode() + b"\n")
+            f.write(data)
+        # other processes never see a partially written file
+        os.replace(tmp, cpath)
+    except OSError:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return False
+    return True
+
+
+def clear(path):
+    """Remove the cache directory that path (a file or a directory) uses."""
+    import shutil
+
+    if not os.path.isdir(path):
+        path = os.path.dirname(os.path.abspath(path))
+    shutil.rmtree(os.path.join(path, CACHE_DIR), ignore_errors=True)
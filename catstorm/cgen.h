@@ -0,0 +1,618 @@
+/*
+ * Runtime of the C code made by cgen.py (see catstorm build).
+ *
+ * Values are passed by value as cs_value: a tag and a payload. Int is
+ * kept in the payload (int64_t, overflow is an error), everything else
+ * points to memory that is never freed, unless the program is built
+ * with -DCS_USE_GC and linked with the Boehm GC (-lgc).
+ *
+ * The generated code defines CS_NAMES and cs_names (names of
+ * attributes and methods) before it includes this file.
+ */
+
+#include <stdarg.h>
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+#ifdef CS_USE_GC
+#include <gc.h>
+#define CS_ALLOC(size) GC_MALLOC(size)
+#define CS_REALLOC(ptr, size) GC_REALLOC(ptr, size)
+#define CS_INIT() GC_INIT()
+#else
+#define CS_ALLOC(size) malloc(size)
+#define CS_REALLOC(ptr, size) realloc(ptr, size)
+#define CS_INIT()
+#endif
+
+typedef enum {
+  CS_UNDEF,  /* variable that is not assigned yet */
+  CS_NONE,
+  CS_BOOL,
+  CS_INT,
+  CS_STR,
+  CS_ARRAY,
+  CS_FUNC,
+  CS_CLASS,
+  CS_OBJ,
+} cs_tag;
+
+typedef struct cs_value cs_value;
+
+typedef struct cs_str {
+  size_t len;
+  const char *data;
+} cs_str;
+
+typedef struct cs_array {
+  size_t len, cap;
+  cs_value *items;
+} cs_array;
+
+typedef struct cs_func {
+  const char *name;
+  int nargs;
+  cs_value (*call)(cs_value self, cs_value *args);
+} cs_func;
+
+typedef struct cs_class {
+  const char *name;
+  const cs_func *const *methods; /* by name id */
+} cs_class;
+
+typedef struct cs_obj {
+  const cs_class *cls;
+  cs_value *attrs; /* by name id */
+} cs_obj;
+
+struct cs_value {
+  cs_tag tag;
+  union {
+    int64_t i;
+    const cs_str *s;
+    cs_array *a;
+    const cs_func *f;
+    const cs_class *c;
+    cs_obj *o;
+  } u;
+};
+
+#define CS_UNDEF_V ((cs_value){CS_UNDEF, {0}})
+#define CS_NONE_V ((cs_value){CS_NONE, {0}})
+#define CS_TRUE ((cs_value){CS_BOOL, {.i = 1}})
+#define CS_FALSE ((cs_value){CS_BOOL, {.i = 0}})
+
+static inline cs_value cs_int(int64_t i) { return (cs_value){CS_INT, {.i = i}}; }
+static inline cs_value cs_bool(int b) { return b ? CS_TRUE : CS_FALSE; }
+static inline cs_value cs_strv(const cs_str *s) { return (cs_value){CS_STR, {.s = s}}; }
+static inline cs_value cs_funcv(const cs_func *f) { return (cs_value){CS_FUNC, {.f = f}}; }
+static inline cs_value cs_classv(const cs_class *c) { return (cs_value){CS_CLASS, {.c = c}}; }
+
+/**********
+ * ERRORS *
+ **********/
+
+static void cs_error(const char *fmt, ...)
+    __attribute__((noreturn, format(printf, 1, 2)));
+
+static void cs_error(const char *fmt, ...) {
+  va_list ap;
+  fflush(stdout);
+  fputs("error: ", stderr);
+  va_start(ap, fmt);
+  vfprintf(stderr, fmt, ap);
+  va_end(ap);
+  fputc('\n', stderr);
+  exit(1);
+}
+
+static const char *const cs_tag_names[] = {
+    "undefined", "NONE", "Bool", "Int", "Str", "Array", "Func", "Class", "Obj",
+};
+
+static inline cs_value cs_defined(cs_value v, const char *name) {
+  if (__builtin_expect(v.tag == CS_UNDEF, 0))
+    cs_error("variable \"%s\" is not defined", name);
+  return v;
+}
+
+/***********
+ * STRINGS *
+ ***********/
+
+typedef struct cs_buf {
+  char *data;
+  size_t len, cap;
+} cs_buf;
+
+static void cs_buf_add(cs_buf *buf, const char *data, size_t len) {
+  if (buf->len + len + 1 > buf->cap) {
+    buf->cap = (buf->len + len + 1) * 2;
+    buf->data = CS_REALLOC(buf->data, buf->cap);
+  }
+  memcpy(buf->data + buf->len, data, len);
+  buf->len += len;
+  buf->data[buf->len] = 0;
+}
+
+static void cs_buf_str(cs_buf *buf, const char *s) { cs_buf_add(buf, s, strlen(s)); }
+
+static cs_value cs_buf_value(cs_buf *buf) {
+  cs_str *s = CS_ALLOC(sizeof(cs_str));
+  s->len = buf->len;
+  s->data = buf->data ? buf->data : "";
+  return cs_strv(s);
+}
+
+static cs_value cs_str_new(const char *data, size_t len) {
+  cs_buf buf = {0};
+  cs_buf_add(&buf, data, len);
+  return cs_buf_value(&buf);
+}
+
+/* repr() of python str (the text of Str) */
+static void cs_repr(cs_buf *buf, const cs_str *s) {
+  char quote = '\'';
+  if (memchr(s->data, '\'', s->len) && !memchr(s->data, '"', s->len))
+    quote = '"';
+  cs_buf_add(buf, &quote, 1);
+  for (size_t i = 0; i < s->len; i++) {
+    unsigned char c = s->data[i];
+    char esc[5];
+    if (c == quote || c == '\\') {
+      esc[0] = '\\', esc[1] = c;
+      cs_buf_add(buf, esc, 2);
+    } else if (c == '\n') {
+      cs_buf_str(buf, "\\n");
+    } else if (c == '\r') {
+      cs_buf_str(buf, "\\r");
+    } else if (c == '\t') {
+      cs_buf_str(buf, "\\t");
+    } else if (c < 0x20 || c == 0x7f) {
+      snprintf(esc, sizeof(esc), "\\x%02x", c);
+      cs_buf_add(buf, esc, 4);
+    } else {
+      cs_buf_add(buf, (char *)&c, 1);
+    }
+  }
+  cs_buf_add(buf, &quote, 1);
+}
+
+static cs_value cs_call_method(cs_value obj, int name, int argc, cs_value *args);
+static int cs_find_name(const char *name);
+
+static void cs_py_str(cs_buf *buf, cs_value v);
+
+/* what value.to_str() shows, e.g. Str in quotes */
+static void cs_text(cs_buf *buf, cs_value v) {
+  char num[32];
+  switch (v.tag) {
+  case CS_NONE:
+    cs_buf_str(buf, "NONE");
+    break;
+  case CS_BOOL:
+    cs_buf_str(buf, v.u.i ? "TRUE" : "FALSE");
+    break;
+  case CS_INT:
+    snprintf(num, sizeof(num), "%lld", (long long)v.u.i);
+    cs_buf_str(buf, num);
+    break;
+  case CS_STR:
+    cs_repr(buf, v.u.s);
+    break;
+  case CS_ARRAY:
+    cs_buf_str(buf, "[");
+    for (size_t i = 0; i < v.u.a->len; i++) {
+      if (i)
+        cs_buf_str(buf, ", ");
+      cs_text(buf, v.u.a->items[i]);
+    }
+    cs_buf_str(buf, "]");
+    break;
+  case CS_FUNC:
+    cs_buf_str(buf, "<func ");
+    cs_buf_str(buf, v.u.f->name);
+    cs_buf_str(buf, ">");
+    break;
+  case CS_CLASS:
+    cs_buf_str(buf, "<");
+    cs_buf_str(buf, v.u.c->name);
+    cs_buf_str(buf, ">");
+    break;
+  case CS_OBJ: {
+    int to_str = cs_find_name("to_str");
+    if (to_str < 0)
+      cs_error("No such member \"to_str\" in class %s", v.u.o->cls->name);
+    cs_py_str(buf, cs_call_method(v, to_str, 0, NULL));
+    break;
+  }
+  default:
+    cs_error("undefined value");
+  }
+}
+
+/* text of the value with Str as it is (to_py_str()) */
+static void cs_py_str(cs_buf *buf, cs_value v) {
+  if (v.tag == CS_STR)
+    cs_buf_add(buf, v.u.s->data, v.u.s->len);
+  else
+    cs_text(buf, v);
+}
+
+/* string template, chunks[0] {values[0]} chunks[1] ... */
+static cs_value cs_template(const char *const *chunks, int n, cs_value *values) {
+  cs_buf buf = {0};
+  cs_buf_str(&buf, chunks[0]);
+  for (int i = 0; i < n; i++) {
+    cs_text(&buf, values[i]);
+    cs_buf_str(&buf, chunks[i + 1]);
+  }
+  return cs_buf_value(&buf);
+}
+
+static cs_value cs_print(cs_value v) {
+  cs_buf buf = {0};
+  cs_text(&buf, v);
+  fputs("P> ", stdout);
+  if (buf.data)
+    fwrite(buf.data, 1, buf.len, stdout);
+  fputc('\n', stdout);
+  return v;
+}
+
+/*************
+ * OPERATORS *
+ *************/
+
+static void cs_unsupported(const char *meth, const char *sym, cs_value left) {
+  cs_error("%s does not have %s method, operation (%s) not supported",
+           cs_tag_names[left.tag], meth, sym);
+}
+
+static cs_value cs_add_slow(cs_value a, cs_value b) {
+  if (a.tag == CS_STR && b.tag == CS_STR) {
+    cs_buf buf = {0};
+    cs_buf_add(&buf, a.u.s->data, a.u.s->len);
+    cs_buf_add(&buf, b.u.s->data, b.u.s->len);
+    return cs_buf_value(&buf);
+  }
+  cs_unsupported("Add", "+", a);
+  return CS_NONE_V;
+}
+
+static inline cs_value cs_add(cs_value a, cs_value b) {
+  int64_t r;
+  if (a.tag == CS_INT && b.tag == CS_INT) {
+    if (__builtin_add_overflow(a.u.i, b.u.i, &r))
+      cs_error("integer overflow in +");
+    return cs_int(r);
+  }
+  return cs_add_slow(a, b);
+}
+
+static inline cs_value cs_sub(cs_value a, cs_value b) {
+  int64_t r;
+  if (a.tag != CS_INT || b.tag != CS_INT)
+    cs_unsupported("Sub", "-", a);
+  if (__builtin_sub_overflow(a.u.i, b.u.i, &r))
+    cs_error("integer overflow in -");
+  return cs_int(r);
+}
+
+static inline cs_value cs_mul(cs_value a, cs_value b) {
+  int64_t r;
+  if (a.tag != CS_INT || b.tag != CS_INT)
+    cs_unsupported("Mul", "*", a);
+  if (__builtin_mul_overflow(a.u.i, b.u.i, &r))
+    cs_error("integer overflow in *");
+  return cs_int(r);
+}
+
+static inline cs_value cs_minus(cs_value a) {
+  if (a.tag != CS_INT)
+    cs_error("%s does not support unary minus", cs_tag_names[a.tag]);
+  if (a.u.i == INT64_MIN)
+    cs_error("integer overflow in -");
+  return cs_int(-a.u.i);
+}
+
+static int cs_truthy(cs_value v);
+
+static int cs_equal(cs_value a, cs_value b) {
+  int numeric_a = a.tag == CS_INT || a.tag == CS_BOOL;
+  int numeric_b = b.tag == CS_INT || b.tag == CS_BOOL;
+  if (numeric_a && numeric_b)
+    return a.u.i == b.u.i;
+  if (a.tag == CS_STR && b.tag == CS_STR)
+    return a.u.s->len == b.u.s->len &&
+           !memcmp(a.u.s->data, b.u.s->data, a.u.s->len);
+  if (a.tag == CS_ARRAY) {
+    if (b.tag != CS_ARRAY || a.u.a->len != b.u.a->len)
+      return 0;
+    for (size_t i = 0; i < a.u.a->len; i++)
+      if (!cs_equal(a.u.a->items[i], b.u.a->items[i]))
+        return 0;
+    return 1;
+  }
+  if (a.tag != b.tag)
+    return 0;
+  return a.tag == CS_NONE || a.u.f == b.u.f;
+}
+
+static inline cs_value cs_eq(cs_value a, cs_value b) {
+  if (a.tag == CS_INT && b.tag == CS_INT)
+    return cs_bool(a.u.i == b.u.i);
+  return cs_bool(cs_equal(a, b));
+}
+
+static inline cs_value cs_ne(cs_value a, cs_value b) {
+  if (a.tag == CS_INT && b.tag == CS_INT)
+    return cs_bool(a.u.i != b.u.i);
+  if (a.tag == CS_ARRAY)
+    cs_unsupported("NotEq", "!=", a);
+  return cs_bool(!cs_equal(a, b));
+}
+
+static int cs_compare(cs_value a, cs_value b, const char *meth, const char *sym) {
+  if ((a.tag == CS_INT || a.tag == CS_BOOL) && (b.tag == CS_INT || b.tag == CS_BOOL))
+    return a.u.i < b.u.i ? -1 : a.u.i > b.u.i;
+  if (a.tag == CS_STR && b.tag == CS_STR) {
+    size_t n = a.u.s->len < b.u.s->len ? a.u.s->len : b.u.s->len;
+    int r = memcmp(a.u.s->data, b.u.s->data, n);
+    if (r)
+      return r;
+    return a.u.s->len < b.u.s->len ? -1 : a.u.s->len > b.u.s->len;
+  }
+  cs_unsupported(meth, sym, a);
+  return 0;
+}
+
+static inline cs_value cs_gt(cs_value a, cs_value b) {
+  if (a.tag == CS_INT && b.tag == CS_INT)
+    return cs_bool(a.u.i > b.u.i);
+  return cs_bool(cs_compare(a, b, "Gt", ">") > 0);
+}
+
+static inline cs_value cs_lt(cs_value a, cs_value b) {
+  if (a.tag == CS_INT && b.tag == CS_INT)
+    return cs_bool(a.u.i < b.u.i);
+  return cs_bool(cs_compare(a, b, "Lt", "<") < 0);
+}
+
+/* value.to_bool(), used by if, and, or, not */
+static inline int cs_truthy(cs_value v) {
+  switch (v.tag) {
+  case CS_BOOL:
+  case CS_INT:
+    return v.u.i != 0;
+  case CS_NONE:
+    return 0;
+  case CS_STR:
+    return v.u.s->len != 0;
+  case CS_ARRAY:
+    return v.u.a->len != 0;
+  case CS_UNDEF:
+    cs_error("undefined value");
+  default:
+    return 1;
+  }
+}
+
+/* truth of the value for python, used by while */
+static inline int cs_py_truthy(cs_value v) {
+  if (v.tag == CS_BOOL)
+    return v.u.i != 0;
+  if (v.tag == CS_ARRAY)
+    return v.u.a->len != 0;
+  return 1;
+}
+
+/**********
+ * ARRAYS *
+ **********/
+
+static cs_value cs_array_new(int n, const cs_value *items) {
+  cs_array *a = CS_ALLOC(sizeof(cs_array));
+  a->len = a->cap = n;
+  a->items = CS_ALLOC(sizeof(cs_value) * (n ? n : 1));
+  if (n)
+    memcpy(a->items, items, sizeof(cs_value) * n);
+  return (cs_value){CS_ARRAY, {.a = a}};
+}
+
+static cs_value cs_append(cs_value arr, cs_value v) {
+  cs_array *a;
+  if (arr.tag != CS_ARRAY)
+    cs_unsupported("Append", "<<<", arr);
+  a = arr.u.a;
+  if (a->len == a->cap) {
+    a->cap = a->cap ? a->cap * 2 : 4;
+    a->items = CS_REALLOC(a->items, sizeof(cs_value) * a->cap);
+  }
+  a->items[a->len++] = v;
+  return v;
+}
+
+static int64_t cs_index(cs_value key, size_t len) {
+  int64_t i;
+  if (key.tag != CS_INT)
+    cs_error("index must be Int, got %s", cs_tag_names[key.tag]);
+  i = key.u.i < 0 ? key.u.i + (int64_t)len : key.u.i;
+  if (i < 0 || i >= (int64_t)len)
+    cs_error("index out of range");
+  return i;
+}
+
+static cs_value cs_get_item(cs_value v, cs_value key) {
+  if (v.tag == CS_ARRAY)
+    return v.u.a->items[cs_index(key, v.u.a->len)];
+  if (v.tag == CS_STR)
+    return cs_str_new(v.u.s->data + cs_index(key, v.u.s->len), 1);
+  cs_error("%s does not support subscript", cs_tag_names[v.tag]);
+}
+
+static int64_t cs_bound(cs_value v, size_t len) {
+  int64_t i;
+  if (v.tag != CS_INT)
+    cs_error("slice bounds must be Int");
+  i = v.u.i < 0 ? v.u.i + (int64_t)len : v.u.i;
+  return i < 0 ? 0 : i > (int64_t)len ? (int64_t)len : i;
+}
+
+static cs_value cs_slice(cs_value v, cs_value start, cs_value stop) {
+  int64_t from, to;
+  if (v.tag != CS_ARRAY)
+    cs_error("%s does not support slices", cs_tag_names[v.tag]);
+  from = cs_bound(start, v.u.a->len);
+  to = cs_bound(stop, v.u.a->len);
+  return cs_array_new(to > from ? to - from : 0, v.u.a->items + from);
+}
+
+static cs_value cs_set_item(cs_value v, cs_value key, cs_value value) {
+  if (v.tag != CS_ARRAY)
+    cs_error("%s does not support item assignment", cs_tag_names[v.tag]);
+  v.u.a->items[cs_index(key, v.u.a->len)] = value;
+  return value;
+}
+
+/* iteration over arrays and strings (by bytes) */
+typedef struct cs_iter {
+  cs_value seq;
+  size_t pos;
+} cs_iter;
+
+static cs_iter cs_iter_new(cs_value seq) {
+  if (seq.tag != CS_ARRAY && seq.tag != CS_STR)
+    cs_error("%s is not iterable", cs_tag_names[seq.tag]);
+  return (cs_iter){seq, 0};
+}
+
+static inline int cs_next(cs_iter *it, cs_value *var) {
+  if (it->seq.tag == CS_ARRAY) {
+    if (it->pos >= it->seq.u.a->len)
+      return 0;
+    *var = it->seq.u.a->items[it->pos++];
+    return 1;
+  }
+  if (it->pos >= it->seq.u.s->len)
+    return 0;
+  *var = cs_str_new(it->seq.u.s->data + it->pos++, 1);
+  return 1;
+}
+
+/***********************
+ * FUNCTIONS, OBJECTS *
+ ***********************/
+
+static int cs_find_name(const char *name) {
+  for (int i = 0; i < CS_NAMES; i++)
+    if (!strcmp(cs_names[i], name))
+      return i;
+  return -1;
+}
+
+static cs_value cs_new(const cs_class *cls, int argc, cs_value *args);
+
+static cs_value cs_apply(const cs_func *f, cs_value self, int argc, cs_value *args) {
+  if (argc != f->nargs)
+    cs_error("The number of arguments must match the function signature.\n"
+             "Got %d instead of %d (%s).", argc, f->nargs, f->name);
+  return f->call(self, args);
+}
+
+/* call of a value, self is "this" of the caller */
+static cs_value cs_call(cs_value self, cs_value f, int argc, cs_value *args) {
+  if (f.tag == CS_FUNC)
+    return cs_apply(f.u.f, self, argc, args);
+  if (f.tag == CS_CLASS)
+    return cs_new(f.u.c, argc, args);
+  cs_error("I can only call functions and classes, got %s instead",
+           cs_tag_names[f.tag]);
+}
+
+static cs_value cs_get_attr(cs_value v, int name) {
+  const cs_func *method;
+  if (v.tag != CS_OBJ)
+    cs_error("%s has no attribute \"%s\"", cs_tag_names[v.tag], cs_names[name]);
+  if (v.u.o->attrs[name].tag != CS_UNDEF)
+    return v.u.o->attrs[name];
+  method = v.u.o->cls->methods[name];
+  if (!method)
+    cs_error("No such member \"%s\" in class %s", cs_names[name], v.u.o->cls->name);
+  return cs_funcv(method);
+}
+
+static cs_value cs_set_attr(cs_value v, int name, cs_value value) {
+  if (v.tag != CS_OBJ)
+    cs_error("%s has no attribute \"%s\"", cs_tag_names[v.tag], cs_names[name]);
+  v.u.o->attrs[name] = value;
+  return CS_NONE_V;
+}
+
+static cs_value cs_builtin_method(cs_value v, const char *name, int argc) {
+  if (!strcmp(name, "len") && argc == 0) {
+    if (v.tag == CS_ARRAY)
+      return cs_int(v.u.a->len);
+    if (v.tag == CS_STR)
+      return cs_int(v.u.s->len);
+  }
+  if (!strcmp(name, "strip") && argc == 0 && v.tag == CS_STR) {
+    const char *start = v.u.s->data, *end = start + v.u.s->len;
+    while (start < end && strchr(" \t\n\r\f\v", *start))
+      start++;
+    while (end > start && strchr(" \t\n\r\f\v", end[-1]))
+      end--;
+    return cs_str_new(start, end - start);
+  }
+  cs_error("%s has no method \"%s\"", cs_tag_names[v.tag], name);
+}
+
+/* obj@name . args, "this" of the method is obj */
+static cs_value cs_call_method(cs_value obj, int name, int argc, cs_value *args) {
+  if (obj.tag != CS_OBJ)
+    return cs_builtin_method(obj, cs_names[name], argc);
+  return cs_call(obj, cs_get_attr(obj, name), argc, args);
+}
+
+static cs_value cs_new(const cs_class *cls, int argc, cs_value *args) {
+  cs_obj *o = CS_ALLOC(sizeof(cs_obj));
+  cs_value obj = {CS_OBJ, {.o = o}};
+  int init = cs_find_name("New");
+  o->cls = cls;
+  o->attrs = CS_ALLOC(sizeof(cs_value) * (CS_NAMES ? CS_NAMES : 1));
+  for (int i = 0; i < CS_NAMES; i++)
+    o->attrs[i] = CS_UNDEF_V;
+  if (init < 0 || !cls->methods[init])
+    cs_error("No such member \"New\" in class %s", cls->name);
+  cs_apply(cls->methods[init], obj, argc, args);
+  return obj;
+}
+
+static cs_value cs_assert(cs_value v, const char *expr) {
+  if (v.tag != CS_BOOL)
+    puts("warning, asserting on not bool");
+  if (!cs_truthy(v))
+    cs_error("Assertion failed on %s", expr);
+  return v;
+}
+
+/* runs main(progname, args), returns the exit status */
+static int cs_run(int argc, char **argv, void (*init)(void), cs_value *main_func) {
+  cs_value args[2];
+  cs_value result;
+  CS_INIT();
+  init();
+  if (main_func->tag == CS_UNDEF)
+    cs_error("variable \"main\" is not defined");
+  args[0] = cs_str_new(argv[0], strlen(argv[0]));
+  args[1] = cs_array_new(0, NULL);
+  for (int i = 1; i < argc; i++)
+    cs_append(args[1], cs_str_new(argv[i], strlen(argv[i])));
+  result = cs_call(CS_NONE_V, *main_func, 2, args);
+  if (result.tag == CS_INT)
+    return (int)result.u.i;
+  cs_print(result);
+  return 1;
+}
@@ -0,0 +1,650 @@
+#!/usr/bin/env python3
+"""
+C backend: translates the rewritten tree into C (see --emit-c) and
+builds a native executable with the system compiler (catstorm build).
+
+The code is written with writer.CBlock and uses the runtime in cgen.h.
+Every function becomes a C function taking "this" and its arguments,
+calls of top-level functions are direct C calls, other calls go
+through cs_call(). Int is unboxed, so arithmetic and loops over Int
+do not allocate.
+
+Variables are resolved when the program is compiled: a function sees
+its arguments, its own variables, the top-level variables and the
+functions and classes the functions around it define (and never
+reassign).
+The interpreter scopes variables dynamically (a function sees the
+variables of its caller), programs that rely on that are rejected
+with CompileError, as are nodes the backend does not translate.
+A loop body runs in a new frame, so variables assigned in it are
+local to the loop and start with the values they had outside.
+"""
+
+import os
+import re
+import shlex
+import subprocess
+import tempfile
+
+from .interpreter import (
+    FALSE,
+    NONE,
+    TRUE,
+    Add,
+    And,
+    Append,
+    ArrayNode,
+    Assert,
+    Assign,
+    Attr,
+    Call,
+    Call0,
+    CallObj,
+    Class,
+    Colon,
+    Comma,
+    Eq,
+    ForLoop,
+    Func,
+    GetAttr,
+    Gt,
+    If,
+    IfElse,
+    Int,
+    LazyBlock,
+    Lt,
+    Minus,
+    Mul,
+    Not,
+    NotEq,
+    Or,
+    Parens,
+    Print,
+    Ret,
+    SetAttr,
+    Str,
+    StrTemplate,
+    Sub,
+    Subscript,
+    Var,
+    WhileLoop,
+)
+from .syntax_tree import BaseNode, Leaf
+from .writer import CBlock
+
+HEADER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cgen.h")
+
+OPERATORS = {
+    Add: "cs_add",
+    Sub: "cs_sub",
+    Mul: "cs_mul",
+    Eq: "cs_eq",
+    NotEq: "cs_ne",
+    Gt: "cs_gt",
+    Lt: "cs_lt",
+    Append: "cs_append",
+}
+
+CONSTANTS = {id(TRUE): "CS_TRUE", id(FALSE): "CS_FALSE", id(NONE): "CS_NONE_V"}
+
+INT64 = range(-(2**63), 2**63)
+
+
+class CValue(Leaf):
+    """C expression (in nodes made by the generator)."""
+
+
+class CompileError(Exception):
+    """The program can't be translated into C."""
+
+
+class Scope:
+    """Variables of a function or of a loop body.
+
+    names -- name -> C expression reading the variable,
+    defined -- names that are always defined (arguments and constants).
+    """
+
+    def __init__(self, names, defined=(), parent=None):
+        self.names = names
+        self.defined = set(defined)
+        self.parent = parent
+
+    def find(self, name):
+        scope = self
+        while scope is not None:
+            if name in scope.names:
+                return scope
+            scope = scope.parent
+        return None
+
+
+def c_string(text):
+    """C literal of the string (UTF-8)."""
+    out = []
+    for byte in text.encode():
+        char = chr(byte)
+        if char in '\\"?':
+            out.append("\\" + char)
+        elif 0x20 <= byte < 0x7F:
+            out.append(char)
+        else:
+            out.append("\\%03o" % byte)
+    return '"%s"' % "".join(out)
+
+
+def mangle(name):
+    return re.sub(r"\W", lambda m: "_%x" % ord(m.group()), name)
+
+
+def assigned(node, names):
+    """Count how many times the node assigns names in its frame (loop
+    bodies and bodies of functions have their own frames), definitions
+    of functions and classes count 1, other assignments 2.
+    """
+    if isinstance(node, Assign) and isinstance(node.left, Var):
+        names[node.left.value] = names.get(node.left.value, 0) + 2
+    elif isinstance(node, (Func, Class)):
+        names[node.name] = names.get(node.name, 0) + 1
+        return
+    elif isinstance(node, ForLoop):
+        assigned(node.expr, names)
+        return
+    if isinstance(node, (BaseNode, list, tuple)):
+        for child in node:
+            assigned(child, names)
+
+
+def pure(node):
+    """If evaluating the node has no effects (the order does not matter)."""
+    if isinstance(node, Parens):
+        return pure(node.arg)
+    if isinstance(node, StrTemplate):
+        return not len(node)
+    return isinstance(node, (Var, Int, Str)) or id(node) in CONSTANTS
+
+
+class Generator:
+    """Translates the program into C source.
+
+    path -- name of the source (for messages).
+    """
+
+    def __init__(self, path="<catstorm>"):
+        self.path = path
+        self.lineno = None
+        self.name_ids = {}  # name of attribute or method -> index in cs_names
+        self.literals = []  # definitions of string literals
+        self.literal_names = {}
+        self.cnames = set()
+        self.prototypes = []
+        self.classes = []  # definitions of method tables and classes
+        self.locals = set()  # C names used in the function
+        self.code = CBlock()
+        self.todo = []  # (Func, C name, scope it's defined in) to translate
+        self.globals = {}  # top-level names -> C names
+        self.constant = set()  # ids of definitions of constants
+        self.direct = {}  # value of a constant function -> (Func, C name)
+        self.scope = self.closure = None
+        self.temps = 0
+
+    def error(self, message):
+        where = "%s:%s: " % (self.path, self.lineno) if self.lineno else ""
+        return CompileError(where + message)
+
+    def unique(self, name):
+        result, i = name, 1
+        while result in self.cnames:
+            i += 1
+            result = "%s_%d" % (name, i)
+        self.cnames.add(result)
+        return result
+
+    def name_id(self, name):
+        if name not in self.name_ids:
+            self.name_ids[name] = len(self.name_ids)
+        return self.name_ids[name]
+
+    def literal(self, text):
+        """C expression of Str with the text."""
+        if text not in self.literal_names:
+            name = self.unique("str_%d" % len(self.literals))
+            self.literal_names[text] = name
+            size = len(text.encode())
+            self.literals.append(
+                "static const cs_str %s = {%d, %s};" % (name, size, c_string(text))
+            )
+        return "cs_strv(&%s)" % self.literal_names[text]
+
+    def local(self, name, prefix="v_"):
+        """C name of a variable of the function."""
+        result, i = prefix + mangle(name), 1
+        while result in self.locals:
+            i += 1
+            result = "%s%s_%d" % (prefix, mangle(name), i)
+        self.locals.add(result)
+        return result
+
+    def temp(self):
+        self.temps += 1
+        return "t%d" % self.temps
+
+    # program
+
+    def program(self, tree):
+        counts = {}
+        for node in tree:
+            assigned(node, counts)
+        if "main" not in counts:
+            raise self.error('no "main" function')
+        self.globals = {name: self.unique("g_" + mangle(name)) for name in counts}
+        self.scope = self.closure = Scope(dict(self.globals))
+        consts = self.constants(tree, counts, self.scope)
+        self.init(tree, consts)
+        while self.todo:
+            self.function(*self.todo.pop(0))
+        return self.source()
+
+    def constants(self, block, counts, scope, exclude=()):
+        """Functions and classes that are defined by the statements of the
+        block and never reassigned are constants, their values are put
+        into the scope (that becomes the scope of their bodies).
+        """
+        consts = {}
+        for node in block:
+            name = getattr(node, "name", None)
+            if not isinstance(node, (Func, Class)) or name in exclude:
+                continue
+            if counts.get(name) != 1:
+                continue
+            if isinstance(node, Func):
+                cname = self.declare(node, scope)
+                value = "cs_funcv(&func_%s)" % cname
+                self.direct[value] = node, cname
+            else:
+                value = self.klass(node, scope)
+            self.constant.add(id(node))
+            consts[name] = scope.names[name] = value
+            scope.defined.add(name)
+        return consts
+
+    def declare(self, func, scope, cname=None):
+        """Queue translation of the function, returns its C name."""
+        if isinstance(func.body, LazyBlock):
+            func.body.load()
+        cname = cname or self.unique("fn_" + mangle(func.name))
+        params = ", ".join(["cs_value this"] + ["cs_value" for _ in func.args])
+        self.prototypes.append("static cs_value %s(%s);" % (cname, params))
+        self.prototypes.append("static const cs_func func_%s;" % cname)
+        self.todo.append((func, cname, scope))
+        return cname
+
+    def init(self, tree, consts):
+        """cs_init() runs the top-level statements."""
+        self.code.add("static void cs_init(void)")
+        with self.code.cblock() as body:
+            self.temps, self.returns = 0, False
+            body.add("cs_value this = CS_NONE_V")
+            for name, value in consts.items():
+                body.add("%s = %s" % (self.globals[name], value))
+            self.statements(tree, body)
+            self.declare_temps(body, 1)
+        self.code.add("")
+        self.code.add("int main(int argc, char **argv)")
+        with self.code.cblock() as body:
+            body.add("return cs_run(argc, argv, cs_init, &%s)" % self.globals["main"])
+
+    def function(self, func, cname, outer):
+        """Translate the function, outer is the scope it's defined in."""
+        counts = {}
+        for node in func.body:
+            assigned(node, counts)
+        self.locals = set()
+        args = [self.local(name) for name in func.args]
+        names = dict(zip(func.args, args))
+        # nested definitions see the constants of the function
+        self.closure = Scope({}, parent=outer)
+        consts = self.constants(func.body, counts, self.closure, func.args)
+        for name in counts:
+            if name not in names and name not in consts:
+                names[name] = self.local(name)
+        variables = dict(names)
+        names.update(consts)
+        self.scope = Scope(names, list(func.args) + list(consts), outer)
+        self.temps, self.returns = 0, True
+        params = ", ".join(["cs_value this"] + ["cs_value " + arg for arg in args])
+        self.code.add("")
+        self.code.add("static cs_value %s(%s)" % (cname, params))
+        with self.code.cblock() as body:
+            for name, var in variables.items():
+                if name not in func.args:
+                    body.add("cs_value %s = CS_UNDEF_V" % var)
+            start = len(body.content)
+            self.statements(func.body, body, "return")
+            self.declare_temps(body, start)
+        call = ", ".join(["this"] + ["args[%d]" % i for i in range(len(args))])
+        self.code.add("static cs_value call_%s(cs_value this, cs_value *args)" % cname)
+        with self.code.cblock() as body:
+            body.add("return %s(%s)" % (cname, call))
+        self.code.add(
+            "static const cs_func func_%s = {%s, %d, call_%s};"
+            % (cname, c_string(func.name), len(args), cname)
+        )
+
+    def declare_temps(self, body, at):
+        if self.temps:
+            temps = ", ".join("t%d" % i for i in range(1, self.temps + 1))
+            body.content.insert(at, "cs_value " + temps)
+
+    def klass(self, node, scope):
+        """Define the class, returns its C value."""
+        cname = self.unique("class_" + mangle(node.name))
+        methods = []
+        for member in node.body:
+            if not isinstance(member, Func):
+                raise self.error("only methods are supported in classes")
+            fname = self.unique("fn_%s_%s" % (mangle(node.name), mangle(member.name)))
+            self.declare(member, scope, fname)
+            methods.append((self.name_id(member.name), fname))
+        table = ", ".join("[%d] = &func_%s" % method for method in methods)
+        self.classes.append(
+            "static const cs_func *const methods_%s[CS_NAMES + 1] = {%s};"
+            % (cname, table)
+        )
+        self.classes.append(
+            "static const cs_class %s = {%s, methods_%s};"
+            % (cname, c_string(node.name), cname)
+        )
+        return "cs_classv(&%s)" % cname
+
+    def source(self):
+        names = sorted(self.name_ids, key=self.name_ids.get)
+        out = ["/* generated by catstorm from %s */" % self.path, ""]
+        out.append("#define CS_NAMES %d" % len(names))
+        out.append(
+            "static const char *const cs_names[] = {%s};"
+            % ", ".join(map(c_string, names or [""]))
+        )
+        out.append('#include "cgen.h"')
+        out.append("")
+        out.extend(self.prototypes)
+        out.append("")
+        out.extend("static cs_value %s;" % cname for cname in self.globals.values())
+        out.append("")
+        out.extend(self.literals)
+        out.extend(self.classes)
+        out.extend(self.code.to_str())
+        return "\n".join(out) + "\n"
+
+    # statements
+
+    def statements(self, block, out, target=None):
+        """Translate the block, the value of the last statement goes
+        to target (a variable or "return").
+        """
+        if not len(block) and target:
+            out.add(assign(target, "CS_NONE_V"))
+        last = len(block) - 1
+        for i, node in enumerate(block):
+            self.statement(node, out, target if i == last else None)
+
+    def statement(self, node, out, target=None):
+        self.lineno = getattr(node, "lineno", None) or self.lineno
+        cls = type(node)
+        if cls is Ret:
+            value = self.expr(node.arg)
+            if self.returns:
+                out.add("return " + value)
+            else:
+                out.add(value)
+                out.add("return")
+        elif cls is If:
+            with out.cblock("if (cs_truthy(%s))" % self.expr(node.clause)) as body:
+                self.statements(node.body, body, target)
+            if target:
+                with out.cblock("else") as body:
+                    body.add(assign(target, "CS_NONE_V"))
+        elif cls is WhileLoop:
+            cond = "while (cs_py_truthy(%s))" % self.expr(node.expr)
+            with out.cblock(cond) as body:
+                self.statements(node.body, body)
+            if target:
+                out.add(assign(target, "CS_NONE_V"))
+        elif cls is ForLoop:
+            self.for_loop(node, out, target)
+        elif cls is Assign and isinstance(node.left, Var) and not target:
+            out.add(self.expr(node)[1:-1])
+        elif id(node) in self.constant:
+            if target:  # the value is set before the statements run
+                out.add(assign(target, self.scope.names[node.name]))
+        elif cls is Class:
+            value = self.klass(node, self.closure)
+            self.statement(Assign(Var(node.name), CValue(value)), out, target)
+        else:
+            value = self.expr(node)
+            out.add(assign(target, value) if target else value)
+
+    def for_loop(self, node, out, target):
+        if not isinstance(node.var, Var):
+            raise self.error("for loops support only one variable")
+        result = target
+        if target == "return":
+            result = self.temp()
+        seq = self.expr(node.expr)
+        outer = self.scope
+        names = {node.var.value: None}
+        for child in node.body:
+            assigned(child, names)
+        for name in names:
+            names[name] = self.local(name)
+        with out.cblock() as loop:
+            # the body runs in a new frame that starts with the outer values
+            for name, var in names.items():
+                found = outer.find(name)
+                value = found.names[name] if found else "CS_UNDEF_V"
+                loop.add("cs_value %s = %s" % (var, value))
+            it = self.local("it", "")
+            loop.add("cs_iter %s = cs_iter_new(%s)" % (it, seq))
+            if result:
+                loop.add(assign(result, "CS_NONE_V"))
+            self.scope = Scope(names, parent=outer)
+            var = names[node.var.value]
+            with loop.cblock("while (cs_next(&%s, &%s))" % (it, var)) as body:
+                self.statements(node.body, body, result)
+            self.scope = outer
+        if target == "return":
+            out.add("return " + result)
+
+    # expressions
+
+    def var(self, name):
+        if name == "this":
+            return "this"
+        scope = self.scope.find(name)
+        if scope is None:
+            raise self.error(
+                '"%s" is not defined in the function, the C backend does not '
+                "support variables of the calling function (dynamic scoping)" % name
+            )
+        value = scope.names[name]
+        if name in scope.defined:
+            return value
+        return 'cs_defined(%s, "%s")' % (value, name)
+
+    def ordered(self, nodes):
+        """C expressions of the nodes and the assignments that must be done
+        before them, so they are evaluated from left to right.
+        """
+        exprs = [self.expr(node) for node in nodes]
+        before = []
+        if sum(not pure(node) for node in nodes) > 1:
+            for i, node in enumerate(nodes):
+                if not pure(node):
+                    tmp = self.temp()
+                    before.append("%s = %s" % (tmp, exprs[i]))
+                    exprs[i] = tmp
+        return before, exprs
+
+    def call(self, func, nodes, *args):
+        """func(args..., values of the nodes)."""
+        before, exprs = self.ordered(nodes)
+        return sequence(before, "%s(%s)" % (func, ", ".join(list(args) + exprs)))
+
+    def values(self, func, nodes, *args):
+        """func(args..., n, array of values of the nodes)."""
+        before, exprs = self.ordered(nodes)
+        if exprs:
+            array = "(cs_value[]){%s}" % ", ".join(exprs)
+        else:
+            array = "NULL"
+        call = "%s(%s)" % (func, ", ".join(list(args) + [str(len(exprs)), array]))
+        return sequence(before, call)
+
+    def expr(self, node):
+        """C expression evaluating the node."""
+        cls = type(node)
+        if id(node) in CONSTANTS:
+            return CONSTANTS[id(node)]
+        if cls is Int:
+            if node.value not in INT64:
+                raise self.error("%d does not fit into 64 bits" % node.value)
+            return "cs_int(%dLL)" % node.value
+        if cls is Str:
+            return self.literal(node.value)
+        if cls is Var:
+            return self.var(node.value)
+        if cls in OPERATORS:
+            return self.call(OPERATORS[cls], [node.left, node.right])
+        if cls is Parens:
+            return self.expr(node.arg)
+        if cls is Assign and isinstance(node.left, Var):
+            scope = self.scope.find(node.left.value)
+            if scope is not self.scope:
+                raise self.error("can't assign %s here" % node.left.value)
+            value = self.expr(node.right)
+            return "(%s = %s)" % (scope.names[node.left.value], value)
+        if cls is Assign and isinstance(node.left, Subscript):
+            nodes = [node.right, node.left.left, node.left.right]
+            before, (value, owner, key) = self.ordered(nodes)
+            return sequence(before, "cs_set_item(%s, %s, %s)" % (owner, key, value))
+        if cls is And or cls is Or:
+            tmp = self.temp()
+            left, right = self.expr(node.left), self.expr(node.right)
+            if cls is And:
+                return "(%s = %s, cs_truthy(%s) ? %s : CS_FALSE)" % (
+                    tmp,
+                    left,
+                    tmp,
+                    right,
+                )
+            return "(%s = %s, cs_truthy(%s) ? %s : %s)" % (tmp, left, tmp, tmp, right)
+        if cls is Not:
+            return "(cs_truthy(%s) ? CS_FALSE : CS_TRUE)" % self.expr(node.arg)
+        if cls is Minus:
+            return "cs_minus(%s)" % self.expr(node.arg)
+        if cls is IfElse:
+            cond = self.expr(node.cond)
+            then, otherwise = self.expr(node.then), self.expr(node.otherwise)
+            return "(cs_truthy(%s) ? %s : %s)" % (cond, then, otherwise)
+        if cls is Subscript and isinstance(node.right, Colon):
+            if len(node.right) != 2:
+                raise self.error("only slices [start:stop] are supported")
+            return self.call("cs_slice", [node.left, *node.right])
+        if cls is Subscript:
+            return self.call("cs_get_item", [node.left, node.right])
+        if cls is ArrayNode:
+            return self.values("cs_array_new", list(node))
+        if cls is StrTemplate:
+            return self.template(node)
+        if cls is Print:
+            return "cs_print(%s)" % self.expr(node.arg)
+        if cls is Assert:
+            text = c_string(str(node.arg))
+            return "cs_assert(%s, %s)" % (self.expr(node.arg), text)
+        if cls is Call:
+            args = list(node.right) if isinstance(node.right, Comma) else [node.right]
+            left = node.left
+            if isinstance(left, Var):
+                func, cname = self.direct.get(self.var(left.value), (None, None))
+                if func and len(func.args) == len(args):
+                    return self.call(cname, args, "this")
+            before, exprs = self.ordered([left] + args)
+            array = "(cs_value[]){%s}" % ", ".join(exprs[1:]) if args else "NULL"
+            call = "cs_call(this, %s, %d, %s)" % (exprs[0], len(args), array)
+            return sequence(before, call)
+        if cls is Call0:
+            return "cs_call(this, %s, 0, NULL)" % self.expr(node.arg)
+        if cls is CallObj:
+            args = list(node.args) if isinstance(node.args, Comma) else [node.args]
+            name = str(self.name_id(node.meth_name))
+            before, exprs = self.ordered([node.obj] + args)
+            obj, exprs = exprs[0], exprs[1:]
+            array = "(cs_value[]){%s}" % ", ".join(exprs) if exprs else "NULL"
+            call = "cs_call_method(%s, %s, %d, %s)" % (obj, name, len(exprs), array)
+            return sequence(before, call)
+        if cls is GetAttr and isinstance(node.attr_name, str):
+            obj = self.expr(node.obj)
+            return "cs_get_attr(%s, %d)" % (obj, self.name_id(node.attr_name))
+        if cls is Attr:
+            obj = self.expr(node.left)
+            return "cs_get_attr(%s, %d)" % (obj, self.name_id(node.right.value))
+        if cls is SetAttr and isinstance(node.attr_name, str):
+            before, (obj, value) = self.ordered([node.obj, node.value])
+            call = "cs_set_attr(%s, %d, %s)" % (
+                obj,
+                self.name_id(node.attr_name),
+                value,
+            )
+            return sequence(before, call)
+        if cls is Func:
+            value = "cs_funcv(&func_%s)" % self.declare(node, self.closure)
+            return self.expr(Assign(Var(node.name), CValue(value)))
+        if cls is CValue:
+            return node.value
+        raise self.error("%s is not supported by the C backend" % cls.__name__)
+
+    def template(self, node):
+        if not len(node):
+            return self.literal(node.chunks[0])
+        name = self.unique("tpl_%d" % len(self.literals))
+        chunks = ", ".join(map(c_string, node.chunks))
+        self.literals.append("static const char *const %s[] = {%s};" % (name, chunks))
+        return self.values("cs_template", list(node), name)
+
+
+def assign(target, expr):
+    if target == "return":
+        return "return " + expr
+    return "%s = %s" % (target, expr)
+
+
+def sequence(before, expr):
+    """C comma expression doing the assignments before expr."""
+    if not before:
+        return expr
+    return "(%s)" % ", ".join(before + [expr])
+
+
+def generate(tree, path="<catstorm>"):
+    """C source of the program."""
+    return Generator(path).program(tree)
+
+
+def build(tree, output, path="<catstorm>"):
+    """Translate the program and compile it into the executable output
+    with $CC (cc by default) and $CFLAGS.
+    """
+    source = generate(tree, path)
+    cc = shlex.split(os.environ.get("CC", "cc"))
+    flags = shlex.split(os.environ.get("CFLAGS", "-O2"))
+    with tempfile.TemporaryDirectory() as tmp:
+        name = os.path.splitext(os.path.basename(output))[0] or "program"
+        cfile = os.path.join(tmp, name + ".c")
+        with open(cfile, "w") as f:
+            f.write(source)
+        include = os.path.dirname(HEADER)
+        cmd = cc + flags + ["-I", include, "-o", output, cfile]
+        result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode:
+        raise CompileError("%s failed:\n%s" % (" ".join(cmd), result.stderr))
+    return output
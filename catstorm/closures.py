@@ -0,0 +1,646 @@
+#!/usr/bin/env python3
+"""
+Execution engine that compiles the rewritten tree into closures (see --closures).
+
+Every node is compiled once into a function(frame) that does what
+node.eval(frame) does. Closures of the children are captured as locals,
+so running the program does not look up eval() methods, and the checks
+eval() does on the shape of the tree (e.g., what is assigned to, how
+many arguments are passed) are done at compile time. Operators cache
+the method of the left operand for its type.
+
+The closure of a function body is installed as eval() of the Block,
+so the body runs compiled whatever calls it (Func.Call, Class.Call,
+methods of modules). Bodies that are not loaded yet (see LazyBlock)
+are loaded and compiled on the first call. Nodes without a compiler
+are run by their own eval().
+"""
+
+from types import FunctionType
+
+from . import interpreter
+from .frame import Frame
+from .interpreter import (
+    FALSE,
+    NONE,
+    TRUE,
+    Add,
+    And,
+    Append,
+    Array,
+    ArrayNode,
+    Assert,
+    Assign,
+    Attr,
+    Block,
+    Bool,
+    Call,
+    Call0,
+    CallObj,
+    CharSepVals,
+    Class,
+    Comma,
+    Eq,
+    ForLoop,
+    Func,
+    GetAttr,
+    Gt,
+    If,
+    IfElse,
+    Import,
+    Int,
+    LazyBlock,
+    Lt,
+    Minus,
+    ModuleFunc,
+    Mul,
+    NewADT,
+    Not,
+    NotEq,
+    Obj,
+    Or,
+    Parens,
+    Print,
+    Ret,
+    ReturnException,
+    SetAttr,
+    Str,
+    StrTemplate,
+    Sub,
+    Subscript,
+    Union,
+    Value,
+    Var,
+    WhileLoop,
+)
+
+compilers = {}  # node class -> function returning the closure
+
+
+def compiles(*classes):
+    """Decorator that registers a compiler for nodes of the classes
+    (and of their subclasses).
+    """
+
+    def decorator(compiler):
+        for cls in classes:
+            compilers[cls] = compiler
+        return compiler
+
+    return decorator
+
+
+def compile_node(node):
+    """Returns function(frame) that evaluates the node."""
+    for cls in type(node).__mro__:
+        compiler = compilers.get(cls)
+        if compiler is not None:
+            return compiler(node)
+    return fallback(node)
+
+
+def fallback(node):
+    try:
+        return node.eval
+    except AttributeError:
+        # fail when it's run, like the tree would
+        def run(frame):
+            return node.eval(frame)
+
+        return run
+
+
+def install(block):
+    """Compile the block and make the closure its eval()."""
+    run = block.__dict__.get("eval")
+    if run is None:
+        run = block.eval = compile_node(block)
+    return run
+
+
+#########
+# NODES #
+#########
+
+
+@compiles(Value)
+def compile_value(node):
+    if type(node).eval not in (Value.eval, Bool.eval):
+        return fallback(node)
+
+    def run(frame):
+        return node
+
+    return run
+
+
+@compiles(Var)
+def compile_var(node):
+    name = node.value
+
+    def run(frame):
+        scope = frame.dict
+        if name in scope:
+            return scope[name]
+        parent = frame.parent
+        while parent is not None:
+            scope = parent.dict
+            if name in scope:
+                return scope[name]
+            parent = parent.parent
+        return frame[name]  # raises KeyError
+
+    return run
+
+
+@compiles(Block)
+def compile_block(node):
+    if isinstance(node, LazyBlock) and not node.loaded:
+        return compile_lazy(node)
+    exprs = [compile_node(expr) for expr in node]
+    if not node.catch_ret:
+        if len(exprs) == 1:
+            return exprs[0]
+
+        def run(frame):
+            r = NONE
+            for expr in exprs:
+                r = expr(frame)
+            return r
+
+    elif len(exprs) == 1:
+        expr = exprs[0]
+
+        def run(frame):
+            try:
+                return expr(frame)
+            except ReturnException as e:
+                return e.args[0]
+
+    else:
+
+        def run(frame):
+            r = NONE
+            try:
+                for expr in exprs:
+                    r = expr(frame)
+            except ReturnException as e:
+                r = e.args[0]
+            return r
+
+    return run
+
+
+def compile_lazy(node):
+    compiled = None
+
+    def run(frame):
+        nonlocal compiled
+        if compiled is None:
+            node.load()
+            compiled = node.eval = compile_block(node)
+        return compiled(frame)
+
+    return run
+
+
+@compiles(Add, Sub, Mul, Eq, NotEq, Gt, Lt, Append)
+def compile_infix(node):
+    methname, sym = node.methname, node.sym
+    left, right = compile_node(node.left), compile_node(node.right)
+    if isinstance(node.left, Value) and hasattr(node.left, methname):
+        # a literal, the method is known at compile time
+        meth = getattr(node.left, methname)
+
+        def run(frame):
+            return meth(right(frame))
+
+        return run
+
+    cached_type = cached_meth = None
+
+    def call(lvalue, rvalue):
+        nonlocal cached_type, cached_meth
+        if type(lvalue) is cached_type:
+            return cached_meth(lvalue, rvalue)
+        try:
+            meth = getattr(lvalue, methname)
+        except AttributeError:
+            raise Exception(
+                "{} does not have {} method, "
+                "operation ({}) not supported".format(lvalue, methname, sym)
+            )
+        func = getattr(type(lvalue), methname, None)
+        if isinstance(func, FunctionType):
+            if methname not in getattr(lvalue, "__dict__", ()):
+                cached_type, cached_meth = type(lvalue), func
+        return meth(rvalue)
+
+    # variables of the current frame are read without calling the closure
+    lname = node.left.value if isinstance(node.left, Var) else None
+    rname = node.right.value if isinstance(node.right, Var) else None
+    int_op = node.int_op
+    if int_op and type(node.right) is Int:
+        literal, rint = node.right, node.right.value
+
+        def run(frame):
+            scope = frame.dict
+            lvalue = scope[lname] if lname in scope else left(frame)
+            if type(lvalue) is Int:
+                return int_op(lvalue.value, rint)
+            return call(lvalue, literal)
+
+    elif int_op:
+
+        def run(frame):
+            scope = frame.dict
+            lvalue = scope[lname] if lname in scope else left(frame)
+            rvalue = scope[rname] if rname in scope else right(frame)
+            if type(lvalue) is Int and type(rvalue) is Int:
+                return int_op(lvalue.value, rvalue.value)
+            return call(lvalue, rvalue)
+
+    else:
+
+        def run(frame):
+            return call(left(frame), right(frame))
+
+    return run
+
+
+@compiles(Assign)
+def compile_assign(node):
+    target = node.left
+    value = compile_node(node.right)
+    if isinstance(target, Var):
+        name = target.value
+
+        def run(frame):
+            result = value(frame)
+            frame.dict[name] = result
+            return result
+
+    elif isinstance(target, Subscript):
+        owner, key = compile_node(target.left), compile_node(target.right)
+
+        def run(frame):
+            result = value(frame)
+            owner(frame).SetItem(key(frame), result)
+            return result
+
+    else:
+        return fallback(node)  # raises the error
+    return run
+
+
+@compiles(And)
+def compile_and(node):
+    left, right = compile_node(node.left), compile_node(node.right)
+
+    def run(frame):
+        if not left(frame).to_bool():
+            return FALSE
+        return right(frame)
+
+    return run
+
+
+@compiles(Or)
+def compile_or(node):
+    left, right = compile_node(node.left), compile_node(node.right)
+
+    def run(frame):
+        value = left(frame)
+        if value.to_bool():
+            return value
+        return right(frame)
+
+    return run
+
+
+@compiles(Not)
+def compile_not(node):
+    arg = compile_node(node.arg)
+
+    def run(frame):
+        if arg(frame).to_bool():
+            return FALSE
+        return TRUE
+
+    return run
+
+
+@compiles(Minus)
+def compile_minus(node):
+    arg = compile_node(node.arg)
+
+    def run(frame):
+        return arg(frame).Minus()
+
+    return run
+
+
+@compiles(Parens)
+def compile_parens(node):
+    return compile_node(node.arg)
+
+
+@compiles(Subscript)
+def compile_subscript(node):
+    left, right = compile_node(node.left), compile_node(node.right)
+
+    def run(frame):
+        return left(frame).GetItem(right(frame))
+
+    return run
+
+
+@compiles(CharSepVals)
+def compile_values(node):
+    cls = type(node)
+    items = [compile_node(e) for e in node]
+
+    def run(frame):
+        return cls(*[item(frame) for item in items], flatten=False)
+
+    return run
+
+
+@compiles(ArrayNode)
+def compile_array(node):
+    items = [compile_node(e) for e in node]
+
+    def run(frame):
+        return Array(*[item(frame) for item in items])
+
+    return run
+
+
+@compiles(StrTemplate)
+def compile_template(node):
+    first = node.chunks[0]
+    parts = list(zip(map(compile_node, node), node.chunks[1:]))
+
+    def run(frame):
+        result = [first]
+        for expr, chunk in parts:
+            result.append(expr(frame).to_str(frame=frame).to_py_str())
+            result.append(chunk)
+        return Str("".join(result))
+
+    return run
+
+
+@compiles(Print)
+def compile_print(node):
+    arg, show = compile_node(node.arg), Print.show
+
+    def run(frame):
+        return show(arg(frame), frame)
+
+    return run
+
+
+@compiles(Ret)
+def compile_ret(node):
+    arg = compile_node(node.arg)
+
+    def run(frame):
+        raise ReturnException(arg(frame))
+
+    return run
+
+
+@compiles(Assert)
+def compile_assert(node):
+    arg = compile_node(node.arg)
+
+    def run(frame):
+        r = arg(frame)
+        if not isinstance(r, Bool):
+            print("warning, asserting on not bool")
+        if not r.to_bool():
+            raise Exception("Assertion failed on %s" % node.arg)
+        return r
+
+    return run
+
+
+#############
+# FUNCTIONS #
+#############
+
+
+@compiles(Func)
+def compile_func(node):
+    install(node.body)
+    return fallback(node)
+
+
+@compiles(Class)
+def compile_class(node):
+    compile_node(node.body)  # installs bodies of the methods
+    return fallback(node)
+
+
+@compiles(Import)
+def compile_import(node):
+    name = node.name
+
+    def run(frame):
+        module = frame[name] = interpreter.import_module(name)
+        install(module.tree)  # and so bodies of its functions
+        return module
+
+    return run
+
+
+def bind(func, values, frame):
+    """Func.Call() without the checks, they are done by the caller."""
+    scope = frame.dict
+    for name, value in zip(func.args, values):
+        scope[name] = value
+    return func.body.eval(frame)
+
+
+@compiles(Call)
+def compile_call(node):
+    if not isinstance(node.right, Comma):
+        return fallback(node)
+    callee = compile_node(node.left)
+    args = [compile_node(arg) for arg in node.right]
+    accepted = (Func, Class, NewADT, Union, ModuleFunc)
+
+    def run(frame):
+        func = callee(frame)
+        if type(func) is Func:
+            values = [arg(frame) for arg in args]
+            if len(values) == len(func.args):
+                return bind(func, values, Frame(frame))
+        else:
+            assert isinstance(func, accepted) or issubclass(
+                func, accepted
+            ), "I can only call functions and classes, got %s (%s) instead" % (
+                func,
+                type(func),
+            )
+            values = [arg(frame) for arg in args]
+        return func.Call(Comma(*values, flatten=False), Frame(frame))
+
+    return run
+
+
+@compiles(Call0)
+def compile_call0(node):
+    arg = compile_node(node.arg)
+
+    def run(frame):
+        newframe = Frame(frame)
+        func = arg(newframe)
+        if hasattr(func, "Call"):
+            return func.Call([], newframe)
+        else:
+            return func(newframe)
+
+    return run
+
+
+@compiles(CallObj)
+def compile_call_obj(node):
+    if not isinstance(node.args, Comma):
+        return fallback(node)
+    obj = compile_node(node.obj)
+    args = [compile_node(arg) for arg in node.args]
+    meth_name = node.meth_name
+    cached_class = cached_func = None
+
+    def method(this):
+        nonlocal cached_class, cached_func
+        if type(this) is Obj and meth_name not in this:
+            # the method of the class, classes do not change
+            if this["Class"] is cached_class:
+                return cached_func
+            func = this.GetAttr(meth_name)
+            cached_class, cached_func = this["Class"], func
+            return func
+        return this.GetAttr(meth_name)
+
+    def run(frame):
+        this = obj(frame)
+        values = [arg(frame) for arg in args]
+        newframe = Frame(frame)
+        newframe.dict["this"] = this
+        func = method(this)
+        if type(func) is Func and len(values) == len(func.args):
+            return bind(func, values, newframe)
+        return func.Call(Comma(*values, flatten=False), newframe)
+
+    return run
+
+
+#####################
+# OBJECT ATTRIBUTES #
+#####################
+
+
+@compiles(GetAttr)
+def compile_get_attr(node):
+    if not isinstance(node.attr_name, str):
+        return fallback(node)
+    obj, name = compile_node(node.obj), node.attr_name
+
+    def run(frame):
+        return obj(frame).GetAttr(name)
+
+    return run
+
+
+@compiles(SetAttr)
+def compile_set_attr(node):
+    if not isinstance(node.attr_name, str):
+        return fallback(node)
+    obj, name = compile_node(node.obj), node.attr_name
+    value = compile_node(node.value)
+
+    def run(frame):
+        owner = obj(frame)
+        owner.SetAttr(name, value(frame))
+
+    return run
+
+
+@compiles(Attr)
+def compile_attr(node):
+    this, name = compile_node(node.left), node.right.value
+
+    def run(frame):
+        return this(frame).GetAttr(name)
+
+    return run
+
+
+################
+# CONTROL FLOW #
+################
+
+
+@compiles(IfElse)
+def compile_ifelse(node):
+    cond = compile_node(node.cond)
+    then, otherwise = compile_node(node.then), compile_node(node.otherwise)
+
+    def run(frame):
+        if cond(frame).to_bool():
+            return then(frame)
+        return otherwise(frame)
+
+    return run
+
+
+@compiles(If)
+def compile_if(node):
+    clause, body = compile_node(node.clause), compile_node(node.body)
+
+    def run(frame):
+        if clause(frame).to_bool():
+            return body(frame)
+
+    return run
+
+
+@compiles(ForLoop)
+def compile_for(node):
+    if not isinstance(node.var, Var):
+        return fallback(node)
+    name = node.var.value
+    expr, body = compile_node(node.expr), compile_node(node.body)
+
+    def run(frame):
+        iterator = expr(frame).Iter()
+        result = NONE
+        newframe = Frame(frame)
+        scope = newframe.dict
+        while True:
+            e = iterator.next()
+            if e is None:
+                break
+            scope[name] = e
+            result = body(newframe)
+        return result
+
+    return run
+
+
+@compiles(WhileLoop)
+def compile_while(node):
+    expr, body = compile_node(node.expr), compile_node(node.body)
+
+    def run(frame):
+        while True:
+            cond = expr(frame)
+            # Bool.__bool__() is slow, check the constants first
+            if cond is not TRUE and (cond is FALSE or not cond):
+                break
+            body(frame)
+
+    return run
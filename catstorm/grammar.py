@@ -1,8 +1,9 @@
 #!/usr/bin/env python3
-from .interpreter import (Case, Class, ForLoop, Func, If, Int, NewADT, StrTPL,
-                          Var, WhileLoop)
-from .peg import ANY, CSV, MAYBE, RE, SOMEOF, SYM, test
-from .pratt import pratt_parse, symap
+from .interpreter import (Case, Class, ForLoop, Func, If, Import, Int, NewADT,
+                          StrTPL, Var, WhileLoop)
+from .peg import ANY, CSV, MAYBE, RE, SOMEOF, SPAN, SYM, analyze, test
+from .peg_compiler import compile_grammar
+from .pratt import pratt_parse1, symap
 
 # BITS AND PIECES
 EOL = RE(r"$")
@@ -18,6 +19,7 @@ SHELLCOMMENT = RE(r"\#.*", "COMMENT")
 CPPCOMMENT = RE(r"//.*", "COMMENT")
 CCOMMENT = RE(r"/\*.*?\*/", "COMMENT")
 COMMENT = SHELLCOMMENT | CCOMMENT | CPPCOMMENT
+SKIP = [SHELLCOMMENT, CCOMMENT, CPPCOMMENT]  # dropped by the lexer
 
 # DATA AND TYPES
 ID = RE(r"[A-Za-z][A-Za-z0-9_]*", "ID")
@@ -53,6 +55,7 @@ LAMBDA = MAKEKW("->", prio=2)
 COLON = opmap.get(":", SYM(":"))
 NEWCLASS = MAKEKW("::class", prio=2)
 NEWADT = MAKEKW("::adt", prio=2)
+NEWIMPORT = MAKEKW("::import", prio=2)
 
 # CLASS STUFF
 CLASS = NEWCLASS + ID
@@ -61,8 +64,11 @@ CLASS = NEWCLASS + ID
 UNION = ID % "name" & MAYBE(CSV(ID, sep=COMMA)) % "members"
 ADT = NEWADT + ID % "name" + ASSIGN + CSV(UNION, sep=PIPE) % "variants"
 
+# MODULES
+IMPORT = NEWIMPORT + ID
+
 # EXPRESSIONS
-EXPR = SOMEOF(OPS, ID / Var, CONST)
+EXPR = SPAN(SOMEOF(OPS, ID, CONST), wrap={ID: Var})
 
 # FUNCTIONS
 FUNC = (
@@ -82,12 +88,17 @@ WHILELOOP = KW("while") + EXPR
 PROG = (
     COMMENT % None
     | FUNC / Func
-    | EXPR / pratt_parse
+    | EXPR / pratt_parse1
     | FORLOOP / ForLoop
     | WHILELOOP / WhileLoop
     | CLASS / Class
     | ADT / NewADT
+    | IMPORT / Import
 )
+analyze(PROG)
+
+# the same as PROG, but compiled into python code
+PARSER = compile_grammar(PROG)
 
 
 if __name__ == "__main__":
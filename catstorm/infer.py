@@ -0,0 +1,476 @@
+#!/usr/bin/env python3
+"""
+Static type inference over the rewritten tree (see load_program and
+--check-types).
+
+Types of the variables of a frame are followed statement by statement
+(loops are iterated until the types don't change). A frame changes
+only its own variables, so a variable the function assigned keeps the
+type it was given, but variables it did not assign are read from the
+frames of the callers (dynamic scoping) and their types are unknown,
+as are the arguments. Top-level functions and classes that are never
+bound again anywhere in the program are known everywhere.
+
+Types are Int, Str, Bool, Array, NONE, ("func", Func), ("class", Class),
+("obj", Class) or ANY (unknown).
+
+Where the types are proven, the nodes get annotations (attributes that
+are not fields, so they are cached with the tree) and the interpreter
+uses them when it specializes the nodes (see interpreter.quicken):
+"static" -- Int operation on two Ints,
+"callee" -- the Func the Call calls, arguments are bound without checks,
+"method", "cls" -- the Func the CallObj calls and the class of the object
+(the method is never shadowed by an attribute).
+The inference assumes it sees the whole program: a name bound once at
+the top level keeps its value and a variable keeps its type between
+assignments. Names bound by other modules or by frames of callers
+(scoping is dynamic) break that, so the specialized nodes still check
+the callee, the class or the types and deoptimize when the check fails.
+Nodes that are not proven are evaluated as before. Operations that
+are certain to fail are reported (see infer()).
+"""
+
+from .interpreter import (
+    FALSE,
+    NONE,
+    TRUE,
+    Add,
+    And,
+    Append,
+    ArrayNode,
+    Assert,
+    Assign,
+    Attr,
+    Bool,
+    Call,
+    Call0,
+    CallObj,
+    Class,
+    Comma,
+    Eq,
+    ForLoop,
+    Func,
+    GetAttr,
+    Gt,
+    If,
+    IfElse,
+    Import,
+    Int,
+    LazyBlock,
+    Lt,
+    Match,
+    Minus,
+    Mul,
+    NewADT,
+    Not,
+    NotEq,
+    Or,
+    Parens,
+    Print,
+    Ret,
+    SetAttr,
+    Str,
+    StrTemplate,
+    StrTPL,
+    Sub,
+    Subscript,
+    Var,
+    WhileLoop,
+)
+from .syntax_tree import BaseNode
+
+ANY = None
+INT, STR, BOOL, ARRAY, NONE_TYPE = "Int", "Str", "Bool", "Array", "NONE"
+
+INFIX = [Add, Sub, Mul, Eq, NotEq, Gt, Lt]
+SAMPLES = {INT: Int(2), STR: Str("a"), BOOL: TRUE}
+CONSTANTS = {id(TRUE): BOOL, id(FALSE): BOOL, id(NONE): NONE_TYPE}
+
+
+def operations():
+    """(operator, type, type) -> type of the result or None if the
+    operation fails, found by doing them on sample values.
+    """
+    names = {Int: INT, Str: STR, Bool: BOOL}
+    table = {}
+    for op in INFIX:
+        for left, lvalue in SAMPLES.items():
+            for right, rvalue in SAMPLES.items():
+                try:
+                    result = getattr(lvalue, op.methname)(rvalue)
+                except Exception:
+                    result = None
+                table[op, left, right] = names.get(type(result), ANY)
+    return table
+
+
+OPERATIONS = operations()
+
+
+def walk(node):
+    """All nodes of the tree."""
+    yield node
+    if isinstance(node, (BaseNode, list, tuple)):
+        for child in node:
+            yield from walk(child)
+
+
+def join(a, b):
+    return a if a == b else ANY
+
+
+def merge(env, other):
+    """Types after either of the paths (other goes to env)."""
+    for name in set(env) | set(other):
+        env[name] = join(env.get(name, ANY), other.get(name, ANY))
+
+
+def type_name(t):
+    if isinstance(t, tuple):
+        kind, node = t
+        return {"func": "function", "class": "class", "obj": "instance of"}[kind] + (
+            " %s" % node.name
+        )
+    return t
+
+
+class Inference:
+    """Infers types of the tree, issues -- list of (lineno, message)."""
+
+    def __init__(self, tree):
+        self.issues = []
+        self.lineno = None
+        self.annotating = True
+        self.done = set()
+        self.todo = []
+        self.scan(tree)
+
+    def scan(self, tree):
+        """Find what's bound in the whole program."""
+        counts = {}
+        self.attrs = set()  # names of attributes set anywhere
+        self.whole = True  # the whole program is in the tree
+
+        def bind(name, n=2):
+            counts[name] = counts.get(name, 0) + n
+
+        for node in walk(tree):
+            if isinstance(node, Assign) and isinstance(node.left, Var):
+                bind(node.left.value)
+            elif isinstance(node, (Func, Class)):
+                bind(node.name, 1)
+                for arg in getattr(node, "args", []):
+                    bind(arg)
+            elif isinstance(node, ForLoop):
+                for var in walk(node.var):
+                    if isinstance(var, Var):
+                        bind(var.value)
+            elif isinstance(node, Match):
+                for var in walk(node):
+                    if isinstance(var, Var):
+                        bind(var.value)
+            elif isinstance(node, NewADT):
+                for variant in node.variants:
+                    bind(variant.tag)
+            elif isinstance(node, SetAttr):
+                self.attrs.add(node.attr_name)
+            if isinstance(node, Import) or (
+                isinstance(node, LazyBlock) and not node.loaded
+            ):
+                self.whole = False
+        # functions and classes defined once at the top level
+        self.globals = {}
+        if self.whole:
+            for node in tree:
+                if isinstance(node, Func) and counts[node.name] == 1:
+                    self.globals[node.name] = ("func", node)
+                elif isinstance(node, Class) and counts[node.name] == 1:
+                    self.globals[node.name] = ("class", node)
+
+    def report(self, message):
+        if self.annotating:
+            self.issues.append((self.lineno, message))
+
+    def annotate(self, node, **state):
+        if self.annotating:
+            node.__dict__.update(state)
+
+    def run(self, tree):
+        self.block(tree, {})
+        while self.todo:
+            func = self.todo.pop(0)
+            if isinstance(func.body, LazyBlock) and not func.body.loaded:
+                continue
+            self.lineno = getattr(func, "lineno", None) or self.lineno
+            self.block(func.body, {name: ANY for name in func.args})
+        return self.issues
+
+    def define(self, node):
+        """Queue analysis of the function or methods of the class."""
+        if id(node) in self.done:
+            return
+        self.done.add(id(node))
+        if isinstance(node, Func):
+            self.todo.append(node)
+        else:
+            for member in node.body:
+                if isinstance(member, Func):
+                    self.define(member)
+
+    # statements
+
+    def block(self, block, env):
+        result = ANY
+        for node in block:
+            self.lineno = getattr(node, "lineno", None) or self.lineno
+            result = self.expr(node, env)
+        return result
+
+    def loop(self, env, body):
+        """Iterate body(env) until the types don't change, then once more
+        to annotate the nodes with the final types.
+        """
+        annotating, self.annotating = self.annotating, False
+        while True:
+            before = dict(env)
+            after = dict(env)
+            body(after)
+            merge(env, after)
+            if env == before:
+                break
+        self.annotating = annotating
+        body(dict(env))
+
+    def while_loop(self, node, env):
+        def body(env):
+            self.expr(node.expr, env)
+            self.block(node.body, env)
+
+        self.loop(env, body)
+        return ANY
+
+    def for_loop(self, node, env):
+        seq = self.expr(node.expr, env)
+        # the body runs in a new frame, it starts with the values of env
+        frame = dict(env)
+
+        def body(frame):
+            for var in walk(node.var):
+                if isinstance(var, Var):
+                    frame[var.value] = STR if seq == STR else ANY
+            self.block(node.body, frame)
+
+        self.loop(frame, body)
+        return ANY
+
+    # expressions
+
+    def expr(self, node, env):
+        """Type of the node, env (name -> type) is updated."""
+        cls = type(node)
+        if id(node) in CONSTANTS:
+            return CONSTANTS[id(node)]
+        if cls is Int:
+            return INT
+        if cls is Str or cls is StrTPL:
+            return STR
+        if cls is Var:
+            if node.value in env:
+                return env[node.value]
+            return self.globals.get(node.value, ANY)
+        if cls in INFIX:
+            return self.infix(node, env)
+        if cls is Assign and isinstance(node.left, Var):
+            env[node.left.value] = self.expr(node.right, env)
+            return env[node.left.value]
+        if cls is Parens:
+            return self.expr(node.arg, env)
+        if cls is StrTemplate:
+            for child in node:
+                self.expr(child, env)
+            return STR
+        if cls is ArrayNode:
+            for child in node:
+                self.expr(child, env)
+            return ARRAY
+        if cls is Append:
+            left = self.expr(node.left, env)
+            self.expr(node.right, env)
+            return ARRAY if left == ARRAY else ANY
+        if cls is Not:
+            self.expr(node.arg, env)
+            return BOOL
+        if cls is And or cls is Or:
+            left = self.expr(node.left, env)
+            branch = dict(env)
+            right = self.expr(node.right, branch)
+            merge(env, branch)
+            return join(BOOL if cls is And else left, right)
+        if cls is Minus:
+            arg = self.expr(node.arg, env)
+            if arg in (STR, BOOL):
+                self.report("%s does not support unary minus" % arg)
+            return INT if arg == INT else ANY
+        if cls is IfElse:
+            self.expr(node.cond, env)
+            then, otherwise = dict(env), dict(env)
+            result = join(
+                self.expr(node.then, then), self.expr(node.otherwise, otherwise)
+            )
+            merge(then, otherwise)
+            env.update(then)
+            return result
+        if cls is If:
+            self.expr(node.clause, env)
+            branch = dict(env)
+            self.block(node.body, branch)
+            merge(env, branch)
+            return ANY
+        if cls is WhileLoop:
+            return self.while_loop(node, env)
+        if cls is ForLoop:
+            return self.for_loop(node, env)
+        if cls is Subscript:
+            left, right = self.expr(node.left, env), self.expr(node.right, env)
+            return STR if left == STR and right == INT else ANY
+        if cls is Print:
+            return self.expr(node.arg, env)
+        if cls is Assert:
+            return self.expr(node.arg, env)
+        if cls is Ret:
+            self.expr(node.arg, env)
+            return ANY
+        if cls is Func or cls is Class:
+            self.define(node)
+            env[node.name] = ("func" if cls is Func else "class", node)
+            return env[node.name]
+        if cls is Call:
+            return self.call(node, env)
+        if cls is Call0:
+            # the callee is evaluated in the frame of the call
+            return self.apply(node, self.expr(node.arg, dict(env)), [])
+        if cls is CallObj:
+            return self.call_method(node, env)
+        if cls is GetAttr:
+            self.member(self.expr(node.obj, env), node.attr_name)
+            return ANY
+        if cls is Attr:
+            self.member(self.expr(node.left, env), node.right.value)
+            return ANY
+        if cls is SetAttr:
+            self.expr(node.obj, env)
+            self.expr(node.value, env)
+            return ANY
+        if cls is Import:
+            env[node.name] = ANY
+            return ANY
+        return self.unknown(node, env)
+
+    def unknown(self, node, env):
+        """Node the inference does not know: variables it mentions may be
+        bound by it (e.g., patterns of match), their types become unknown.
+        """
+        for child in node if isinstance(node, (BaseNode, list)) else []:
+            if isinstance(child, BaseNode):
+                self.expr(child, env)
+        for child in walk(node):
+            if isinstance(child, Var):
+                env[child.value] = ANY
+        return ANY
+
+    def infix(self, node, env):
+        left, right = self.expr(node.left, env), self.expr(node.right, env)
+        if left in SAMPLES and right in SAMPLES:
+            result = OPERATIONS[type(node), left, right]
+            if result is ANY:
+                self.report("unsupported operation %s %s %s" % (left, node.sym, right))
+            elif left == right == INT:
+                self.annotate(node, static=True)
+            return result
+        if type(node) in (Eq, NotEq):
+            return BOOL if left in SAMPLES or left == ARRAY else ANY
+        return ANY
+
+    def call(self, node, env):
+        callee = self.expr(node.left, env)
+        args = list(node.right) if isinstance(node.right, Comma) else [node.right]
+        types = [self.expr(arg, env) for arg in args]
+        result = self.apply(node, callee, types)
+        if (
+            isinstance(node.left, Var)
+            and isinstance(callee, tuple)
+            and callee[0] == "func"
+            and len(callee[1].args) == len(args)
+        ):
+            self.annotate(node, callee=callee[1])
+        return result
+
+    def apply(self, node, callee, types):
+        """Type of the result of the call, types -- types of the arguments
+        (one argument of unknown type may be spread if it's a Comma).
+        """
+        if callee in SAMPLES or callee in (ARRAY, NONE_TYPE):
+            self.report("%s can't be called" % callee)
+            return ANY
+        if not isinstance(callee, tuple):
+            return ANY
+        kind, definition = callee
+        if kind == "func":
+            self.arity(definition, types)
+            return ANY
+        if kind == "class":
+            for member in definition.body:
+                if isinstance(member, Func) and member.name == "New":
+                    self.arity(member, types)
+                    break
+            else:
+                self.report("class %s has no New method" % definition.name)
+            return ("obj", definition)
+        self.report("%s can't be called" % type_name(callee))
+        return ANY
+
+    def arity(self, func, types):
+        if len(types) == len(func.args):
+            return
+        if len(types) == 1 and types[0] not in SAMPLES:
+            return  # may be a Comma
+        self.report(
+            "%s takes %d arguments, got %d" % (func.name, len(func.args), len(types))
+        )
+
+    def member(self, obj, name):
+        """Method of the class of obj (if it's known)."""
+        if not (isinstance(obj, tuple) and obj[0] == "obj"):
+            return None
+        for member in obj[1].body:
+            if isinstance(member, Func) and member.name == name:
+                return member
+        if self.whole and name not in self.attrs:
+            self.report('class %s has no member "%s"' % (obj[1].name, name))
+        return None
+
+    def call_method(self, node, env):
+        obj = self.expr(node.obj, env)
+        args = list(node.args) if isinstance(node.args, Comma) else [node.args]
+        types = [self.expr(arg, env) for arg in args]
+        method = self.member(obj, node.meth_name)
+        if method is None:
+            return ANY
+        self.arity(method, types)
+        proven = (
+            self.whole
+            and node.meth_name not in self.attrs
+            and isinstance(node.args, Comma)
+            and len(node.args) == len(method.args)
+        )
+        if proven:
+            self.annotate(node, method=method, cls=obj[1])
+        return ANY
+
+
+def infer(tree):
+    """Infer types in the tree and annotate its nodes.
+    Returns messages ("line N: ...") about operations that would fail.
+    """
+    issues = Inference(tree).run(tree)
+    return ["line %s: %s" % (lineno or "?", message) for lineno, message in issues]
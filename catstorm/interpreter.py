@@ -1,6 +1,7 @@
 import re
 from itertools import chain, repeat
 
+from .frame import Frame
 from .log import Log
 from .pratt import (
     brackets,
@@ -36,6 +37,41 @@ class NoAttr(Exception):
     """When class or object doesn't have the attr."""
 
 
+# Nodes of operators, GetAttr and CallObj rewrite themselves in place
+# (node.__class__ = variant) into variants specialized for the types
+# they see when they are evaluated, e.g. Int + Int or a method of the
+# class cached in the node. A variant checks the types (guard) and
+# turns the node back into the generic one when they change, a node
+# that had to go back QUICKEN_LIMIT times stays generic (Megamorphic).
+quicken = True  # disabled by --no-quicken
+QUICKEN_LIMIT = 4
+
+
+def variant(generic, name, cls):
+    """Make cls a variant of the generic node class (generic.name)."""
+    cls.__name__ = generic.__name__
+    cls.__qualname__ = "%s.%s" % (generic.__qualname__, name)
+    cls.generic = generic
+    setattr(generic, name, cls)
+    return cls
+
+
+def become(node, new_class, **state):
+    """Rewrite the node in place into new_class, state goes to its attributes
+    (Node.__setattr__ accepts only fields).
+    """
+    node.__dict__.update(state)
+    object.__setattr__(node, "__class__", new_class)
+
+
+def deoptimize(node):
+    """Guard of the variant failed, makes the node generic again."""
+    misses = node.__dict__.get("misses", 0) + 1
+    generic = node.generic
+    become(node, generic if misses < QUICKEN_LIMIT else generic.Megamorphic)
+    node.__dict__["misses"] = misses
+
+
 ##############
 # DATA TYPES #
 ##############
@@ -184,6 +220,13 @@ class Int(Value):
         return self.value
 
 
+def new_int(value):
+    """Int(value) for python ints, without the checks of Int.__init__()."""
+    obj = Int.__new__(Int)
+    obj.value = value
+    return obj
+
+
 class Str(Value):
     def GetItem(self, attr):
         if isinstance(attr, Int):
@@ -232,23 +275,51 @@ class StrTPL(Value):
         self.value = str(value)  # TODO: do we need this?
 
     def eval(self, frame):
+        return self.compile().eval(frame)
+
+    def compile(self, rewrite=None):
+        """Parse the expressions in {}, returns StrTemplate.
+        rewrite -- function to apply to the parsed expressions.
+        """
         # TODO: cannot import from top level due to circual dependences
-        from .grammar import PROG
+        from .grammar import PARSER
         from .peg import tokenize
 
-        # perform string expansion
         string = self.value
-        expressions = re.findall("\{(.+?)\}", string, re.M)
-        for rawexpr in expressions:
-            tokens = tokenize(rawexpr)
-            expr, r = PROG.match(tokens)  # TODO: perform rewrite
-            result = expr.eval(frame)
-            as_str = result.to_str(frame=frame).to_py_str()
-            string = string.replace("{%s}" % rawexpr, as_str)
+        chunks, exprs = [], []
+        pos = 0
+        for match in re.finditer(r"\{(.+?)\}", string):
+            chunks.append(self.unescape(string[pos : match.start()]))
+            expr, r = PARSER.match(tokenize(match.group(1)))
+            exprs.append(rewrite(expr) if rewrite else expr)
+            pos = match.end()
+        chunks.append(self.unescape(string[pos:]))
+        return StrTemplate(*exprs, chunks=chunks)
+
+    def unescape(self, string):
         # replace special symbols
         for k, v in self.replace.items():
             string = string.replace(k, v)
-        return Str(string)
+        return string
+
+
+class StrTemplate(ListNode):
+    """String with expressions, made by StrTPL.compile().
+    chunks -- literal parts of the string, one more than expressions.
+    """
+
+    def __init__(self, *exprs, chunks=()):
+        super().__init__(*exprs)
+        self.chunks = list(chunks)
+
+    def eval(self, frame):
+        chunks = self.chunks
+        parts = [chunks[0]]
+        for expr, chunk in zip(self, chunks[1:]):
+            result = expr.eval(frame)
+            parts.append(result.to_str(frame=frame).to_py_str())
+            parts.append(chunk)
+        return Str("".join(parts))
 
 
 class Iter(CallPython):
@@ -365,7 +436,10 @@ class Ret(Unary):
 @prefix("p ", 0)
 class Print(Unary):
     def eval(self, frame):
-        value = self.arg.eval(frame)
+        return self.show(self.arg.eval(frame), frame)
+
+    @staticmethod
+    def show(value, frame):
         assert not isinstance(
             value, str
         ), "got instance of str, but it should be interpreter.Str"
@@ -382,7 +456,9 @@ class Print(Unary):
         return value
 
 
-def newinfix(sym, prio, methname, sametype=True, right=False):
+def newinfix(sym, prio, methname, sametype=True, right=False, int_op=None):
+    """int_op(a, b) -> Int or Bool, the operation on values of Ints."""
+
     class Infix(Binary):
         def eval(self, frame):
             left = self.left.eval(frame)
@@ -393,6 +469,9 @@ def newinfix(sym, prio, methname, sametype=True, right=False):
             #     "Left and right operands of ({} {} {}) must have same type.\n" \
             #     "(Or latter is subclass of former). Got {} and {}." \
             #     .format(left, sym, right, type(left), type(right))
+            return self.apply(left, right)
+
+        def apply(self, left, right):
             try:
                 meth = getattr(left, methname)
             except AttributeError:
@@ -400,22 +479,100 @@ def newinfix(sym, prio, methname, sametype=True, right=False):
                     "{} does not have {} method, "
                     "operation ({}) not supported".format(left, methname, sym)
                 )
+            if quicken:
+                self.specialize(left, right)
             return meth(right)
 
+        def specialize(self, left, right):
+            cls = type(left)
+            # "static" -- infer.py found Ints, the guard of Infix.Int stays
+            # for what it does not see (e.g. names bound by other modules)
+            if int_op and ("static" in self.__dict__ or cls is Int is type(right)):
+                become(self, Infix.Int)
+            elif hasattr(cls, methname):
+                become(self, Infix.Typed, cls=cls, meth=getattr(cls, methname))
+            else:
+                become(self, Infix.Megamorphic)
+
+    class Megamorphic(Infix):
+        def specialize(self, left, right):
+            pass
+
+    class Typed(Infix):
+        """The left operand has type self.cls, self.meth is its method."""
+
+        def eval(self, frame):
+            left = self.left.eval(frame)
+            right = self.right.eval(frame)
+            if type(left) is self.cls:
+                return self.meth(left, right)
+            deoptimize(self)
+            return self.apply(left, right)
+
+    class IntInfix(Infix):
+        def eval(self, frame):
+            left = self.left.eval(frame)
+            right = self.right.eval(frame)
+            if type(left) is Int and type(right) is Int:
+                return int_op(left.value, right.value)
+            self.__dict__.pop("static", None)  # infer.py was wrong
+            deoptimize(self)
+            return self.apply(left, right)
+
+    Infix.sym = sym
+    Infix.methname = methname
+    Infix.int_op = staticmethod(int_op) if int_op else None
     func = infix_r if right else infix
     Infix = func(sym, prio)(Infix)
     Infix.__name__ = Infix.__qualname__ = methname
+    variant(Infix, "Megamorphic", Megamorphic)
+    variant(Infix, "Typed", Typed)
+    if int_op:
+        variant(Infix, "Int", IntInfix)
     return Infix
 
 
-newinfix("+", 20, "Add")
-newinfix("-", 20, "Sub")
-newinfix("*", 30, "Mul")
-newinfix("==", 4, "Eq")
-newinfix("!=", 4, "NotEq")
-newinfix(">", 3, "Gt")
-newinfix("<", 3, "Lt")
-newinfix("<<<", 3, "Append", sametype=False)
+# what the operators do with the values of two Ints, the backends
+# (closures.py, vm.py, runtime.py) use them through Infix.int_op
+
+
+def int_add(a, b):
+    return new_int(a + b)
+
+
+def int_sub(a, b):
+    return new_int(a - b)
+
+
+def int_mul(a, b):
+    return new_int(a * b)
+
+
+def int_eq(a, b):
+    return TRUE if a == b else FALSE
+
+
+def int_ne(a, b):
+    return TRUE if a != b else FALSE
+
+
+def int_gt(a, b):
+    return TRUE if a > b else FALSE
+
+
+def int_lt(a, b):
+    return TRUE if a < b else FALSE
+
+
+# assigned to names of the module, so the nodes can be pickled
+Add = newinfix("+", 20, "Add", int_op=int_add)
+Sub = newinfix("-", 20, "Sub", int_op=int_sub)
+Mul = newinfix("*", 30, "Mul", int_op=int_mul)
+Eq = newinfix("==", 4, "Eq", int_op=int_eq)
+NotEq = newinfix("!=", 4, "NotEq", int_op=int_ne)
+Gt = newinfix(">", 3, "Gt", int_op=int_gt)
+Lt = newinfix("<", 3, "Lt", int_op=int_lt)
+Append = newinfix("<<<", 3, "Append", sametype=False)
 
 
 @infix_r("=", 2)
@@ -599,8 +756,11 @@ def call_r(left, right):
 @infix_r(" . ", 5)
 class Call(Binary):
     def eval(self, frame):
+        if quicken and "callee" in self.__dict__:
+            become(self, KnownCall)
+            return self.eval(frame)
         callee = self.left.eval(frame)
-        accepted = (Func, Class, NewADT, Union)
+        accepted = (Func, Class, NewADT, Union, ModuleFunc)
         assert isinstance(callee, accepted) or issubclass(
             callee, accepted
         ), "I can only call functions and classes, got %s (%s) instead" % (
@@ -619,6 +779,36 @@ class Call(Binary):
         raise NoMatch
 
 
+class KnownCall(Call):
+    """Call of self.callee, the function and the number of arguments are
+    proven by infer.py, so the arguments are bound without the checks.
+    """
+
+    def eval(self, frame):
+        func = self.left.eval(frame)
+        if func is not self.callee:  # the name is bound by another module
+            del self.__dict__["callee"]
+            become(self, Call)
+            return self.eval(frame)
+        right = self.right
+        if type(right) is Comma:
+            args = [arg.eval(frame) for arg in right]
+        else:
+            args = right.eval(frame)
+            if type(args) is not Comma:
+                args = [args]
+        with frame as newframe:
+            if len(args) != len(func.args):
+                return func.Call(args, newframe)  # fails
+            scope = newframe.dict
+            for name, value in zip(func.args, args):
+                scope[name] = value
+            return func.body.eval(newframe)
+
+
+variant(Call, "Known", KnownCall)
+
+
 #######
 # ADT #
 #######
@@ -638,6 +828,11 @@ class NewADT(Node):
 
             self.variants.append(NewUnion)
 
+    def __reduce__(self):
+        # the variants are classes local to __init__, so rebuild them on load
+        variants = [{"name": U.tag, "members": U.members} for U in self.variants]
+        return NewADT, (self.name, variants)
+
     def eval(self, frame):
         for Union in self.variants:
             frame[Union.tag] = Union
@@ -678,8 +873,10 @@ class Func(Node):
     def __init__(self, name, args, body=[]):
         self.name = name
         self.args = args if args else []
-        log.func.debug("pratt_parse on %s" % body)
-        if body:
+        if lazy_loader:
+            self.body = LazyBlock(body)
+        elif body:
+            log.func.debug("pratt_parse on %s" % body)
             self.body = Block(pratt_parse1(body))
         else:
             self.body = Block()
@@ -726,6 +923,35 @@ class Block(ListNode):
         return r
 
 
+# function that parses LazyBlock, lazy loading is disabled when it's None
+lazy_loader = None
+
+
+class LazyBlock(Block):
+    """Function body that is parsed on the first call.
+
+    span -- tokens of the expression that follows "->" (if any),
+    lines -- tokenized lines of the indented body (see storm.parse).
+    """
+
+    def __init__(self, span=None):
+        super().__init__()
+        self.span = span
+        self.lines = []
+        self.loaded = False
+
+    def load(self):
+        if not self.loaded:
+            self.loaded = True
+            lazy_loader(self)
+        return self
+
+    def eval(self, frame):
+        if not self.loaded:
+            self.load()
+        return super().eval(frame)
+
+
 #######################
 # CLASSES AND OBJECTS #
 #######################
@@ -743,6 +969,10 @@ class Class(Node):
         self.body = Block()
         classes[name] = self
 
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        classes[self.name] = self
+
     def eval(self, frame):
         frame[self.name] = self
         return self
@@ -826,9 +1056,48 @@ class GetAttr(Node):
         obj = self.obj.eval(frame)
         attr_name = self.attr_name
         assert isinstance(attr_name, str)
+        if quicken:
+            specialize_attr(self, obj, attr_name)
         return obj.GetAttr(attr_name)
 
 
+def specialize_attr(node, obj, name):
+    """Cache the member of the class of obj in the node (GetAttr, CallObj)."""
+    if type(obj) is Obj:
+        cls = obj["Class"]
+        member = None
+        if name not in obj:
+            member = cls[name]  # raises if there is no such member
+        become(node, node.Cached, cls=cls, member=member)
+    else:
+        become(node, node.Megamorphic)
+
+
+class CachedAttr(GetAttr):
+    """obj is an instance of self.cls, self.member is its member (None if
+    it's an attribute of the object).
+    """
+
+    def eval(self, frame):
+        obj = self.obj.eval(frame)
+        if type(obj) is Obj and obj["Class"] is self.cls:
+            if self.attr_name in obj:
+                return obj[self.attr_name]
+            if self.member is not None:
+                return self.member
+        deoptimize(self)
+        return obj.GetAttr(self.attr_name)
+
+
+class MegamorphicAttr(GetAttr):
+    def eval(self, frame):
+        return self.obj.eval(frame).GetAttr(self.attr_name)
+
+
+variant(GetAttr, "Cached", CachedAttr)
+variant(GetAttr, "Megamorphic", MegamorphicAttr)
+
+
 class SetAttr(Node):
     fields = ["obj", "attr_name", "value"]
 
@@ -844,14 +1113,77 @@ class CallObj(Node):
     fields = ["obj", "meth_name", "args"]
 
     def eval(self, frame):
+        if quicken and "method" in self.__dict__:
+            become(self, self.Known)
+            return self.eval(frame)
         this = self.obj.eval(frame)
         args = self.args.eval(frame)
         with frame as newframe:
             newframe["this"] = this
+            if quicken:
+                specialize_attr(self, this, self.meth_name)
             callee = this.GetAttr(self.meth_name)
             return callee.Call(args, newframe)
 
 
+class CachedCallObj(CallObj):
+    """Call of the method self.member of self.cls (see CachedAttr)."""
+
+    def eval(self, frame):
+        this = self.obj.eval(frame)
+        args = self.args.eval(frame)
+        with frame as newframe:
+            newframe["this"] = this
+            callee = None
+            if type(this) is Obj and this["Class"] is self.cls:
+                name = self.meth_name
+                callee = this[name] if name in this else self.member
+            if callee is None:
+                deoptimize(self)
+                callee = this.GetAttr(self.meth_name)
+            return callee.Call(args, newframe)
+
+
+class MegamorphicCallObj(CallObj):
+    def eval(self, frame):
+        this = self.obj.eval(frame)
+        args = self.args.eval(frame)
+        with frame as newframe:
+            newframe["this"] = this
+            callee = this.GetAttr(self.meth_name)
+            return callee.Call(args, newframe)
+
+
+class KnownCallObj(CallObj):
+    """Call of self.method of self.cls, the class of the object and the
+    number of arguments are proven by infer.py. The class is checked anyway,
+    the object may come from code infer.py did not see.
+    """
+
+    def eval(self, frame):
+        this = self.obj.eval(frame)
+        args = [arg.eval(frame) for arg in self.args]
+        name = self.meth_name
+        if type(this) is not Obj or this["Class"] is not self.cls or name in this:
+            del self.__dict__["method"]
+            deoptimize(self)
+            with frame as newframe:
+                newframe["this"] = this
+                return this.GetAttr(name).Call(args, newframe)
+        method = self.method
+        with frame as newframe:
+            scope = newframe.dict
+            scope["this"] = this
+            for name, value in zip(method.args, args):
+                scope[name] = value
+            return method.body.eval(newframe)
+
+
+variant(CallObj, "Known", KnownCallObj)
+variant(CallObj, "Cached", CachedCallObj)
+variant(CallObj, "Megamorphic", MegamorphicCallObj)
+
+
 @prefix("@", 6)
 class This(Unary):
     # TODO: absolete method after tree rewrite.
@@ -879,6 +1211,86 @@ class Attr(Binary):
         return attr
 
 
+###########
+# MODULES #
+###########
+
+# function that finds and parses a module by name, returns Block
+# (see storm.load_module)
+module_loader = None
+modules = {}  # modules imported by the process
+
+
+def import_module(name):
+    try:
+        return modules[name]
+    except KeyError:
+        pass
+    module = modules[name] = Module(name, module_loader(name))
+    return module
+
+
+class Import(Node):
+    """::import name -- bind the module to the name."""
+
+    fields = ["name"]
+
+    def eval(self, frame):
+        module = frame[self.name] = import_module(self.name)
+        return module
+
+
+class Module:
+    """Imported module. Its definitions are put into the namespace
+    when an attribute is accessed for the first time.
+    """
+
+    definitions = (Func, Class, NewADT, Import)
+
+    def __init__(self, name, tree):
+        self.name = name
+        self.tree = tree
+        self.frame = None
+
+    @property
+    def namespace(self):
+        if self.frame is None:
+            self.frame = Frame()
+            for node in self.tree:
+                if isinstance(node, self.definitions):
+                    node.eval(self.frame)
+        return self.frame
+
+    def GetAttr(self, name):
+        if isinstance(name, Str):
+            name = name.to_py_str()
+        value = self.namespace[name]
+        if isinstance(value, Func):
+            return ModuleFunc(value, self)
+        return value
+
+    def to_str(self, frame=None):
+        return Str("<module %s>" % self.name)
+
+    def __repr__(self):
+        return "<module %s>" % self.name
+
+
+class ModuleFunc:
+    """Function of a module, it is called in the namespace of the module."""
+
+    def __init__(self, func, module):
+        self.func = func
+        self.module = module
+
+    def Call(self, args, frame):
+        with self.module.namespace as newframe:
+            return self.func.Call(args, newframe)
+
+    def to_str(self, frame=None):
+        return Str("<func %s@%s>" % (self.module.name, self.func.name))
+
+
 ################
 # CONTROL FLOW #
 ################
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Streaming lexer for whole source files.
+
+The block structure is encoded in the token stream, like in python:
+an INDENT token opens a nested block, DEDENT closes it and every
+logical line is terminated with NEWLINE. Lines ending with "\\"
+are joined with the following line.
+
+Tokens are produced one logical line at a time (each line is a
+separate peg.Tokens buffer), so memory use does not depend on
+the size of the input.
+"""
+
+import mmap
+
+from .peg import TAG, NoMatch, Tokens, get_tokenizer
+
+INDENT = TAG("INDENT")
+DEDENT = TAG("DEDENT")
+NEWLINE = TAG("NEWLINE")
+
+
+def lex(lines, skip=(), lineno=1):
+    """Tokenize an iterable of physical lines.
+    skip -- symbols (e.g., comments) to be left out of the stream,
+    lineno -- number of the first line.
+    Yields peg.Tokens: optional DEDENTs/INDENT, then tokens of the line,
+    then NEWLINE. Pending DEDENTs are flushed at the end of input.
+    """
+    tokenizer = get_tokenizer()
+    skip = {sym.id for sym in skip}
+    levels = [0]
+    for lineno, line in _logical_lines(lines, lineno):
+        end = len(line)
+        pos = end - len(line.lstrip())
+        if pos == end:  # blank line
+            continue
+        tokens = Tokens(line, lineno=lineno)
+        try:
+            tokenizer.scan(line, pos, end, tokens, skip)
+        except NoMatch as err:
+            raise NoMatch("line %s: %s" % (lineno, err))
+        if not len(tokens):  # only comments
+            continue
+
+        # encode indentation
+        head = Tokens(line, lineno=lineno)
+        if pos > levels[-1]:
+            levels.append(pos)
+            head.append(INDENT.id, 0, pos)
+        while pos < levels[-1]:
+            levels.pop()
+            head.append(DEDENT.id, pos, pos)
+        # A dedent to a level that is not on the stack keeps
+        # the line in the enclosing block (like the old line-based indent parser did).
+        if len(head):
+            head.tags.extend(tokens.tags)
+            head.starts.extend(tokens.starts)
+            head.ends.extend(tokens.ends)
+            tokens = head
+        tokens.append(NEWLINE.id, end, end)
+        yield tokens
+
+    if len(levels) > 1:
+        tokens = Tokens("")
+        for _ in levels[1:]:
+            tokens.append(DEDENT.id, 0, 0)
+        yield tokens
+
+
+def lex_text(text, skip=()):
+    return lex(text.splitlines(), skip=skip)
+
+
+def lex_file(path, skip=()):
+    """Like lex(), but reads lines from a memory-mapped file."""
+    with open(path, "rb") as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty files cannot be mapped
+            return
+        with mm:
+            lines = (line.decode() for line in iter(mm.readline, b""))
+            yield from lex(lines, skip=skip)
+
+
+def is_blank(line, skip=()):
+    """True if there are no tokens in the line except the skipped ones."""
+    line = line.strip().rstrip("\\")
+    tokens = Tokens(line)
+    try:
+        get_tokenizer().scan(line, 0, len(line), tokens, {sym.id for sym in skip})
+    except NoMatch:
+        return False
+    return not len(tokens)
+
+
+def _logical_lines(lines, start=1):
+    """Join lines ending with backslash, strip trailing whitespace.
+    Yields (lineno, line) where lineno is the number of the first
+    physical line.
+    """
+    buf = ""
+    first = None
+    for lineno, line in enumerate(lines, start=start):
+        line = line.rstrip("\r\n")
+        if line.endswith("\\"):
+            if not buf:
+                first = lineno
+            buf += line.strip("\\")
+            continue
+        if buf:
+            yield first, (buf + line).rstrip()
+            buf = ""
+            continue
+        yield lineno, line.rstrip()
+    if buf:
+        raise ValueError("last line contains '\\'")
@@ -1,29 +1,326 @@
 #!/usr/bin/env python3
 import re
+import sys
+import time
+from array import array
 
 
 class NoMatch(Exception):
     pass
 
 
-symbols = []
+class Fail:
+    """Returned by Grammar.parse() instead of raising NoMatch."""
+
+    def __repr__(self):
+        return "FAIL"
+
+    def __bool__(self):
+        return False
+
+
+FAIL = Fail()
+
+
+symbols = []  # token tags are indices in this list
+
+# Packrat parsing: None -- disabled,
+# otherwise the max size of the memo table (0 -- unbounded).
+packrat = None
+
+
+class Packrat:
+    """Memo table (rule, position) -> result (or failure) of one parse."""
+
+    def __init__(self, maxsize=0):
+        self.maxsize = maxsize
+        self.table = {}
+
+    def parse(self, rule, tokens, pos):
+        key = rule, pos
+        try:
+            return self.table[key]
+        except KeyError:
+            pass
+        result = rule._parse(tokens, pos)
+        self.store(key, result)
+        return result
+
+    def store(self, key, result):
+        if self.maxsize and len(self.table) >= self.maxsize:
+            del self.table[next(iter(self.table))]  # the oldest one
+        self.table[key] = result
+
+
+# Profiling: None -- disabled, otherwise Profile collecting statistics
+# of rules (see --parse-profile).
+profile = None
+
+
+class Profile:
+    """Statistics of named rules: attempts, matches, failures,
+    tokens consumed before failing and cumulative time.
+
+    names -- {id(rule): name}, other rules are not profiled.
+    Time of a rule includes the time of rules it tries.
+    """
+
+    def __init__(self, names):
+        self.names = names
+        self.stats = {}  # name -> [attempts, matches, failures, tokens, seconds]
+
+    def run(self, rule, parse, tokens, *args):
+        """Call parse(tokens, *args) for the rule (pos is the last
+        argument) and count the result.
+        """
+        pos = args[-1]
+        stats = self.stats.get(self.names[id(rule)])
+        if stats is None:
+            stats = self.stats[self.names[id(rule)]] = [0, 0, 0, 0, 0.0]
+        # the furthest failure inside the rule tells how far it got
+        furthest, expected = tokens.furthest, tokens.expected
+        tokens.furthest, tokens.expected = pos, []
+        start = time.perf_counter()
+        r = parse(tokens, *args)
+        stats[4] += time.perf_counter() - start
+        stats[0] += 1
+        if r is FAIL:
+            stats[2] += 1
+            stats[3] += tokens.furthest - pos
+        else:
+            stats[1] += 1
+        # merge back as if the failures were recorded by Tokens.fail()
+        if not tokens.expected or furthest > tokens.furthest:
+            tokens.furthest, tokens.expected = furthest, expected
+        elif furthest == tokens.furthest:
+            tokens.expected = expected + tokens.expected
+        return r
+
+    def report(self, file=None):
+        """Print the statistics (to stderr), the slowest rules first."""
+        file = file or sys.stderr
+        print(
+            "{:<14} {:>9} {:>9} {:>9} {:>10} {:>10}".format(
+                "rule", "attempts", "matches", "failures", "backtrack", "time"
+            ),
+            file=file,
+        )
+        rows = sorted(self.stats.items(), key=lambda item: -item[1][4])
+        for name, (attempts, matches, failures, tokens, seconds) in rows:
+            print(
+                "{:<14} {:9} {:9} {:9} {:10} {:8.2f}ms".format(
+                    name, attempts, matches, failures, tokens, seconds * 1000
+                ),
+                file=file,
+            )
+
+
+class Profiled:
+    """Takes the place of tokens.memo while profiling.
+    memo -- Packrat or None.
+    """
+
+    def __init__(self, profile, memo):
+        self.profile = profile
+        self.memo = memo
+        if memo is not None:  # used by the compiled parser
+            self.table = memo.table
+            self.store = memo.store
+
+    def parse(self, rule, tokens, pos):
+        if id(rule) in self.profile.names:
+            return self.profile.run(rule, self._parse, tokens, rule, pos)
+        return self._parse(tokens, rule, pos)
+
+    def _parse(self, tokens, rule, pos):
+        if self.memo is None:
+            return rule._parse(tokens, pos)
+        return self.memo.parse(rule, tokens, pos)
+
+
+def rule_names(namespace):
+    """{id(rule): name} of rules defined in the namespace
+    (e.g., vars() of a grammar module).
+    """
+    names = {}
+    for name, obj in namespace.items():
+        if isinstance(obj, Composer) and name.isupper():
+            names.setdefault(id(obj), name)
+    return names
+
+
+class Tokens:
+    """Compact buffer of tokens.
+
+    Tag ids and (start, end) offsets of the token data are kept in
+    parallel arrays. Values are created from the text only when requested
+    (and then cached, so each position always gives the same object).
+    Indexing returns (datum, tag) pairs like plain token lists used to.
+    """
+
+    def __init__(self, text, lineno=None):
+        self.text = text
+        self.lineno = lineno
+        self.tags = array("H")
+        self.starts = array("l")
+        self.ends = array("l")
+        self.values = {}
+        self.memo = None if packrat is None else Packrat(packrat)
+        if profile is not None:
+            self.memo = Profiled(profile, self.memo)
+        # the furthest position where a terminal failed to match
+        # and the terminals expected there (for error messages)
+        self.furthest = 0
+        self.expected = []
+
+    def append(self, tag, start, end):
+        self.tags.append(tag)
+        self.starts.append(start)
+        self.ends.append(end)
+
+    def tag(self, pos):
+        return symbols[self.tags[pos]]
+
+    def value(self, pos):
+        values = self.values
+        if pos in values:  # most values are converted once, don't raise
+            return values[pos]
+        start = self.starts[pos]
+        datum = self.text[start : self.ends[pos]] if start >= 0 else None
+        value = values[pos] = symbols[self.tags[pos]].conv(datum)
+        return value
+
+    def fail(self, pos, rule):
+        """Remember what was expected at the furthest failure."""
+        if pos >= self.furthest:
+            if pos > self.furthest:
+                self.furthest = pos
+                self.expected = []
+            self.expected.append(rule)
+        return FAIL
+
+    def span(self, start, end, wrap=None):
+        return TokenSpan(self, start, end, wrap)
+
+    def __len__(self):
+        return len(self.tags)
+
+    def __getitem__(self, pos):
+        return self.value(pos), self.tag(pos)
+
+    def __iter__(self):
+        return (self[pos] for pos in range(len(self)))
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class TokenSpan:
+    """A view on values of tokens[start:end].
+
+    wrap -- maps tag ids to callables applied to values of such tokens.
+    """
+
+    __slots__ = ("tokens", "start", "end", "wrap")
+
+    def __init__(self, tokens, start, end, wrap=None):
+        self.tokens = tokens
+        self.start = start
+        self.end = end
+        self.wrap = wrap
+
+    @property
+    def lineno(self):
+        return self.tokens.lineno
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, idx):
+        if not 0 <= idx < self.end - self.start:
+            raise IndexError(idx)
+        return self._value(self.start + idx)
+
+    def _value(self, pos):
+        value = self.tokens.value(pos)
+        if self.wrap:
+            wrap = self.wrap.get(self.tokens.tags[pos])
+            if wrap:
+                return wrap(value)
+        return value
+
+    def __iter__(self):
+        return (self._value(pos) for pos in range(self.start, self.end))
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class Tokenizer:
+    """Splits text into tokens using a single regex.
+
+    All symbols are merged into one alternation. Alternatives are
+    ordered the same way symbols are tried one by one (by priority),
+    so the first-match-wins behaviour does not change.
+    """
+
+    def __init__(self, symbols):
+        self.count = len(symbols)
+        self.symbols = sorted(
+            (sym for sym in symbols if sym.regex),
+            key=lambda x: (x.prio, x.regex),
+            reverse=True,
+        )
+        # the outer group of every symbol is named after it, so the patterns
+        # of symbols need not be compiled to count their groups
+        alternatives = [
+            r"\s*(?P<t%d>%s)" % (sym.id, sym.source) for sym in self.symbols
+        ]
+        self.regex = re.compile("|".join(alternatives))
+        self.groups = {}  # index of the outer group -> (symbol, datum group)
+        starts = [self.regex.groupindex["t%d" % sym.id] for sym in self.symbols]
+        ends = starts[1:] + [self.regex.groups + 1]
+        for sym, group, end in zip(self.symbols, starts, ends):
+            # datum is the last group of the symbol pattern, like in RE.tokenize
+            self.groups[group] = sym.id, end - 1
+
+    def tokenize(self, text, pos=0):
+        tokens = Tokens(text)
+        self.scan(text, pos, len(text), tokens)
+        return tokens
+
+    def scan(self, text, pos, end, tokens, skip=()):
+        """Append tokens found in text[pos:end] to tokens.
+        Tokens with tags from skip (e.g., comments) are dropped.
+        """
+        match = self.regex.match
+        groups = self.groups
+        append = tokens.append
+        while pos < end:
+            m = match(text, pos, end)
+            if not m:
+                raise NoMatch("cannot tokenize at pos %s, text: %s" % (pos, text))
+            tag, datum = groups[m.lastindex]
+            if tag not in skip:
+                append(tag, *m.span(datum))
+            pos = m.end()
+
+
+_tokenizer = None
+
+
+def get_tokenizer():
+    """Tokenizer for all symbols registered so far."""
+    global _tokenizer
+    # symbols are only appended, so the count tells if the table is stale
+    if _tokenizer is None or _tokenizer.count != len(symbols):
+        _tokenizer = Tokenizer(symbols)
+    return _tokenizer
 
 
 def tokenize(text, pos=0):
     """Split input into a bunch of annotated tokens."""
-    result = []
-    mysymbols = sorted(symbols, key=lambda x: (x.prio, x.pattern.pattern), reverse=True)
-    while pos < len(text):
-        for p in mysymbols:
-            try:
-                r, pos = p.tokenize(text, pos)
-                result.append((r, p))
-                break
-            except NoMatch:
-                pass
-        else:
-            raise NoMatch("cannot tokenize at pos %s, text: %s" % (pos, text))
-    return result
+    return get_tokenizer().tokenize(text, pos)
 
 
 #####################
@@ -32,9 +329,43 @@ def tokenize(text, pos=0):
 
 
 class Grammar:
+    """Parsers implement parse(tokens, pos) that returns (result, newpos)
+    or FAIL. Exceptions are left for match(), the public interface.
+    """
+
+    def match(self, tokens, pos=0):
+        """Like parse(), but raises NoMatch on failure."""
+        tokens.furthest = pos
+        tokens.expected = []
+        r = self.parse(tokens, pos)
+        if r is FAIL:
+            raise self.error(tokens, pos)
+        return r
+
+    def error(self, tokens, pos):
+        """NoMatch for the match that failed at pos. Its args are the same
+        as before parse() returned FAIL: tokens of the line (without
+        the ones made by the lexer, e.g. INDENT) and the position where
+        the match started among them. pos and expected tell where it got
+        furthest and what was expected there.
+        """
+        shown = [i for i in range(len(tokens)) if not isinstance(tokens.tag(i), TAG)]
+        start = sum(1 for i in shown if i < pos)
+        err = NoMatch("syntax error", [tokens[i] for i in shown], start)
+        err.pos = tokens.furthest
+        err.expected = tokens.expected
+        return err
+
+    def first(self):
+        """Returns (FIRST set, nullable): ids of tags a match
+        can start with and whether it can match no tokens at all.
+        """
+        raise NotImplementedError
+
     def __add__(self, other):
         if isinstance(self, ALL):
             self.things += [other]
+            self.reset()
             return self
         return ALL(self, other)
 
@@ -42,6 +373,7 @@ class Grammar:
     def __or__(self, other):
         if isinstance(self, ANY):
             self.things += [other]
+            self.reset()
             return self
         return ANY(self, other)
 
@@ -64,33 +396,68 @@ class RE(Grammar):
     """
 
     def __init__(self, pattern, name=None, conv=str, prio=0):
-        self.pattern = re.compile("\s*(%s)" % pattern)
+        self.source = pattern
+        self.regex = r"\s*(%s)" % pattern
+        self._pattern = None  # compiled on demand, the lexer does not need it
         self.conv = conv
         self.name = name
         self.prio = prio
+        self.id = len(symbols)
         symbols.append(self)
 
+    @property
+    def pattern(self):
+        if self._pattern is None and self.regex:
+            self._pattern = re.compile(self.regex)
+        return self._pattern
+
     def tokenize(self, text, pos=0):
-        m = self.pattern.match(text[pos:])
+        m = self.pattern.match(text, pos)
         if not m:
             raise NoMatch("syntax error", text, pos)
-        text = m.groups()[-1]
-        newpos = pos + m.end()
-        return self.conv(text), newpos
+        return self.conv(m.groups()[-1]), m.end()
 
-    def match(self, tokens, pos=0):
+    def parse(self, tokens, pos=0):
+        if pos < len(tokens) and tokens.tags[pos] == self.id:
+            return tokens.value(pos), pos + 1
+        return tokens.fail(pos, self)
+
+    def error(self, tokens, pos):
         if pos >= len(tokens):
-            raise NoMatch
-        datum, tag = tokens[pos]
-        if tag != self:
-            raise NoMatch("%s != %s for %s" % (tag, self, datum))
-        return datum, pos + 1
+            err = NoMatch()
+        else:
+            err = NoMatch(
+                "%s != %s for %s" % (tokens.tag(pos), self, tokens.value(pos))
+            )
+        err.pos = pos
+        err.expected = [self]
+        return err
+
+    def first(self):
+        return frozenset([self.id]), False
 
     def __repr__(self):
         if self.name:
             return self.name
         cls = self.__class__.__name__
-        return "%s(/%s/)" % (cls, self.pattern.pattern)
+        return "%s(/%s/)" % (cls, self.regex)
+
+
+class TAG(RE):
+    """Tag for tokens that are produced by a lexer (e.g., INDENT),
+    not matched by a regex.
+    """
+
+    def __init__(self, name):
+        self.source = self.regex = self._pattern = None
+        self.conv = str
+        self.name = name
+        self.prio = 0
+        self.id = len(symbols)
+        symbols.append(self)
+
+    def tokenize(self, text, pos=0):
+        raise NoMatch("%s cannot be tokenized" % self)
 
 
 class SYM(RE):
@@ -109,8 +476,76 @@ class SYM(RE):
 
 
 class Composer(Grammar):
+    """Base class for parsers built from other parsers.
+    Subclasses implement _parse().
+    """
+
     def __init__(self, *things):
         self.things = list(things)
+        self.reset()
+
+    def reset(self):
+        """Forget grammar analysis (should be called when things change)."""
+        self._first = None
+        self._dispatch = None
+
+    def parse(self, tokens, pos=0):
+        memo = tokens.memo
+        if memo is None:
+            return self._parse(tokens, pos)
+        return memo.parse(self, tokens, pos)
+
+    def first(self):
+        if self._first is None:
+            self._first = frozenset(), False  # in case the rule is recursive
+            self._first = self._compute_first()
+        return self._first
+
+    def _compute_first(self):
+        """By default things are matched one after another."""
+        tags = set()
+        for thing in self.things:
+            first, nullable = thing.first()
+            tags |= first
+            if not nullable:
+                return frozenset(tags), False
+        return frozenset(tags), True
+
+    def _compute_union(self):
+        """FIRST set for rules that try things as alternatives."""
+        tags = set()
+        nullable = False
+        for thing in self.things:
+            first, maybe = thing.first()
+            tags |= first
+            nullable = nullable or maybe
+        return frozenset(tags), nullable
+
+    def dispatch(self):
+        """Returns ({tag id: alternatives}, alternatives for other tags).
+        Alternatives are the things that might match at a token
+        with the given tag, in the original order.
+        """
+        if self._dispatch is None:
+            firsts = [thing.first() for thing in self.things]
+            default = tuple(
+                t for t, (_, nullable) in zip(self.things, firsts) if nullable
+            )
+            table = {}
+            for tag in set().union(*(first for first, _ in firsts)):
+                table[tag] = tuple(
+                    t
+                    for t, (first, nullable) in zip(self.things, firsts)
+                    if nullable or tag in first
+                )
+            self._dispatch = table, default
+        return self._dispatch
+
+    def alternatives(self, tokens, pos):
+        table, default = self.dispatch()
+        if pos < len(tokens):
+            return table.get(tokens.tags[pos], default)
+        return default
 
     def __repr__(self):
         cls = self.__class__.__name__
@@ -125,18 +560,24 @@ class Attr(Composer):
         ), "Attribute name should be a string or None"
         self.attr = attr
 
-    def match(self, tokens, pos=0):
-        r, pos = self.things[0].match(tokens, pos)
+    def _parse(self, tokens, pos=0):
+        r = self.things[0].parse(tokens, pos)
+        if r is FAIL:
+            return FAIL
+        r, pos = r
         if self.attr is None:
             return {}, pos
         return {self.attr: r}, pos
 
 
 class MergeAttr(Composer):
-    def match(self, tokens, pos=0):
+    def _parse(self, tokens, pos=0):
         result = {}
         for thing in self.things:
-            r, pos = thing.match(tokens, pos)
+            r = thing.parse(tokens, pos)
+            if r is FAIL:
+                return FAIL
+            r, pos = r
             if r:
                 result.update(r)
         return result, pos
@@ -151,13 +592,19 @@ class Wrap(Composer):
         # "Attribute name should be a string or None"
         self.attr = attr
 
-    def match(self, tokens, pos=0):
-        result, pos = self.things[0].match(tokens, pos)
+    def _parse(self, tokens, pos=0):
+        result = self.things[0].parse(tokens, pos)
+        if result is FAIL:
+            return FAIL
+        result, pos = result
         # print("wrap res", result)
         if self.attr is None:
             return None, pos
-        if isinstance(result, str):
-            return self.attr(result), pos
+        return self.convert(result), pos
+
+    def convert(self, result):
+        if isinstance(result, (str, TokenSpan)):
+            return self.attr(result)
         elif isinstance(result, list):
             args = []
             kwargs = {}
@@ -168,37 +615,60 @@ class Wrap(Composer):
                     kwargs.update(r)
                 else:
                     args.append(r)
-            return self.attr(*args, **kwargs), pos
+            return self.attr(*args, **kwargs)
         else:
             raise Exception("do not know how to process this")
 
 
+class SPAN(Composer):
+    """Matches like the given parser, but returns the matched tokens
+    as a TokenSpan (to be parsed later, e.g., by the pratt parser).
+
+    wrap -- {RE: callable}, how to convert values of these tokens
+    (in the same way ID / Var would do).
+    """
+
+    def __init__(self, thing, wrap=None):
+        super().__init__(thing)
+        self.wrap = {sym.id: conv for sym, conv in wrap.items()} if wrap else None
+
+    def _parse(self, tokens, pos=0):
+        r = self.things[0].parse(tokens, pos)
+        if r is FAIL:
+            return FAIL
+        return tokens.span(pos, r[1], self.wrap), r[1]
+
+
 class ALL(Composer):
-    def match(self, tokens, pos=0):
+    def _parse(self, tokens, pos=0):
         result = []
         for thing in self.things:
-            r, pos = thing.match(tokens, pos)
+            r = thing.parse(tokens, pos)
+            if r is FAIL:
+                return FAIL
+            r, pos = r
             if r:
                 result += [r]
         return result, pos
 
 
 class SOMEOF(Composer):
-    def match(self, tokens, pos=0):
+    _compute_first = Composer._compute_union
+
+    def _parse(self, tokens, pos=0):
         result = []
         while True:
-            for thing in self.things:
-                try:
-                    r, pos = thing.match(tokens, pos)
+            for thing in self.alternatives(tokens, pos):
+                r = thing.parse(tokens, pos)
+                if r is not FAIL:
+                    r, pos = r
                     if r:
                         result += [r]
                     break  # break is neccessary because it's a PEG parser and the order does matter
-                except NoMatch:
-                    pass
             else:
                 break
         if not result:
-            raise NoMatch("syntax error", tokens, pos)
+            return tokens.fail(pos, self)
         return result, pos
 
 
@@ -208,42 +678,69 @@ class CSV(Composer):
         assert sep, "sep is mandatory parameter"
         self.sep = sep
 
-    def match(self, tokens, pos=0):
+    def _parse(self, tokens, pos=0):
         result = []
+        thing, sep = self.things[0], self.sep
         while True:
-            try:
-                r, pos = self.things[0].match(tokens, pos)
-                if r:
-                    result.append(r)
-                r, pos = self.sep.match(tokens, pos)
-            except NoMatch:
-                if not result:
-                    raise
+            r = thing.parse(tokens, pos)
+            if r is FAIL:
                 break
+            r, pos = r
+            if r:
+                result.append(r)
+            r = sep.parse(tokens, pos)
+            if r is FAIL:
+                break
+            pos = r[1]
+        if not result:
+            return FAIL
         return result, pos
 
+    def _compute_first(self):
+        return self.things[0].first()
+
 
 # THESE RETURN ONLY ONE ELEMENT AT MOST
 class MAYBE(Composer):
-    def match(self, tokens, pos=0):
+    def _parse(self, tokens, pos=0):
         assert len(self.things) == 1, "accepts only one arg"
-        try:
-            r, pos = self.things[0].match(tokens, pos)
-            return r, pos
-        except NoMatch:
+        r = self.things[0].parse(tokens, pos)
+        if r is FAIL:
             return None, pos
+        return r
+
+    def _compute_first(self):
+        first, _ = self.things[0].first()
+        return first, True
 
 
 class ANY(Composer):
     """First match wins"""
 
-    def match(self, tokens, pos=0):
-        for thing in self.things:
-            try:
-                return thing.match(tokens, pos)
-            except NoMatch:
-                pass
-        raise NoMatch("syntax error", tokens, pos)
+    _compute_first = Composer._compute_union
+
+    def _parse(self, tokens, pos=0):
+        for thing in self.alternatives(tokens, pos):
+            r = thing.parse(tokens, pos)
+            if r is not FAIL:
+                return r
+        return tokens.fail(pos, self)
+
+
+def analyze(rule):
+    """Precompute FIRST sets and dispatch tables of all rules
+    reachable from the given one.
+    """
+    seen = set()
+    todo = [rule]
+    while todo:
+        rule = todo.pop()
+        if id(rule) in seen or not isinstance(rule, Composer):
+            continue
+        seen.add(id(rule))
+        rule.first()
+        rule.dispatch()
+        todo.extend(rule.things)
 
 
 def test(expr, text, verbose=True):
@@ -0,0 +1,477 @@
+#!/usr/bin/env python3
+"""
+Compiles PEG combinators (see peg.py) into python code.
+
+Each rule becomes a function with token tag checks inlined,
+so parsing does not walk the object graph and does not do
+dynamic dispatch on every node. The generated parser gives
+exactly the same results as the combinators it was made from.
+
+Functions take (tokens, tags, n, pos) where tags are token
+tags and n is their number. They return (result, newpos) or FAIL,
+just like Grammar.parse().
+
+The generated parser is about 2-2.5x faster than the combinators
+on the grammar and 1.3-1.6x on parsing as a whole, short of the
+several times it was meant to be (see benchmarks/parser.py).
+"""
+
+import hashlib
+import marshal
+import os
+import sys
+
+from .peg import (
+    ALL,
+    ANY,
+    CSV,
+    FAIL,
+    RE,
+    SPAN,
+    Attr,
+    Composer,
+    Grammar,
+    Profiled,
+    Wrap,
+    symbols,
+)
+
+_cache = {}  # (fingerprint, memo, profile) -> (source, entry function)
+
+
+class Compiled(Grammar):
+    """Drop-in replacement for the rule it was compiled from."""
+
+    def __init__(self, rule, key):
+        self.rule = rule
+        self.key = key
+        self.source, self._plain = _generate(rule, key, memo=False)
+        self._variants = {}  # (memo, profile) -> entry function, made on demand
+
+    def parse(self, tokens, pos=0):
+        tags = tokens.tags
+        memo = tokens.memo
+        if memo is None:
+            return self._plain(tokens, tags, len(tags), pos)
+        if isinstance(memo, Profiled):
+            variant = memo.memo is not None, memo.profile
+        else:
+            variant = True, None
+        try:
+            entry = self._variants[variant]
+        except KeyError:
+            _, entry = _generate(self.rule, self.key, *variant)
+            self._variants[variant] = entry
+        return entry(tokens, tags, len(tags), pos)
+
+    def error(self, tokens, pos):
+        return self.rule.error(tokens, pos)
+
+    def first(self):
+        return self.rule.first()
+
+    def __repr__(self):
+        return "Compiled(%r)" % self.rule
+
+
+def compile_grammar(rule):
+    """Returns a Compiled parser for the rule. Code is generated
+    again only if the grammar has changed since the last call.
+    """
+    return Compiled(rule, fingerprint(rule))
+
+
+def _generate(rule, key, memo, profile=None):
+    try:
+        source, entry = _cache[key, memo, profile]
+    except KeyError:
+        gen = Generator(memo=memo, profile=profile)
+        name = gen.name(rule)
+        source = gen.generate()
+        namespace = dict(gen.consts)
+        exec(_compile(source, "<grammar %s>" % key[:8]), namespace)
+        entry = namespace[name]
+        _cache[key, memo, profile] = source, entry
+    return source, entry
+
+
+def _compile(source, filename):
+    """compile() the generated code, the code object is saved to
+    __pycache__ (like .pyc files), so it's not compiled on every start.
+    """
+    digest = hashlib.sha1((filename + source).encode()).hexdigest()
+    dirname = os.path.dirname(os.path.abspath(__file__))
+    if sys.pycache_prefix:
+        dirname = os.path.join(sys.pycache_prefix, dirname.lstrip(os.sep))
+    else:
+        dirname = os.path.join(dirname, "__pycache__")
+    tag = sys.implementation.cache_tag
+    path = os.path.join(dirname, "grammar.%s.%s.marshal" % (digest[:16], tag))
+    try:
+        with open(path, "rb") as f:
+            return marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+    code = compile(source, filename, "exec")
+    if not sys.dont_write_bytecode:
+        tmp = "%s.%d" % (path, os.getpid())
+        try:
+            os.makedirs(dirname, exist_ok=True)
+            with open(tmp, "wb") as f:
+                marshal.dump(code, f)
+            os.replace(tmp, path)
+        except OSError:
+            pass
+    return code
+
+
+def fingerprint(rule):
+    """A hash that changes when anything in the grammar changes."""
+    rules = _collect(rule)
+    index = {id(rule): i for i, rule in enumerate(rules)}
+    parts = [_describe(rule, index) for rule in rules]
+    return hashlib.sha1("\n".join(parts).encode()).hexdigest()
+
+
+def _collect(rule):
+    """All rules reachable from the given one, in a stable order."""
+    rules = []
+    seen = set()
+    todo = [rule]
+    while todo:
+        rule = todo.pop()
+        if id(rule) in seen:
+            continue
+        seen.add(id(rule))
+        rules.append(rule)
+        if isinstance(rule, Composer):
+            todo.extend(reversed(rule.things))
+            if isinstance(rule, CSV):
+                todo.append(rule.sep)
+    return rules
+
+
+def _describe(rule, index):
+    cls = rule.__class__.__name__
+    if isinstance(rule, RE):
+        return "%s %s %r %s" % (cls, rule.id, rule.regex, rule.conv)
+    things = [index[id(thing)] for thing in rule.things]
+    extra = ""
+    if isinstance(rule, (Attr, Wrap)):
+        extra = _qualname(rule.attr)
+    elif isinstance(rule, SPAN) and rule.wrap:
+        extra = sorted((k, _qualname(v)) for k, v in rule.wrap.items())
+    elif isinstance(rule, CSV):
+        extra = index[id(rule.sep)]
+    return "%s %s %s" % (cls, things, extra)
+
+
+def _qualname(obj):
+    if obj is None or isinstance(obj, str):
+        return repr(obj)
+    return "%s.%s" % (obj.__module__, obj.__qualname__)
+
+
+def _terminals(rule):
+    """Tag ids if rule matches exactly one token (a terminal or
+    a choice between terminals), otherwise None.
+    """
+    if isinstance(rule, RE):
+        return frozenset([rule.id])
+    if isinstance(rule, ANY) and rule.things:
+        if all(isinstance(thing, RE) for thing in rule.things):
+            return frozenset(thing.id for thing in rule.things)
+    return None
+
+
+def _always_true(conv):
+    """True if everything conv returns is true in boolean context."""
+    return isinstance(conv, type) and not (
+        hasattr(conv, "__bool__") or hasattr(conv, "__len__")
+    )
+
+
+class Generator:
+    """Generates parsing functions for rules.
+
+    Besides the functions returning the same results as rules do,
+    it makes recognizers for rules whose results are thrown away
+    (e.g., in SPAN or "% None"). Recognizers return (bool(result), pos),
+    they do not convert tokens into values and do not build lists.
+
+    memo -- generate code for packrat parsing (see peg.Packrat),
+    profile -- peg.Profile to count calls of the rules it names
+    (they are not inlined then).
+    """
+
+    def __init__(self, memo=False, profile=None):
+        self.memo = memo
+        self.profile = profile
+        self.names = {}  # (id(rule), recog) -> name of its function
+        self.consts = {"FAIL": FAIL, "profile": profile}
+        self.todo = []
+        self.lines = []
+
+    def generate(self):
+        while self.todo:
+            rule, recog = self.todo.pop(0)
+            getattr(self, "gen_" + rule.__class__.__name__)(rule, recog)
+        return "\n".join(self.lines) + "\n"
+
+    def name(self, rule, recog=False):
+        """Name of function parsing (or recognizing) the rule."""
+        try:
+            return self.names[id(rule), recog]
+        except KeyError:
+            pass
+        name = "%s_%s" % (rule.__class__.__name__, len(self.names))
+        if recog:
+            name = "is_" + name
+        self.names[id(rule), recog] = name
+        self.const(rule, "rule_" + name)
+        self.todo.append((rule, recog))
+        return name
+
+    def const(self, obj, name=None):
+        """Make obj available to generated code."""
+        if name is None:
+            name = "c%s" % len(self.consts)
+        self.consts[name] = obj
+        return name
+
+    def tagcheck(self, tags):
+        if len(tags) == 1:
+            return "tag == %s" % next(iter(tags))
+        return "tag in %s" % self.const(tags)
+
+    def value(self, terminals, recog):
+        """Expression giving the value (or its truth) of token at pos."""
+        if not recog:
+            return "tokens.value(pos)"
+        convs = {symbols[tag].conv for tag in terminals}
+        if all(map(_always_true, convs)):
+            return "True"
+        if convs == {str}:
+            return "tokens.ends[pos] > tokens.starts[pos] >= 0"
+        return "bool(tokens.value(pos))"
+
+    def profiled(self, rule):
+        return self.profile is not None and id(rule) in self.profile.names
+
+    def header(self, rule, recog):
+        """Emit function header, return indent of its body."""
+        name = self.name(rule, recog)
+        const = "rule_" + name
+        if self.profiled(rule):
+            self.lines += [
+                "",
+                "def %s(tokens, tags, n, pos):" % name,
+                "    return profile.run(%s, _%s, tokens, tags, n, pos)" % (const, name),
+                "",
+            ]
+            name = "_" + name
+        if self.memo:
+            # recognizers give other results, so they need other keys
+            key = "%s, pos, True" if recog else "%s, pos"
+            self.lines += [
+                "",
+                "def %s(tokens, tags, n, pos):" % name,
+                "    table = tokens.memo.table",
+                "    key = " + key % const,
+                "    try:",
+                "        return table[key]",
+                "    except KeyError:",
+                "        pass",
+                "    r = _%s(tokens, tags, n, pos)" % name,
+                "    tokens.memo.store(key, r)",
+                "    return r",
+                "",
+            ]
+            name = "_" + name
+        self.lines += ["", "def %s(tokens, tags, n, pos):" % name]
+        return "    "
+
+    def call(self, thing, ind, on_fail, recog=False):
+        """Emit code that matches thing at pos, leaving its value in r
+        and advancing pos. on_fail -- statement to execute on failure.
+        """
+        if isinstance(thing, RE):
+            self.lines += [
+                ind + "if pos < n and tags[pos] == %s:" % thing.id,
+                ind + "    r = " + self.value([thing.id], recog),
+                ind + "    pos += 1",
+                ind + "else:",
+                ind + "    tokens.fail(pos, %s)" % self.const(thing),
+                ind + "    " + on_fail,
+            ]
+        else:
+            self.lines += [
+                ind + "r = %s(tokens, tags, n, pos)" % self.name(thing, recog),
+                ind + "if r is FAIL:",
+                ind + "    " + on_fail,
+                ind + "r, pos = r",
+            ]
+
+    def collect(self, ind, recog, method="append"):
+        """Emit code adding r to the result."""
+        if recog:
+            return [ind + "if r:", ind + "    result = True"]
+        return [ind + "if r:", ind + "    result.%s(r)" % method]
+
+    def gen_ALL(self, rule, recog):
+        ind = self.header(rule, recog)
+        self.lines.append(ind + ("result = False" if recog else "result = []"))
+        for thing in rule.things:
+            self.call(thing, ind, "return FAIL", recog)
+            self.lines += self.collect(ind, recog)
+        self.lines.append(ind + "return result, pos")
+
+    def gen_MergeAttr(self, rule, recog):
+        ind = self.header(rule, recog)
+        self.lines.append(ind + ("result = False" if recog else "result = {}"))
+        for thing in rule.things:
+            self.call(thing, ind, "return FAIL", recog)
+            self.lines += self.collect(ind, recog, "update")
+        self.lines.append(ind + "return result, pos")
+
+    def gen_Attr(self, rule, recog):
+        ind = self.header(rule, recog)
+        self.call(rule.things[0], ind, "return FAIL", recog or rule.attr is None)
+        if rule.attr is None:
+            self.lines.append(
+                ind + ("return False, pos" if recog else "return {}, pos")
+            )
+        elif recog:
+            self.lines.append(ind + "return True, pos")
+        else:
+            self.lines.append(ind + "return {%r: r}, pos" % rule.attr)
+
+    def gen_Wrap(self, rule, recog):
+        ind = self.header(rule, recog)
+        thing = rule.things[0]
+        if rule.attr is None:
+            self.call(thing, ind, "return FAIL", recog=True)
+            self.lines.append(
+                ind + ("return False, pos" if recog else "return None, pos")
+            )
+            return
+        if isinstance(thing, ALL) and not self.profiled(thing):
+            # inline ALL and Wrap.convert(): collect arguments right away
+            self.lines += [ind + "args = []", ind + "kwargs = {}"]
+            for sub in thing.things:
+                if isinstance(sub, Attr) and sub.attr is None:
+                    self.call(sub, ind, "return FAIL", recog=True)
+                elif isinstance(sub, Attr) and not self.profiled(sub):
+                    self.call(sub.things[0], ind, "return FAIL")
+                    self.lines.append(ind + "kwargs[%r] = r" % sub.attr)
+                else:
+                    self.call(sub, ind, "return FAIL")
+                    self.lines += [
+                        ind + "if isinstance(r, dict):",
+                        ind + "    kwargs.update(r)",
+                        ind + "elif r:",
+                        ind + "    args.append(r)",
+                    ]
+            result = "%s(*args, **kwargs)" % self.const(rule.attr)
+        else:
+            self.call(thing, ind, "return FAIL")
+            result = "%s(r)" % self.const(rule.convert)
+        if recog:
+            result = "bool(%s)" % result
+        self.lines.append(ind + "return %s, pos" % result)
+
+    def gen_SPAN(self, rule, recog):
+        ind = self.header(rule, recog)
+        self.lines.append(ind + "start = pos")
+        self.call(rule.things[0], ind, "return FAIL", recog=True)
+        if recog:
+            self.lines.append(ind + "return pos > start, pos")
+        else:
+            wrap = self.const(rule.wrap)
+            self.lines.append(ind + "return tokens.span(start, pos, %s), pos" % wrap)
+
+    def gen_MAYBE(self, rule, recog):
+        ind = self.header(rule, recog)
+        assert len(rule.things) == 1, "accepts only one arg"
+        on_fail = "return False, pos" if recog else "return None, pos"
+        self.call(rule.things[0], ind, on_fail, recog)
+        self.lines.append(ind + "return r, pos")
+
+    def gen_CSV(self, rule, recog):
+        ind = self.header(rule, recog)
+        self.lines += [
+            ind + ("result = False" if recog else "result = []"),
+            ind + "while True:",
+        ]
+        self.call(rule.things[0], ind + "    ", "break", recog)
+        self.lines += self.collect(ind + "    ", recog)
+        self.call(rule.sep, ind + "    ", "break", recog=True)
+        self.lines += [
+            ind + "if not result:",
+            ind + "    return FAIL",
+            ind + "return result, pos",
+        ]
+
+    def gen_ANY(self, rule, recog):
+        ind = self.header(rule, recog)
+        self.lines.append(ind + "tag = tags[pos] if pos < n else -1")
+        terminals = _terminals(rule)
+        if terminals:
+            self.lines += [
+                ind + "if %s:" % self.tagcheck(terminals),
+                ind + "    return %s, pos + 1" % self.value(terminals, recog),
+            ]
+        else:
+            for thing in rule.things:
+                if isinstance(thing, RE):
+                    self.lines += [
+                        ind + "if tag == %s:" % thing.id,
+                        ind + "    return %s, pos + 1" % self.value([thing.id], recog),
+                    ]
+                    continue
+                first, nullable = thing.first()
+                if nullable:
+                    self.lines.append(ind + "if True:")
+                else:
+                    self.lines.append(ind + "if %s:" % self.tagcheck(first))
+                self.lines += [
+                    ind + "    r = %s(tokens, tags, n, pos)" % self.name(thing, recog),
+                    ind + "    if r is not FAIL:",
+                    ind + "        return r",
+                ]
+        self.lines.append(ind + "return tokens.fail(pos, %s)" % self.const(rule))
+
+    def gen_SOMEOF(self, rule, recog):
+        ind = self.header(rule, recog)
+        self.lines += [
+            ind + ("result = False" if recog else "result = []"),
+            ind + "while True:",
+            ind + "    tag = tags[pos] if pos < n else -1",
+        ]
+        for thing in rule.things:
+            terminals = _terminals(thing)
+            first, nullable = thing.first()
+            if terminals and not self.profiled(thing):
+                self.lines += [
+                    ind + "    if %s:" % self.tagcheck(terminals),
+                    ind + "        r = " + self.value(terminals, recog),
+                    ind + "        pos += 1",
+                ]
+                self.lines += self.collect(ind + "        ", recog)
+                self.lines.append(ind + "        continue")
+                continue
+            check = "True" if nullable else self.tagcheck(first)
+            self.lines += [
+                ind + "    if %s:" % check,
+                ind + "        r = %s(tokens, tags, n, pos)" % self.name(thing, recog),
+                ind + "        if r is not FAIL:",  # else try the next alternative
+                ind + "            r, pos = r",
+            ]
+            self.lines += self.collect(ind + "            ", recog)
+            self.lines.append(ind + "            continue")
+        self.lines += [
+            ind + "    break",
+            ind + "if not result:",
+            ind + "    return tokens.fail(pos, %s)" % self.const(rule),
+            ind + "return result, pos",
+        ]
@@ -6,8 +6,6 @@ Inspired by http://effbot.org/zone/simple-top-down-parsing.htm
 Read the article before touching this file.
 """
 
-from itertools import chain
-
 symap = {}
 
 
@@ -17,6 +15,15 @@ def symbol(sym, lbp=0):
     except KeyError:
 
         class Sym:
+            instance = None
+
+            def __new__(cls, sym):
+                # operators do not hold any state,
+                # so all their tokens share the same object
+                if cls.instance is None:
+                    cls.instance = super().__new__(cls)
+                return cls.instance
+
             def __init__(self, sym):
                 assert sym == self.sym
 
@@ -50,8 +57,8 @@ class prefix:
     def __call__(self, cls):
         rbp = self.rbp
 
-        def nud(self):
-            return cls(expr(rbp))
+        def nud(self, parser):
+            return cls(parser.expr(rbp))
 
         symbol(self.sym).nud = nud
         return cls
@@ -64,8 +71,8 @@ class infix:
         self.lbp = lbp
 
     def __call__(self, cls):
-        def led(self, left):
-            return cls(left, expr(self.lbp))
+        def led(self, left, parser):
+            return cls(left, parser.expr(self.lbp))
 
         symbol(self.sym, self.lbp).led = led
         return cls
@@ -78,8 +85,8 @@ class infix_r:
         self.lbp = lbp
 
     def __call__(self, cls):
-        def led(self, left):
-            return cls(left, expr(self.lbp - 1))
+        def led(self, left, parser):
+            return cls(left, parser.expr(self.lbp - 1))
 
         symbol(self.sym, self.lbp).led = led
         return cls
@@ -92,7 +99,7 @@ class postfix:
         self.lbp = lbp
 
     def __call__(self, cls):
-        def led(self, left):
+        def led(self, left, parser):
             return cls(left)
 
         symbol(self.sym, self.lbp).led = led
@@ -107,7 +114,7 @@ class nullary:
         self.sym = sym
 
     def __call__(self, cls):
-        def nud(self):
+        def nud(self, parser):
             return cls(self.sym)
 
         symbol(self.sym).nud = nud
@@ -123,17 +130,16 @@ class brackets:
         open = self.open
         close = self.close
 
-        def nud(self):
-            global cur, nxt
+        def nud(self, parser):
             # It might happen there is no expression
             # between open and close symbols.
             # We should check this.
-            if isinstance(nxt, symbol(close)):
-                advance(close)
+            if isinstance(parser.nxt, symbol(close)):
+                parser.advance(close)
                 return cls()
             else:
-                e = expr()
-                advance(close)
+                e = parser.expr()
+                parser.advance(close)
                 return cls(e)
 
         symbol(open).nud = nud
@@ -156,10 +162,10 @@ class subscript:
         close = self.close
         lbp = self.lbp
 
-        def led(self, left):
-            right = expr()
+        def led(self, left, parser):
+            right = parser.expr()
             if close:
-                advance(close)
+                parser.advance(close)
             return cls(left, right)
 
         symbol(open, lbp=lbp).led = led
@@ -175,11 +181,11 @@ class ifelse:
         self.lbp = lbp
 
     def __call__(self, cls):
-        def led(self, left):
+        def led(self, left, parser):
             then = left
-            iff = expr()
-            advance("else")
-            otherwise = expr()
+            iff = parser.expr()
+            parser.advance("else")
+            otherwise = parser.expr()
             return cls(iff, then, otherwise)
 
         symbol("if", lbp=self.lbp).led = led
@@ -201,27 +207,54 @@ class END:
 ###################
 
 
-def shift():
-    global nxt, e
-    return nxt, next(e)
-
-
-def advance(sym=None):
-    """Just skip next symbol."""
-    global cur, nxt
-    cur, nxt = shift()
-    if sym and cur.sym != sym:
-        raise SyntaxError("Expected %r" % sym)
-
-
-def expr(rbp=0):
-    global cur, nxt
-    cur, nxt = shift()
-    left = cur.nud()
-    while rbp < nxt.lbp:
-        cur, nxt = shift()
-        left = cur.led(left)
-    return left
+class Parser:
+    """Holds the state of parsing, so parsers do not interfere
+    with each other (e.g., when an operator parses its arguments
+    again while the outer expression is still being parsed).
+
+    tokens -- any sequence indexable by position.
+    """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+        self.cur = self.nxt = None
+
+    def shift(self):
+        tokens, pos = self.tokens, self.pos
+        token = tokens[pos] if pos < len(tokens) else END
+        self.pos = pos + 1
+        return self.nxt, token
+
+    def advance(self, sym=None):
+        """Just skip next symbol."""
+        self.cur, self.nxt = self.shift()
+        if sym and self.cur.sym != sym:
+            raise SyntaxError("Expected %r" % sym)
+
+    def expr(self, rbp=0):
+        self.cur, self.nxt = self.shift()
+        left = self.cur.nud(self)
+        while rbp < self.nxt.lbp:
+            self.cur, self.nxt = self.shift()
+            left = self.cur.led(left, self)
+        return left
+
+    def parse(self):
+        assert self.tokens, "tokens cannot be empty"
+        assert symap, (
+            "No operators registered."
+            "Please define at least one operator decorated with infix()/prefix()/etc"
+        )
+        self.cur, self.nxt = self.shift()
+        result = self.expr()
+        # sanity check
+        if self.nxt is not END:
+            raise Exception(
+                "not all tokens was parsed: either there is "
+                "a grammar error or problem with operators"
+            )
+        return result
 
 
 def pratt_parse(*tokens):
@@ -229,24 +262,6 @@ def pratt_parse(*tokens):
     return pratt_parse1(tokens)
 
 
-def pratt_parse1(tokens):
-    assert tokens, "tokens cannot be empty"
-    global cur, nxt, e
-    assert symap, (
-        "No operators registered."
-        "Please define at least one operator decorated with infix()/prefix()/etc"
-    )
-    cur = nxt = None
-    e = chain(tokens, [END])
-    cur, nxt = shift()
-    result = expr()
-    # sanity check
-    try:
-        next(e)
-        raise Exception(
-            "not all tokens was parsed: either there is "
-            "a grammar error or problem with operators"
-        )
-    except StopIteration:
-        pass
-    return result
+def pratt_parse1(toks):
+    """Parse a sequence of tokens (any object indexable by position)."""
+    return Parser(toks).parse()
@@ -6,11 +6,11 @@ A more informative backtrace printer.
 At least it includes class names.
 """
 
-import inspect
-import traceback
-
 
 def prettybt(exctype, exc_val, tb):
+    # inspect is slow to import, and it's needed only when things go wrong
+    import inspect
+
     frames = inspect.getinnerframes(tb)
     for frame, file, line, funcname, *other in frames:
         arginfo = inspect.getargvalues(frame)
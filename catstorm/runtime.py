@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Runtime of the python code made by transpile.py.
+
+Values are the same objects the interpreter uses (Int, Str, Array,
+Obj, ...), so transpiled code, the tree and closures can call each
+other. The helpers do what eval() of the corresponding nodes does
+after the operands are evaluated.
+"""
+
+from . import interpreter
+from .frame import Frame
+from .interpreter import (  # noqa: F401 (used by the generated code)
+    FALSE,
+    NONE,
+    TRUE,
+    Add,
+    Array,
+    Class,
+    Comma,
+    Eq,
+    Func,
+    Gt,
+    Int,
+    Lt,
+    ModuleFunc,
+    Mul,
+    NewADT,
+    NotEq,
+    Obj,
+    Print,
+    ReturnException,
+    Str,
+    Sub,
+    Union,
+)
+
+__all__ = [
+    "FALSE",
+    "NONE",
+    "TRUE",
+    "Array",
+    "Comma",
+    "Frame",
+    "Int",
+    "Str",
+    "add",
+    "append",
+    "assert_",
+    "assign",
+    "call",
+    "call0",
+    "call1",
+    "call_method",
+    "callable_",
+    "eq",
+    "gt",
+    "import_",
+    "lt",
+    "mul",
+    "ne",
+    "ret",
+    "set_attr",
+    "show",
+    "sub",
+    "text",
+]
+
+show = Print.show
+
+
+#############
+# OPERATORS #
+#############
+
+
+def binop(left, right, methname, sym):
+    try:
+        meth = getattr(left, methname)
+    except AttributeError:
+        raise Exception(
+            "{} does not have {} method, "
+            "operation ({}) not supported".format(left, methname, sym)
+        )
+    return meth(right)
+
+
+def operation(node_cls):
+    """Function doing what node_cls does with the values of its operands,
+    Int operands are handled here with node_cls.int_op.
+    """
+    int_op, methname, sym = node_cls.int_op, node_cls.methname, node_cls.sym
+
+    def run(left, right):
+        if type(left) is Int and type(right) is Int:
+            return int_op(left.value, right.value)
+        return binop(left, right, methname, sym)
+
+    run.__name__ = run.__qualname__ = methname.lower()
+    return run
+
+
+add = operation(Add)
+sub = operation(Sub)
+mul = operation(Mul)
+eq = operation(Eq)
+ne = operation(NotEq)
+gt = operation(Gt)
+lt = operation(Lt)
+
+
+def append(left, right):
+    return binop(left, right, "Append", "<<<")
+
+
+########
+# MISC #
+########
+
+
+def assign(scope, name, value):
+    scope[name] = value
+    return value
+
+
+def set_attr(obj, name, value):
+    obj.SetAttr(name, value)
+
+
+def ret(value):
+    raise ReturnException(value)
+
+
+def assert_(value, expr):
+    if not isinstance(value, interpreter.Bool):
+        print("warning, asserting on not bool")
+    if not value.to_bool():
+        raise Exception("Assertion failed on %s" % expr)
+    return value
+
+
+def text(value, frame):
+    """How the value is shown in a string template."""
+    return value.to_str(frame=frame).to_py_str()
+
+
+def import_(frame, name):
+    from .transpile import install
+
+    module = frame[name] = interpreter.import_module(name)
+    install(module.tree, "<module %s>" % name)
+    return module
+
+
+#########
+# CALLS #
+#########
+
+CALLABLE = (Func, Class, NewADT, Union, ModuleFunc)
+
+
+def callable_(func):
+    """Check the callee before its arguments are evaluated, like Call does."""
+    if type(func) is not Func:
+        assert isinstance(func, CALLABLE) or issubclass(
+            func, CALLABLE
+        ), "I can only call functions and classes, got %s (%s) instead" % (
+            func,
+            type(func),
+        )
+    return func
+
+
+def bind(func, args, frame):
+    scope = frame.dict
+    for name, value in zip(func.args, args):
+        scope[name] = value
+    return func.body.eval(frame)
+
+
+def call(frame, func, *args):
+    if type(func) is Func and len(args) == len(func.args):
+        return bind(func, args, Frame(frame))
+    return func.Call(Comma(*args, flatten=False), Frame(frame))
+
+
+def call1(frame, func, value):
+    """Call with one argument (it's spread if it's a Comma, like in Call)."""
+    if isinstance(value, Comma):
+        return call(frame, func, *value)
+    return call(frame, func, value)
+
+
+def call0(frame, func):
+    newframe = Frame(frame)
+    if hasattr(func, "Call"):
+        return func.Call([], newframe)
+    return func(newframe)
+
+
+def call_method(frame, this, meth_name, *args):
+    newframe = Frame(frame)
+    newframe.dict["this"] = this
+    func = this.GetAttr(meth_name)
+    if type(func) is Func and len(args) == len(func.args):
+        return bind(func, args, newframe)
+    return func.Call(Comma(*args, flatten=False), newframe)
@@ -1,11 +1,19 @@
 #!/usr/bin/env python3
 
+# Modules that are needed only with some flags (e.g., concurrent.futures
+# for check, zipfile for bundles) are imported where they are used,
+# so that starting the interpreter stays fast (see benchmarks/startup.py).
+
 import argparse
+import os
 import sys
+import time
+from functools import partial
+
+from . import bundle, cache, grammar, interpreter, peg
 
 from .frame import Frame
-from .grammar import PROG
-from .indent_parser import indent_parse
+from .grammar import PARSER, PROG, SKIP
 from .interpreter import (
     Array,
     Assign,
@@ -17,128 +25,617 @@ from .interpreter import (
     Comma,
     DictTPL,
     GetAttr,
+    Import,
     Int,
+    LazyBlock,
     Print,
+    ReturnException,
     SetAttr,
     Str,
+    StrTPL,
     This,
     Var,
 )
+from .lexer import DEDENT, INDENT, NEWLINE, is_blank, lex, lex_file, lex_text
 from .log import Log, logfilter
 from .peg import tokenize
-from .pratt import precedence
+from .pratt import pratt_parse1, precedence
 from .prettybt import prettybt
-from .syntax_tree import BaseNode, pprint
+from .syntax_tree import BaseNode, Rewriter, pprint
 
 log = Log("main")
 
+# PARSER is the compiled version of PROG (see --interpret-grammar)
+program = PARSER
 
-def parse(tree, blk, tokens):
-    """Traverse raw AST tree and parse it."""
-    for e in tree:
-        if isinstance(e, list):
-            assert hasattr(prog, "body"), f"cannot add statement {e} to {prog}"
-            parse(e, prog.body, tokens)
-        else:
-            try:
-                tokens = tokenize(e)
-                prog, r = PROG.match(tokens)
-                if r != len(tokens):
-                    raise Exception("Not all tokens were consumed. Trailing garbage?")
-                if not prog:  # skip comments # TODO: make it better
+
+def parse(lines, blk, show_tokens=False, indented=False):
+    """Parse a stream of tokenized lines (see lexer.lex) into blk.
+
+    indented -- lines are the indented body of blk (see LazyBlock).
+    Bodies of LazyBlocks are not parsed, their lines are collected.
+    """
+    blocks = [blk]
+    prog = None
+    lazy = None  # lines of LazyBlock being collected
+    depth = 0  # and how deep inside it we are
+    for tokens in lines:
+        if show_tokens:
+            print("tokens:", tokens)
+        tags = tokens.tags
+        pos = 0
+        if lazy is not None:
+            dedents = 0
+            while dedents < len(tags) and tags[dedents] == DEDENT.id:
+                dedents += 1
+            if dedents < depth:
+                depth -= dedents
+                if dedents < len(tags) and tags[dedents] == INDENT.id:
+                    depth += 1
+                lazy.append(tokens)
+                continue
+            pos = depth  # skip DEDENTs that close the lazy body
+            lazy = None
+        while pos < len(tags) and tags[pos] == DEDENT.id:
+            blocks.pop()
+            pos += 1
+        if pos == len(tags):
+            continue
+        try:
+            if tags[pos] == INDENT.id:
+                if indented:
+                    indented = False
+                elif isinstance(getattr(prog, "body", None), LazyBlock):
+                    lazy, depth = prog.body.lines, 1
+                    lazy.append(tokens)
                     continue
-                blk.append(prog)
-            except Exception as err:
-                raise Exception(f"line {e.lineno}: {e}\n{err}")
+                else:
+                    assert hasattr(prog, "body"), f"cannot add statement to {prog}"
+                    blocks.append(prog.body)
+                pos += 1
+            prog, r = program.match(tokens, pos)
+            if tags[r] != NEWLINE.id:
+                raise Exception("Not all tokens were consumed. Trailing garbage?")
+        except Exception as err:
+            raise Exception(f"line {tokens.lineno}: {tokens.text.strip()}\n{err}")
+        if not prog:  # TODO: make it better
+            continue
+        if isinstance(prog, BaseNode):
+            prog.lineno = tokens.lineno
+        blocks[-1].append(prog)
 
 
-def traverse(tree, f):
-    for i, e in enumerate(tree):
-        r = f(e)
-        if isinstance(r, BaseNode):
-            traverse(r, f)
-        tree[i] = r
+def load_body(blk):
+    """Parse and rewrite LazyBlock."""
+    if blk.span:
+        blk.append(pratt_parse1(blk.span))
+    if blk.lines:
+        parse(blk.lines, blk, indented=True)
+        blk.lines = []
+    rewrite(blk)
 
 
-def rewrite(tree):
-    def set_attr(elem):
-        if not isinstance(elem, Assign) or not isinstance(elem.left, Attr):
-            return elem
-        obj = elem.left.left
-        attr_name = elem.left.right.value
-        value = elem.right
-        return SetAttr(obj, attr_name, value)
-
-    traverse(tree, set_attr)
-
-    def get_attr(elem):
-        if not isinstance(elem, This):
-            return elem
-        assert isinstance(elem.arg, Var), type(elem.arg)
-        obj = Var("this")
-        attr_name = elem.arg.value
-        return GetAttr(obj, attr_name)
-
-    traverse(tree, get_attr)
-
-    def set_attr(elem):
-        if not isinstance(elem, Assign) or not isinstance(elem.left, GetAttr):
-            return elem
-        obj = elem.left.obj
-        attr_name = elem.left.attr_name
-        value = elem.right
-        return SetAttr(obj, attr_name, value)
-
-    traverse(tree, set_attr)
-
-    empty_args = Comma(flatten=False)
-
-    def call_obj0(e):
-        """Call object method without args."""
-        if isinstance(e, Call0) and isinstance(e.arg, Attr):
-            arg = e.arg
-            obj = arg.left
-            meth_name = arg.right.value
-            return CallObj(obj, meth_name, empty_args)
-        else:
-            return e
+def parse_file(path, show_tokens=False):
+    mainblk = Block()
+    parse(lex_file(path, skip=SKIP), mainblk, show_tokens)
+    return mainblk
+
+
+def load_program(path, use_cache=True, report=False):
+    """Parse and rewrite the program at path, or load it from the cache."""
+    if use_cache:
+        with open(path, "rb") as f:
+            key = cache.source_key(f.read())
+        tree = cache.load(path, key)
+        if tree is not None:
+            if report:
+                print("cache hit:", path, file=sys.stderr)
+            return tree
+    tree = parse_file(path)
+    rewrite(tree)
+    infer_types(tree)
+    if use_cache:
+        if precompile:
+            precompile(tree)
+        stored = cache.store(path, key, tree)
+        if report:
+            status = "stored" if stored else "not stored"
+            print("cache miss:", path, f"({status})", file=sys.stderr)
+    return tree
+
+
+def infer_types(tree):
+    """Annotate the tree with the types found by infer.py, returns the
+    messages about operations that would fail. They are kept in the tree,
+    so they are cached with it (see type_issues()).
+    """
+    from .infer import infer
+
+    issues = tree.__dict__["type_issues"] = infer(tree)
+    return issues
+
+
+def type_issues(tree):
+    """Messages of infer_types(), types are inferred if they were not."""
+    if "type_issues" in tree.__dict__:
+        return tree.__dict__["type_issues"]
+    return infer_types(tree)
+
+
+# directories where modules are looked for
+module_path = []
+# arguments of load_program() for modules, main() may change them
+module_cache = True
+cache_report = False
+# function that compiles the tree before it's cached (see --vm)
+precompile = None
+
+
+def find_module(name):
+    for directory in module_path:
+        path = os.path.join(directory, name + ".ls")
+        if os.path.isfile(path):
+            return path
+    raise ImportError(
+        'No module named "%s" (searched in %s)' % (name, ", ".join(module_path))
+    )
+
+
+def load_module(name):
+    """Find the module on module_path and load it
+    (see interpreter.import_module).
+    """
+    use_cache = module_cache and not interpreter.lazy_loader
+    return load_program(find_module(name), use_cache, cache_report)
+
+
+def find_imports(node):
+    """Names of the modules imported anywhere in the tree."""
+    if isinstance(node, Import):
+        yield node.name
+    elif isinstance(node, BaseNode):
+        for child in node:
+            yield from find_imports(child)
+
+
+def parse_source(source):
+    tree = Block()
+    parse(lex_text(source, skip=SKIP), tree)
+    rewrite(tree)
+    infer_types(tree)
+    return tree
+
+
+def make_bundle(main, output=None):
+    """Bundle the program at main and the modules it imports (found on
+    module_path) into output (main.lsz by default).
+    """
+    if not output:
+        output = os.path.splitext(main)[0] + bundle.SUFFIX
+    name = bundle.module_name(main)
+    modules = {}
+    todo = [(name, main)]
+    while todo:
+        name, path = todo.pop()
+        if name in modules:
+            continue
+        with open(path) as f:
+            source = f.read()
+        tree = parse_source(source)
+        modules[name] = source, tree
+        todo.extend((imp, find_module(imp)) for imp in find_imports(tree))
+    bundle.write(output, bundle.module_name(main), modules)
+    return output
+
+
+def build_executable(main, output=None):
+    """Compile the program at main into a native executable (main without
+    .ls by default), see cgen.py.
+    """
+    from . import cgen
+
+    if not output:
+        output = os.path.splitext(main)[0]
+        if output == main:
+            output += ".out"
+    try:
+        cgen.build(load_program(main), output, main)
+    except cgen.CompileError as e:
+        sys.exit("catstorm build: %s" % e)
+    return output
+
+
+def load_bundle(path):
+    """Load the main module of the bundle (see bundle.py),
+    modules are imported from the bundle too.
+    """
+    app = bundle.Bundle(path)
+
+    def load_module(name):
+        if name not in app.manifest["modules"]:
+            raise ImportError('No module named "%s" in %s' % (name, path))
+        tree = app.module(name)
+        if tree is None:
+            tree = parse_source(app.source(name))
+        return tree
+
+    interpreter.module_loader = load_module
+    return load_module(app.main)
+
+
+# max number of batches of parsed statements waiting for evaluation and
+# how long a batch may be collected (in seconds), see --stream
+STREAM_QUEUE_SIZE = 16
+STREAM_BATCH_TIME = 0.01
+
+
+class Pipe:
+    """Top-level block for parse() that passes statements to the queue
+    (or to anything with put(), e.g., arena.Arena) after the rewrite
+    when they are complete, i.e., when the next top-level statement
+    starts or at the end of input.
+
+    Statements are sent in batches, handing over every statement
+    to the other thread would be too slow.
+    """
+
+    def __init__(self, queue):
+        self.queue = queue
+        self.last = None
+        self.batch = []
+        self.started = 0
+
+    def append(self, node):
+        if self.last is not None:
+            if not self.batch:
+                self.started = time.perf_counter()
+            self.batch.append(rewrite(self.last))
+            if time.perf_counter() - self.started > STREAM_BATCH_TIME:
+                self.send()
+        self.last = node
+
+    def send(self):
+        self.queue.put(self.batch)
+        self.batch = []
+
+    def flush(self):
+        if self.last is not None:
+            self.batch.append(rewrite(self.last))
+            self.last = None
+        self.send()
+
+
+def parse_to_queue(path, queue, show_tokens=False):
+    """Producer of eval_stream(). Puts None at the end of input
+    or the exception if parsing failed.
+    """
+    pipe = Pipe(queue)
+    try:
+        parse(lex_file(path, skip=SKIP), pipe, show_tokens)
+        pipe.flush()
+    except Exception as err:
+        pipe.send()
+        queue.put(err)
+    else:
+        queue.put(None)
+
+
+def eval_stream(path, frame, show_tokens=False, install=None):
+    """Evaluate top-level statements of the program while it's being parsed
+    in another thread. Statements before a syntax error are evaluated.
+    install -- prepares Block to run with another engine
+    (closures.install, transpile.install, vm.install).
+    """
+    from queue import Queue
+    from threading import Thread
+
+    queue = Queue(STREAM_QUEUE_SIZE)
+    thread = Thread(target=parse_to_queue, args=(path, queue, show_tokens))
+    thread.daemon = True
+    thread.start()
+    while True:
+        batch = queue.get()
+        if batch is None:
+            break
+        if isinstance(batch, Exception):
+            raise batch
+        try:
+            for node in batch:
+                if install:
+                    block = Block(node, catch_ret=False)
+                    install(block)
+                    block.eval(frame)
+                else:
+                    node.eval(frame)
+        except ReturnException:
+            break  # like Block.eval()
+
+
+def parse_to_arena(path, show_tokens=False):
+    """Parse the program into arena.Arena statement by statement,
+    so the whole tree is never kept in memory. Returns ArenaBlock.
+    """
+    from .arena import Arena
+
+    packed = Arena()
+    pipe = Pipe(packed)
+    parse(lex_file(path, skip=SKIP), pipe, show_tokens)
+    pipe.flush()
+    return packed.root()
+
+
+class ParseResult:
+    """Parsed (and rewritten) source that can be updated after
+    an edit without parsing everything again (see reparse()).
+
+    lines -- physical lines of the source,
+    tree -- Block with top-level statements,
+    units -- [number of lines, number of nodes in tree] of every
+    top-level statement with its indented body (and the blank lines
+    and comments that follow it).
+    """
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.tree = Block()
+        self.units = []
+
 
-    traverse(tree, call_obj0)
+def parse_text(text):
+    """Parse the source, so it can be re-parsed incrementally."""
+    result = ParseResult(text.split("\n"))
+    result.units, nodes = parse_units(result.lines, 0, len(result.lines))
+    result.tree.extend(nodes)
+    return result
 
-    def comma_args(e):
-        """Ensure function arguments is a list."""
-        if isinstance(e, Call) and not isinstance(e.right, Comma):
-            callee = e.left
-            args = Comma(e.right, flatten=False)
-            return Call(callee, args)
+
+def reparse(result, start, end, text):
+    """Replace the source between start and end ((line, column) pairs,
+    0-based) with text. Only the top-level statements touched by the edit
+    are parsed again, new nodes are spliced into result.tree.
+    If there is a syntax error, result stays as it was.
+    """
+    (first_line, first_col), (last_line, last_col) = start, end
+    lines, units = result.lines, result.units
+    new = lines[first_line][:first_col] + text + lines[last_line][last_col:]
+    new = new.split("\n")
+
+    # units touched by the edit
+    i = node = a = 0
+    while i < len(units) - 1 and a + units[i][0] <= first_line:
+        a += units[i][0]
+        node += units[i][1]
+        i += 1
+    j, b = i, a + units[i][0]
+    while j < len(units) - 1 and b <= last_line:
+        j += 1
+        b += units[j][0]
+
+    lines = lines[:first_line] + new + lines[last_line + 1 :]
+    b += len(new) - (last_line + 1 - first_line)
+    # the edit may join units with their neighbours
+    while True:
+        if i > 0 and not starts_unit(lines, a):
+            i -= 1
+            a -= units[i][0]
+            node -= units[i][1]
+        elif j < len(units) - 1 and not starts_unit(lines, b):
+            j += 1
+            b += units[j][0]
         else:
-            return e
-
-    traverse(tree, comma_args)
-
-    def call_obj(e):
-        """Methods are called with CallObj, not Call."""
-        if isinstance(e, Call) and isinstance(e.left, Attr):
-            arg = e.left
-            obj = arg.left
-            meth_name = arg.right.value
-            args = e.right
-            # if not isinstance(args, Comma):
-            #   args = Comma(args, flatten=False)
-            return CallObj(obj, meth_name, args)
+            break
+
+    new_units, nodes = parse_units(lines, a, b)
+    old_nodes = sum(nnodes for _, nnodes in units[i : j + 1])
+    result.tree[node : node + old_nodes] = nodes
+    units[i : j + 1] = new_units
+    result.lines = lines
+    return result
+
+
+def starts_unit(lines, i):
+    """True if lines[i] begins a top-level statement."""
+    line = lines[i]
+    if not line or line[0].isspace():
+        return False
+    if i > 0 and lines[i - 1].rstrip("\r\n").endswith("\\"):
+        return False
+    return not is_blank(line, SKIP)
+
+
+def parse_units(lines, start, end):
+    """Parse and rewrite lines[start:end] (they are expected to
+    begin with a top-level statement). Returns units and nodes
+    (see ParseResult).
+    """
+    bounds = [start] + [i for i in range(start + 1, end) if starts_unit(lines, i)]
+    units = []
+    blk = Block()
+    for a, b in zip(bounds, bounds[1:] + [end]):
+        size = len(blk)
+        parse(lex(lines[a:b], skip=SKIP, lineno=a + 1), blk)
+        units.append([b - a, len(blk) - size])
+    rewrite(blk)
+    return units, list(blk)
+
+
+def compare_packrat(path, maxsize=0):
+    """Parse the file with and without packrat memoization,
+    check that the results are the same and show the timings.
+    """
+    saved = peg.packrat
+    results = {}
+    try:
+        for mode in (None, maxsize):
+            peg.packrat = mode
+            start = time.perf_counter()
+            tree = parse_file(path)
+            elapsed = time.perf_counter() - start
+            results[mode] = pprint(tree)
+            name = "plain" if mode is None else "packrat"
+            print("{:<10} {:8.2f}ms".format(name, elapsed * 1000))
+    finally:
+        peg.packrat = saved
+    same = results[None] == results[maxsize]
+    print("results are", "the same" if same else "DIFFERENT")
+    return same
+
+
+def check_file(path, check_types=False):
+    """Tokenize, parse and rewrite the file, with check_types report the
+    operations that would fail on the inferred types too.
+    Returns error message or None if everything is fine.
+    """
+    try:
+        tree = parse_file(path)
+        rewrite(tree)
+        issues = infer_types(tree) if check_types else []
+    except Exception as err:
+        return str(err) or repr(err)
+    return ("\n%s: " % path).join(issues) or None
+
+
+def find_scripts(paths):
+    """Files as they are and *.ls files found in directories."""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.endswith(".ls"):
+                        yield os.path.join(root, name)
         else:
-            return e
+            yield path
+
+
+def setup_worker(interpret_grammar, packrat):
+    """Make worker processes parse the same way as the main one."""
+    global program
+    program = PROG if interpret_grammar else PARSER
+    peg.packrat = packrat
+    logfilter.default = False
+
+
+def check(paths, jobs=None, check_types=False):
+    """Check many files in parallel (jobs -- number of processes,
+    all CPUs by default). Errors are reported per file.
+    Returns the number of files with errors.
+    """
+    paths = list(find_scripts(paths))
+    check_one = partial(check_file, check_types=check_types)
+    if jobs == 1:
+        return report(paths, map(check_one, paths))
+    from concurrent.futures import ProcessPoolExecutor
+
+    workers = jobs or os.cpu_count() or 1
+    chunksize = max(1, len(paths) // (4 * workers))
+    initargs = (program is PROG, peg.packrat)
+    with ProcessPoolExecutor(workers, None, setup_worker, initargs) as pool:
+        return report(paths, pool.map(check_one, paths, chunksize=chunksize))
+
+
+def report(paths, errors):
+    failed = 0
+    for path, error in zip(paths, errors):
+        if error:
+            failed += 1
+            print("{}: {}".format(path, error), file=sys.stderr)
+    print("checked {} files, {} failed".format(len(paths), failed))
+    return failed
+
+
+# Tree rewrites. Transforms are applied in the order they are defined
+# here, so later ones can rely on earlier ones (e.g., set_attr2 sees
+# GetAttr made by get_attr).
+rewriter = Rewriter()
+
+
+def rewrite(tree):
+    return rewriter.rewrite(tree)
+
+
+@rewriter.register(Assign)
+def set_attr(elem):
+    if not isinstance(elem.left, Attr):
+        return elem
+    obj = elem.left.left
+    attr_name = elem.left.right.value
+    value = elem.right
+    return SetAttr(obj, attr_name, value)
+
 
-    traverse(tree, call_obj)
+@rewriter.register(This)
+def get_attr(elem):
+    assert isinstance(elem.arg, Var), type(elem.arg)
+    obj = Var("this")
+    attr_name = elem.arg.value
+    return GetAttr(obj, attr_name)
 
-    def dict_rewrite(e):
-        if isinstance(e, DictTPL) and isinstance(e[0], Comma):
-            items = e[0]
-            del e[0]
-            e.extend(items)
+
+@rewriter.register(Assign)
+def set_attr2(elem):
+    if not isinstance(elem.left, GetAttr):
+        return elem
+    obj = elem.left.obj
+    attr_name = elem.left.attr_name
+    value = elem.right
+    return SetAttr(obj, attr_name, value)
+
+
+empty_args = Comma(flatten=False)
+
+
+@rewriter.register(Call0)
+def call_obj0(e):
+    """Call object method without args."""
+    if isinstance(e.arg, Attr):
+        arg = e.arg
+        obj = arg.left
+        meth_name = arg.right.value
+        return CallObj(obj, meth_name, empty_args)
+    else:
         return e
 
-    traverse(tree, dict_rewrite)
+
+@rewriter.register(Call)
+def comma_args(e):
+    """Ensure function arguments is a list."""
+    if not isinstance(e.right, Comma):
+        callee = e.left
+        args = Comma(e.right, flatten=False)
+        return Call(callee, args)
+    else:
+        return e
+
+
+@rewriter.register(Call)
+def call_obj(e):
+    """Methods are called with CallObj, not Call."""
+    if isinstance(e.left, Attr):
+        arg = e.left
+        obj = arg.left
+        meth_name = arg.right.value
+        args = e.right
+        # if not isinstance(args, Comma):
+        #   args = Comma(args, flatten=False)
+        return CallObj(obj, meth_name, args)
+    else:
+        return e
+
+
+@rewriter.register(DictTPL)
+def dict_rewrite(e):
+    if isinstance(e[0], Comma):
+        items = e[0]
+        del e[0]
+        e.extend(items)
+    return e
+
+
+@rewriter.register(StrTPL)
+def str_template(e):
+    """Parse (and rewrite) expressions in the string only once."""
+    return e.compile(rewrite)
 
 
 def main():
@@ -199,15 +696,167 @@ def main():
         default=False,
         help="set strict recursion limit (for debugging)",
     )
-    # parser.add_argument('-c', '--check-types', action='store_const', const=True,
-    # default=False, help="perform type inference and checking (disabled by
-    # default)")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="check files in parallel (with check or --dry-run)",
+    )
+    parser.add_argument(
+        "-I",
+        "--path",
+        action="append",
+        default=[],
+        help="look for modules in the directory (after the directory of [input])",
+    )
+    parser.add_argument(
+        "--lazy",
+        action="store_const",
+        const=True,
+        default=False,
+        help="parse function bodies on the first call (not with --dry-run)",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_const",
+        const=True,
+        default=False,
+        help="evaluate top-level statements while the rest of [input] is parsed",
+    )
+    parser.add_argument(
+        "--arena",
+        action="store_const",
+        const=True,
+        default=False,
+        help="keep the program in compact arrays, make nodes when they are run",
+    )
+    parser.add_argument(
+        "--no-quicken",
+        action="store_const",
+        const=True,
+        default=False,
+        help="don't specialize nodes of operators and attributes for the types "
+        "they see",
+    )
+    parser.add_argument(
+        "--closures",
+        action="store_const",
+        const=True,
+        default=False,
+        help="compile the tree into python closures before running it",
+    )
+    parser.add_argument(
+        "--transpile",
+        action="store_const",
+        const=True,
+        default=False,
+        help="translate the tree into python source and run it",
+    )
+    parser.add_argument(
+        "--emit-python",
+        action="store_const",
+        const=True,
+        default=False,
+        help="print the python source made by --transpile and exit",
+    )
+    parser.add_argument(
+        "--vm",
+        action="store_const",
+        const=True,
+        default=False,
+        help="compile the tree into bytecode and run it on a stack machine",
+    )
+    parser.add_argument(
+        "--dis",
+        action="store_const",
+        const=True,
+        default=False,
+        help="print the bytecode made by --vm and exit",
+    )
+    parser.add_argument(
+        "--emit-c",
+        action="store_const",
+        const=True,
+        default=False,
+        help="print the C source made by catstorm build and exit",
+    )
+    parser.add_argument(
+        "--packrat",
+        action="store_const",
+        const=True,
+        default=False,
+        help="memoize parsing results (packrat parsing)",
+    )
+    parser.add_argument(
+        "--memo-size",
+        type=int,
+        default=0,
+        help="max size of the packrat memo table (0 -- unbounded)",
+    )
+    parser.add_argument(
+        "--interpret-grammar",
+        action="store_const",
+        const=True,
+        default=False,
+        help="parse with PEG combinators instead of the compiled grammar",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_const",
+        const=True,
+        default=False,
+        help="do not read or write the %s cache" % cache.CACHE_DIR,
+    )
+    parser.add_argument(
+        "--clear-cache",
+        action="store_const",
+        const=True,
+        default=False,
+        help="remove the %s cache of [input] (or of the current directory)"
+        % cache.CACHE_DIR,
+    )
+    parser.add_argument(
+        "--cache-report",
+        action="store_const",
+        const=True,
+        default=False,
+        help="report cache hits and misses to stderr",
+    )
+    parser.add_argument(
+        "--parse-profile",
+        action="store_const",
+        const=True,
+        default=False,
+        help="report attempts, failures and time of grammar rules to stderr",
+    )
+    parser.add_argument(
+        "--compare-packrat",
+        action="store_const",
+        const=True,
+        default=False,
+        help="parse input with and without --packrat and compare",
+    )
+    parser.add_argument(
+        "-c",
+        "--check-types",
+        action="store_const",
+        const=True,
+        default=False,
+        help="report operations that would fail on the inferred types and exit "
+        "with status 1 if there are any (with check: in the checked files too)",
+    )
     parser.add_argument(
         "-r", "--raw", help="specify raw expression to execute", nargs="*"
     )
-    parser.add_argument("cmd", nargs="*")
+    parser.add_argument(
+        "cmd",
+        nargs="*",
+        help="[input] [args], check <files/dirs>, bundle <input> [output] "
+        "or build <input> [output]",
+    )
 
-    args = parser.parse_args()
+    args = parser.parse_intermixed_args()
     if args.debug:
         print("arguments:", args)
 
@@ -216,6 +865,11 @@ def main():
         for typ, op, prio in prec:
             print("{:<10} {:4}   {}".format(op, prio, typ))
 
+    if args.clear_cache:
+        cache.clear(args.cmd[0] if args.cmd else ".")
+        if not (args.cmd or args.raw):
+            sys.exit()
+
     if not (args.cmd or args.raw):
         if args.dry_run:
             sys.exit("Nothing to do, bye! :-*")
@@ -239,6 +893,59 @@ def main():
     if args.pretty_bt:
         sys.excepthook = prettybt
 
+    if args.interpret_grammar:
+        global program
+        program = PROG
+
+    if args.compare_packrat:
+        if not args.cmd:
+            sys.exit("--compare-packrat works only with [input]")
+        same = compare_packrat(args.cmd[0], args.memo_size)
+        sys.exit(0 if same else 1)
+
+    if args.packrat:
+        peg.packrat = args.memo_size
+
+    if args.parse_profile:
+        import atexit
+
+        peg.profile = peg.Profile(peg.rule_names(vars(grammar)))
+        atexit.register(peg.profile.report)
+
+    if args.no_quicken:
+        interpreter.quicken = False
+
+    if args.lazy and not (args.dry_run or args.arena):
+        interpreter.lazy_loader = load_body
+
+    # modules are looked for near the program, in --path and $CATSTORM_PATH
+    global module_cache, cache_report, precompile
+    script = args.cmd[0] if args.cmd else ""
+    if script in ("bundle", "build") and len(args.cmd) > 1:
+        script = args.cmd[1]
+    module_path[:] = [os.path.dirname(script) or "."] + args.path
+    if os.environ.get("CATSTORM_PATH"):
+        module_path.extend(os.environ["CATSTORM_PATH"].split(os.pathsep))
+    module_cache = not args.no_cache
+    cache_report = args.cache_report
+    interpreter.module_loader = load_module
+
+    # prepares the tree to run with the engine chosen by the flags
+    install = None
+    if args.closures:
+        from .closures import install
+    elif args.transpile or args.emit_python:
+        from functools import partial
+
+        from . import transpile
+
+        install = partial(transpile.install, path=script or "<raw>")
+    elif args.vm or args.dis:
+        from . import vm
+
+        install = vm.install
+        precompile = vm.compile_tree
+
     # INPUT FROM COMMAND LINE
     if args.raw:
         with Frame() as frame:
@@ -249,7 +956,7 @@ def main():
                 tokens = tokenize(src)
                 if args.tokens:
                     print("tokens:", tokens)
-                prog, r = PROG.match(tokens)
+                prog, r = program.match(tokens)
                 prog = Block(prog)
 
                 if args.ast:
@@ -262,29 +969,103 @@ def main():
                     print("AFTER TREE REWRITE")
                     print(pprint(prog))
 
+                # the types are not inferred for -r without --check-types:
+                # importing infer.py costs more than what its annotations
+                # save on one-liners (see benchmarks/startup.py)
+                issues = infer_types(prog) if args.check_types else []
+                if issues:
+                    for issue in issues:
+                        print("<raw %d>: %s" % (i, issue), file=sys.stderr)
+                    sys.exit(1)
+
                 # execute
+                if args.emit_python:
+                    print(transpile.transpile(prog, "<raw %d>" % i)[0])
+                    continue
+                if args.dis:
+                    vm.dis(prog)
+                    continue
                 if not args.dry_run:
+                    if install:
+                        install(prog)
                     result = prog.eval(frame)
                     print("result of expr %s:" % i, result)
         sys.exit()
 
+    # MAKE A BUNDLE
+    if args.cmd[0] == "bundle":
+        if len(args.cmd) not in (2, 3):
+            sys.exit("usage: catstorm bundle <input> [output]")
+        output = make_bundle(*args.cmd[1:])
+        print("bundled %s into %s" % (args.cmd[1], output))
+        sys.exit()
+
+    # MAKE A NATIVE EXECUTABLE
+    if args.cmd[0] == "build":
+        if len(args.cmd) not in (2, 3):
+            sys.exit("usage: catstorm build <input> [output]")
+        output = build_executable(*args.cmd[1:])
+        print("built %s into %s" % (args.cmd[1], output))
+        sys.exit()
+
+    # CHECK MANY FILES
+    if args.cmd[0] == "check" or (args.dry_run and args.jobs):
+        paths = args.cmd[1:] if args.cmd[0] == "check" else args.cmd
+        if not paths:
+            sys.exit("please specify files or directories to check")
+        failed = check(paths, args.jobs, args.check_types)
+        sys.exit(1 if failed else 0)
+
     # INPUT FROM FILE
-    # parse the file
-    with open(args.cmd[0]) as f:
-        src = f.read()
-    indented = indent_parse(src)
-    mainblk = Block()
-    parse(indented, mainblk, args.tokens)
+    # the cache holds fully parsed trees after the rewrite
+    if bundle.is_bundle(args.cmd[0]):
+        mainblk = load_bundle(args.cmd[0])
+    elif args.stream and not (
+        args.dry_run or args.emit_python or args.dis or args.emit_c
+    ):
+        mainblk = None  # parsed while being evaluated, see eval_stream()
+    elif args.arena and not args.ast:
+        mainblk = parse_to_arena(args.cmd[0], args.tokens)
+    elif args.no_cache or args.tokens or args.ast or args.lazy or args.parse_profile:
+        # parse the file
+        mainblk = parse_file(args.cmd[0], args.tokens)
 
-    if args.ast:
-        print("BEFORE TREE REWRITE")
-        print(pprint(mainblk))
+        if args.ast:
+            print("BEFORE TREE REWRITE")
+            print(pprint(mainblk))
 
-    rewrite(mainblk)
+        rewrite(mainblk)
+        infer_types(mainblk)
 
-    if args.ast:
-        print("AFTER TREE REWRITE")
-        print(pprint(mainblk))
+        if args.ast:
+            print("AFTER TREE REWRITE")
+            print(pprint(mainblk))
+    else:
+        mainblk = load_program(args.cmd[0], report=args.cache_report)
+
+    if args.emit_python:
+        source = transpile.read_source(args.cmd[0])
+        print(transpile.transpile(mainblk, args.cmd[0], source)[0], end="")
+        sys.exit(0)
+    if args.dis:
+        vm.dis(mainblk)
+        sys.exit(0)
+    if args.check_types:
+        if mainblk is None or args.arena:
+            sys.exit("--check-types does not work with --stream and --arena")
+        issues = type_issues(mainblk)
+        for issue in issues:
+            print("%s: %s" % (args.cmd[0], issue), file=sys.stderr)
+        if issues:
+            sys.exit(1)
+    if args.emit_c:
+        from . import cgen
+
+        try:
+            print(cgen.generate(mainblk, args.cmd[0]), end="")
+        except cgen.CompileError as e:
+            sys.exit("error: %s" % e)
+        sys.exit(0)
 
     # exit if code execution not required
     if args.dry_run:
@@ -292,7 +1073,12 @@ def main():
 
     # execute the code
     with Frame() as frame:
-        mainblk.eval(frame)
+        if mainblk is None:
+            eval_stream(args.cmd[0], frame, args.tokens, install)
+        else:
+            if install:
+                install(mainblk)
+            mainblk.eval(frame)
         progname = Str(args.cmd[0])
         cmd = [Str(s) for s in args.cmd[1:]]
         ret = frame["main"].Call((progname, Array(*cmd)), frame)
@@ -22,16 +22,21 @@ class Leaf:
         cls = self.__class__.__name__
         return "(%s %s)" % (cls, self.value)
 
-    def nud(self):
+    def nud(self, parser):
         return self
 
-    def led(self, left):
+    def led(self, left, parser):
         print("on the left", left)
         return left
 
 
 class BaseNode:
-    """Base class for nodes that support iteration over their fields."""
+    """Base class for nodes that support iteration over their fields.
+    lineno -- line of the source where the statement starts (set by the
+    parser for statements only).
+    """
+
+    lineno = None
 
 
 class Node(BaseNode):
@@ -49,7 +54,7 @@ class Node(BaseNode):
         for name, value in zip(self.fields, args):
             setattr(self, name, value)
 
-    def nud(self):
+    def nud(self, parser):
         return self
 
     def __setitem__(self, idx, value):
@@ -57,7 +62,7 @@ class Node(BaseNode):
         setattr(self, attr, value)
 
     def __setattr__(self, name, value):
-        if name not in self.fields:
+        if name not in self.fields and name != "lineno":
             raise AttributeError(
                 'Unknown attribute "%s" for %s (%s)' % (name, type(self), self.fields)
             )
@@ -100,6 +105,83 @@ class Binary(Node):
     fields = ["left", "right"]
 
 
+class Rewriter:
+    """Rewrites the tree in one post-order walk.
+
+    Transforms are registered for node classes (including base classes)
+    and take a node and return a replacement (or the same node).
+    A node gets transforms after its children were rewritten, in the order
+    of registration. If a transform returns a node of another class,
+    only transforms registered after it are tried on the new node.
+    """
+
+    def __init__(self):
+        self.rules = []  # [(class, transform)]
+        self.dispatch = {}  # type -> [(rule index, transform)]
+        self.children = {}  # type -> names of fields (None for lists)
+
+    def register(self, cls):
+        """Decorator that adds a transform for nodes of the class."""
+
+        def decorator(transform):
+            self.rules.append((cls, transform))
+            self.dispatch.clear()
+            return transform
+
+        return decorator
+
+    def transforms(self, typ):
+        try:
+            return self.dispatch[typ]
+        except KeyError:
+            pass
+        transforms = self.dispatch[typ] = [
+            (idx, transform)
+            for idx, (cls, transform) in enumerate(self.rules)
+            if issubclass(typ, cls)
+        ]
+        return transforms
+
+    def fields(self, typ):
+        try:
+            return self.children[typ]
+        except KeyError:
+            pass
+        fields = self.children[typ] = None if issubclass(typ, list) else typ.fields
+        return fields
+
+    def rewrite(self, node):
+        """Returns the rewritten node (children are changed in place)."""
+        if isinstance(node, BaseNode):
+            fields = self.fields(type(node))
+            if fields is None:
+                for idx, child in enumerate(node):
+                    new = self.rewrite(child)
+                    if new is not child:
+                        node[idx] = new
+            else:
+                for name in fields:
+                    child = getattr(node, name)
+                    new = self.rewrite(child)
+                    if new is not child:
+                        setattr(node, name, new)
+        return self.apply(node)
+
+    def apply(self, node, last=-1):
+        """Apply transforms registered after the rule with index last."""
+        for idx, transform in self.transforms(type(node)):
+            if idx <= last:
+                continue
+            new = transform(node)
+            if new is not node:
+                lineno = getattr(node, "lineno", None)
+                if lineno is not None and isinstance(new, BaseNode):
+                    new.lineno = lineno
+                # the class may have changed, and so the transforms
+                return self.apply(new, idx)
+        return node
+
+
 def clsname(node):
     return node.__class__.__name__
 
@@ -0,0 +1,453 @@
+#!/usr/bin/env python3
+"""
+Backend that turns the rewritten tree into python source (see --transpile).
+
+Every function body becomes a def taking the frame, loops become
+python loops, ret becomes return and "x if c else y" a conditional
+expression. The code is compiled with compile() and run against
+runtime.py, the values are the usual interpreter objects.
+
+Variables stay in frames: a function sees the variables of its caller
+(frames are chained at the call), so they cannot be python locals.
+Nodes that have no translation are run by their own eval().
+
+Statements keep the line they came from (see BaseNode.lineno), the
+code is compiled with these lines and the name of the .ls file, and
+the source is put into linecache, so tracebacks show catstorm lines.
+"""
+
+import ast
+import linecache
+
+from .interpreter import (
+    FALSE,
+    NONE,
+    TRUE,
+    Add,
+    And,
+    Append,
+    ArrayNode,
+    Assert,
+    Assign,
+    Attr,
+    Bool,
+    Call,
+    Call0,
+    CallObj,
+    CharSepVals,
+    Class,
+    Comma,
+    Eq,
+    ForLoop,
+    Func,
+    GetAttr,
+    Gt,
+    If,
+    IfElse,
+    Import,
+    Int,
+    LazyBlock,
+    Lt,
+    Minus,
+    Mul,
+    Not,
+    NotEq,
+    Or,
+    Parens,
+    Print,
+    Ret,
+    SetAttr,
+    StrTemplate,
+    Sub,
+    Subscript,
+    Value,
+    Var,
+    WhileLoop,
+)
+from .syntax_tree import BaseNode
+
+HEADER = ["from catstorm.runtime import *"]
+
+# operators -> helpers of the runtime
+OPERATORS = {
+    Add: "add",
+    Sub: "sub",
+    Mul: "mul",
+    Eq: "eq",
+    NotEq: "ne",
+    Gt: "gt",
+    Lt: "lt",
+    Append: "append",
+}
+
+CONSTANTS = {id(TRUE): "TRUE", id(FALSE): "FALSE", id(NONE): "NONE"}
+
+
+class Transpiler:
+    """Generates a python module for a tree and its function bodies.
+
+    path -- name of the catstorm source (for comments and tracebacks),
+    source -- its text (optional, lines are quoted in comments).
+    """
+
+    def __init__(self, path, source=None):
+        self.path = path
+        self.source = source.splitlines() if source else []
+        self.lines = []  # python code
+        self.linemap = []  # line of python code -> line of catstorm
+        self.lineno = 1
+        self.consts = {}  # name -> object the code refers to
+        self.const_names = {}  # id(object) -> name
+        self.literals = []  # module-level definitions of literals
+        self.defs = []  # (Block, name of def) to install
+        self.todo = []  # (name, Block, line) of bodies to translate
+        self.names = {"program"}
+
+    # output
+
+    def emit(self, ind, line):
+        self.lines.append("    " * ind + line)
+        self.linemap.append(self.lineno)
+
+    def statement_line(self, node, ind):
+        lineno = getattr(node, "lineno", None)
+        if lineno is None or lineno == self.lineno:
+            return
+        self.lineno = lineno
+        if 0 < lineno <= len(self.source):
+            self.emit(ind, "# %d: %s" % (lineno, self.source[lineno - 1].strip()))
+
+    def const(self, obj, prefix="n"):
+        """Name under which the code refers to obj."""
+        try:
+            return self.const_names[id(obj)]
+        except KeyError:
+            pass
+        name = self.const_names[id(obj)] = "%s%d" % (prefix, len(self.consts))
+        self.consts[name] = obj
+        return name
+
+    def literal(self, code):
+        """Name of a module-level literal (same literals share it)."""
+        key = "literal", code
+        if key not in self.const_names:
+            name = self.const_names[key] = "k%d" % len(self.literals)
+            self.literals.append("%s = %s" % (name, code))
+        return self.const_names[key]
+
+    def unique(self, name):
+        result, i = name, 1
+        while result in self.names:
+            i += 1
+            result = "%s_%d" % (name, i)
+        self.names.add(result)
+        return result
+
+    # translation
+
+    def module(self, tree):
+        """Translate tree (top-level Block) and the bodies it defines,
+        returns the source.
+        """
+        self.function("program", tree)
+        while self.todo:
+            self.function(*self.todo.pop(0))
+        header = HEADER + ([""] + self.literals if self.literals else [])
+        self.linemap = [1] * len(header) + self.linemap
+        self.lines = header + self.lines
+        return "\n".join(self.lines) + "\n"
+
+    def body(self, func, prefix="func_"):
+        """Translate the body of a Func later."""
+        body = func.body
+        if isinstance(body, LazyBlock) and not body.loaded:
+            return  # see install()
+        name = self.unique(prefix + func.name)
+        self.todo.append((name, body, getattr(func, "lineno", None)))
+
+    def function(self, name, block, lineno=None):
+        self.defs.append((block, name))
+        self.frame = "frame"
+        self.scope = "d"
+        self.temps = 0
+        self.catch = False  # if ReturnException may be raised by the body
+        self.returns = block.catch_ret  # if ret returns from the def
+        self.lineno = lineno or block.lineno or self.lineno
+        self.emit(0, "")
+        self.emit(0, "")
+        self.emit(0, "def %s(frame):" % name)
+        start = len(self.lines)
+        self.emit(1, "d = frame.dict")
+        self.block(block, 1, "return")
+        if self.catch:
+            self.lines[start:] = ["    " + line for line in self.lines[start:]]
+            self.lines.insert(start, "    try:")
+            self.linemap.insert(start, self.linemap[start])
+            self.emit(1, "except ReturnException as e:")
+            self.emit(2, "return e.args[0]")
+
+    def temp(self):
+        self.temps += 1
+        return "t%d" % self.temps
+
+    def block(self, block, ind, target=None):
+        if not block:
+            if target:
+                self.emit(ind, assign(target, "NONE"))
+            else:
+                self.emit(ind, "pass")
+            return
+        last = len(block) - 1
+        for i, node in enumerate(block):
+            self.statement(node, ind, target if i == last else None)
+
+    def statement(self, node, ind, target=None):
+        """Emit node as a statement, its value goes to target
+        (a variable or "return", None if the value is not needed).
+        """
+        self.statement_line(node, ind)
+        cls = type(node)
+        if cls is Ret and self.returns:
+            self.emit(ind, "return " + self.expr(node.arg))
+        elif cls is Assign and isinstance(node.left, Var):
+            lhs = "%s[%r]" % (self.scope, node.left.value)
+            if target and target != "return":
+                lhs = "%s = %s" % (target, lhs)
+            self.emit(ind, "%s = %s" % (lhs, self.expr(node.right)))
+            if target == "return":
+                self.emit(ind, "return %s[%r]" % (self.scope, node.left.value))
+        elif cls is Assign and isinstance(node.left, Subscript):
+            value = self.temp()
+            self.emit(ind, "%s = %s" % (value, self.expr(node.right)))
+            owner, key = self.expr(node.left.left), self.expr(node.left.right)
+            self.emit(ind, "(%s).SetItem(%s, %s)" % (owner, key, value))
+            if target:
+                self.emit(ind, assign(target, value))
+        elif cls is SetAttr and isinstance(node.attr_name, str):
+            obj, value = self.expr(node.obj), self.expr(node.value)
+            self.emit(ind, "(%s).SetAttr(%r, %s)" % (obj, node.attr_name, value))
+            if target:
+                self.emit(ind, assign(target, "None"))
+        elif cls is If:
+            self.emit(ind, "if (%s).to_bool():" % self.expr(node.clause))
+            self.block(node.body, ind + 1, target)
+            if target:
+                self.emit(ind, "else:")
+                self.emit(ind + 1, assign(target, "None"))
+        elif cls is ForLoop and isinstance(node.var, Var):
+            self.for_loop(node, ind, target)
+        elif cls is WhileLoop:
+            self.emit(ind, "while %s:" % self.expr(node.expr))
+            self.block(node.body, ind + 1)
+            if target:
+                self.emit(ind, assign(target, "None"))
+        else:
+            expr = self.expr(node)
+            self.emit(ind, assign(target, expr) if target else expr)
+
+    def for_loop(self, node, ind, target):
+        frame, scope = self.frame, self.scope
+        it, value = self.temp(), self.temp()
+        result = target if target and target != "return" else self.temp()
+        self.emit(ind, "%s = (%s).Iter()" % (it, self.expr(node.expr)))
+        self.emit(ind, "%s = NONE" % result)
+        # the body runs in a new frame
+        self.frame, self.scope = "frame%d" % ind, "d%d" % ind
+        self.emit(ind, "%s = Frame(%s)" % (self.frame, frame))
+        self.emit(ind, "%s = %s.dict" % (self.scope, self.frame))
+        self.emit(ind, "while True:")
+        self.emit(ind + 1, "%s = %s.next()" % (value, it))
+        self.emit(ind + 1, "if %s is None:" % value)
+        self.emit(ind + 2, "break")
+        self.emit(ind + 1, "%s[%r] = %s" % (self.scope, node.var.value, value))
+        self.block(node.body, ind + 1, result)
+        self.frame, self.scope = frame, scope
+        if target == "return":
+            self.emit(ind, "return " + result)
+
+    def expr(self, node):
+        """Python expression evaluating the node."""
+        cls = type(node)
+        if id(node) in CONSTANTS:
+            return CONSTANTS[id(node)]
+        if cls is Int:
+            return self.literal("Int(%r)" % node.value)
+        if isinstance(node, Value) and cls.eval in (Value.eval, Bool.eval):
+            return self.const(node)
+        if cls is Var:
+            name = node.value
+            return "(%s[%r] if %r in %s else %s[%r])" % (
+                self.scope,
+                name,
+                name,
+                self.scope,
+                self.frame,
+                name,
+            )
+        if cls in OPERATORS:
+            left, right = self.expr(node.left), self.expr(node.right)
+            return "%s(%s, %s)" % (OPERATORS[cls], left, right)
+        if cls is Parens:
+            return self.expr(node.arg)
+        if cls is Assign and isinstance(node.left, Var):
+            value = self.expr(node.right)
+            return "assign(%s, %r, %s)" % (self.scope, node.left.value, value)
+        if cls is And:
+            left, right = self.expr(node.left), self.expr(node.right)
+            return "(%s if (%s).to_bool() else FALSE)" % (right, left)
+        if cls is Or:
+            tmp = self.temp()
+            left, right = self.expr(node.left), self.expr(node.right)
+            return "(%s if (%s := %s).to_bool() else %s)" % (tmp, tmp, left, right)
+        if cls is Not:
+            return "(FALSE if (%s).to_bool() else TRUE)" % self.expr(node.arg)
+        if cls is Minus:
+            return "(%s).Minus()" % self.expr(node.arg)
+        if cls is IfElse:
+            cond = self.expr(node.cond)
+            then, otherwise = self.expr(node.then), self.expr(node.otherwise)
+            return "(%s if (%s).to_bool() else %s)" % (then, cond, otherwise)
+        if cls is Subscript:
+            left, right = self.expr(node.left), self.expr(node.right)
+            return "(%s).GetItem(%s)" % (left, right)
+        if isinstance(node, CharSepVals):
+            items = [self.expr(e) for e in node] + ["flatten=False"]
+            return "%s(%s)" % (self.const(cls, "cls"), ", ".join(items))
+        if cls is ArrayNode:
+            return "Array(%s)" % ", ".join(self.expr(e) for e in node)
+        if cls is StrTemplate:
+            return self.template(node)
+        if cls is Print:
+            return "show(%s, %s)" % (self.expr(node.arg), self.frame)
+        if cls is Ret:
+            self.catch = self.returns
+            return "ret(%s)" % self.expr(node.arg)
+        if cls is Assert:
+            return "assert_(%s, %s)" % (self.expr(node.arg), self.const(node.arg))
+        if cls is Call:
+            args = [self.frame, "callable_(%s)" % self.expr(node.left)]
+            if not isinstance(node.right, Comma):
+                args.append(self.expr(node.right))
+                return "call1(%s)" % ", ".join(args)
+            args += [self.expr(e) for e in node.right]
+            return "call(%s)" % ", ".join(args)
+        if cls is Call0 and isinstance(node.arg, Var):
+            return "call0(%s, %s)" % (self.frame, self.expr(node.arg))
+        if cls is CallObj and isinstance(node.args, Comma):
+            args = [self.frame, self.expr(node.obj), repr(node.meth_name)]
+            args += [self.expr(e) for e in node.args]
+            return "call_method(%s)" % ", ".join(args)
+        if cls is GetAttr and isinstance(node.attr_name, str):
+            return "(%s).GetAttr(%r)" % (self.expr(node.obj), node.attr_name)
+        if cls is SetAttr and isinstance(node.attr_name, str):
+            obj, value = self.expr(node.obj), self.expr(node.value)
+            return "set_attr(%s, %r, %s)" % (obj, node.attr_name, value)
+        if cls is Attr:
+            return "(%s).GetAttr(%r)" % (self.expr(node.left), node.right.value)
+        if cls is Import:
+            return "import_(%s, %r)" % (self.frame, node.name)
+        if cls is Func:
+            self.body(node)
+            return "assign(%s, %r, %s)" % (self.scope, node.name, self.const(node))
+        if cls is Class:
+            for member in node.body:
+                if isinstance(member, Func):
+                    self.body(member, "method_%s_" % node.name)
+            return "assign(%s, %r, %s)" % (self.scope, node.name, self.const(node))
+        # no translation, run the tree
+        if contains_ret(node):
+            self.catch = self.returns
+        return "%s.eval(%s)" % (self.const(node), self.frame)
+
+    def template(self, node):
+        parts = [repr(node.chunks[0])] if node.chunks[0] else []
+        for expr, chunk in zip(node, node.chunks[1:]):
+            parts.append("text(%s, %s)" % (self.expr(expr), self.frame))
+            if chunk:
+                parts.append(repr(chunk))
+        if not parts:
+            return self.literal("Str('')")
+        if len(parts) == 1 and not len(node):
+            return self.literal("Str(%s)" % parts[0])
+        return "Str(''.join((%s,)))" % ", ".join(parts)
+
+    def compile(self, source):
+        """Compile the source with the lines of catstorm code."""
+        tree = ast.parse(source, self.path)
+        for node in ast.walk(tree):
+            if hasattr(node, "lineno"):
+                node.lineno = self.linemap[node.lineno - 1]
+                node.end_lineno = self.linemap[(node.end_lineno or 1) - 1]
+                node.end_lineno = max(node.end_lineno, node.lineno)
+        return compile(tree, self.path, "exec")
+
+
+def assign(target, expr):
+    if target == "return":
+        return "return " + expr
+    return "%s = %s" % (target, expr)
+
+
+def contains_ret(node):
+    if isinstance(node, Ret):
+        return True
+    if isinstance(node, BaseNode):
+        return any(contains_ret(child) for child in node)
+    return False
+
+
+def read_source(path):
+    """Text of the program, None if it's not a source file (e.g., a bundle)."""
+    try:
+        with open(path) as f:
+            return f.read()
+    except (OSError, UnicodeDecodeError):
+        return None
+
+
+def transpile(tree, path="<catstorm>", source=None):
+    """Returns (python source, Transpiler) for the tree."""
+    transpiler = Transpiler(path, source)
+    return transpiler.module(tree), transpiler
+
+
+def install(tree, path="<catstorm>"):
+    """Translate the tree and make the python functions eval() of the
+    top-level block and of function bodies. Bodies that are not loaded
+    yet are translated on the first call.
+    """
+    if "eval" in tree.__dict__:
+        return  # already done
+    source = read_source(path)
+    if source is not None:
+        lines = source.splitlines(keepends=True)
+        linecache.cache[path] = len(source), None, lines, path
+    code, transpiler = transpile(tree, path, source)
+    namespace = dict(transpiler.consts)
+    exec(transpiler.compile(code), namespace)
+    for block, name in transpiler.defs:
+        block.eval = namespace[name]
+    install_lazy(tree, path)
+
+
+def install_lazy(node, path):
+    """Make bodies that are not loaded yet translate themselves."""
+    if isinstance(node, Func) and isinstance(node.body, LazyBlock):
+        if not node.body.loaded and "eval" not in node.body.__dict__:
+            node.body.eval = later(node.body, path)
+    elif isinstance(node, Class):
+        for member in node.body:
+            install_lazy(member, path)
+    elif isinstance(node, BaseNode) and not isinstance(node, LazyBlock):
+        for child in node:
+            install_lazy(child, path)
+
+
+def later(body, path):
+    def run(frame):
+        body.load()
+        del body.eval
+        install(body, path)
+        return body.eval(frame)
+
+    return run
@@ -0,0 +1,694 @@
+#!/usr/bin/env python3
+"""
+Stack-based virtual machine (see --vm and --dis).
+
+A block is compiled into Code: a flat array of instructions, two
+words each (opcode and argument), with pools of constants and names
+the arguments refer to. run() executes it with one dispatch loop and
+an explicit stack of values. Calls of functions compiled to Code push
+the state of the caller on a stack of calls instead of calling run()
+again, so deep recursion does not use the python stack. Variables
+are looked up along the chain of frames with a loop for the same
+reason (Frame.__getitem__ is recursive).
+
+The Code of a function body is compiled on its first call and kept
+in the Block (block.code), so it is pickled with the tree and
+cached (see storm.precompile). run() of the body is installed as
+eval() of the Block, so code outside the VM (Func.Call, Class.Call,
+methods of modules) runs the bytecode too. Nodes without a
+translation are run by their own eval() (EVAL instruction).
+"""
+
+from array import array
+from functools import partial
+
+from . import interpreter
+from .frame import Frame
+from .interpreter import (
+    FALSE,
+    NONE,
+    TRUE,
+    Add,
+    And,
+    Append,
+    Array,
+    ArrayNode,
+    Assert,
+    Assign,
+    Attr,
+    Bool,
+    Call,
+    Call0,
+    CallObj,
+    CharSepVals,
+    Class,
+    Comma,
+    Eq,
+    ForLoop,
+    Func,
+    GetAttr,
+    Gt,
+    If,
+    IfElse,
+    Import,
+    Int,
+    LazyBlock,
+    Lt,
+    Minus,
+    Mul,
+    Not,
+    NotEq,
+    Or,
+    Parens,
+    Print,
+    Ret,
+    ReturnException,
+    SetAttr,
+    Str,
+    StrTemplate,
+    Sub,
+    Subscript,
+    Value,
+    Var,
+    WhileLoop,
+)
+from .runtime import assert_, binop, callable_, show, text
+from .syntax_tree import BaseNode
+
+################
+# INSTRUCTIONS #
+################
+
+OPNAMES = [
+    "LOAD_NAME",  # push the variable names[arg]
+    "LOAD_CONST",  # push consts[arg]
+    "STORE_NAME",  # frame[names[arg]] = top, the value stays on the stack
+    "POP",
+    "BINARY",  # pop right and left, push the result of BINARY_OPS[arg]
+    "JUMP_UNLESS",  # pop, jump to arg if value.to_bool() is FALSE
+    "JUMP_IF_FALSY",  # pop, jump to arg if the value is false for python
+    "JUMP",
+    "CALL",  # pop arg values and the function, push the result
+    "CALL_VALUE",  # call with one value, spread if it's Comma
+    "CALL_METHOD",  # arg = name << 8 | number of values, "this" is below them
+    "CALL0",  # call without arguments
+    "CHECK_CALLABLE",  # fail if top can't be called
+    "RETURN",  # return top from the code
+    "RAISE_RETURN",  # raise ReturnException with top (ret outside a function)
+    "FOR_ITER",  # push the next value of the iterator on top, or pop it
+    # and jump to arg when it's exhausted
+    "GET_ITER",
+    "ENTER_FRAME",  # the code runs in a new frame (loop bodies)
+    "LEAVE_FRAME",
+    "PUT",  # pop, replace the arg-th value from the top
+    "GET_ATTR",  # replace the object with its attribute names[arg]
+    "SET_ATTR",  # pop the value and the object, push None
+    "GET_ITEM",
+    "SET_ITEM",  # pop key, owner and the value, push the value
+    "AND",  # if top is false replace it with FALSE and jump to arg, else pop
+    "OR",  # if top is true jump to arg, else pop
+    "NOT",
+    "MINUS",
+    "BUILD_SEQ",  # pop arg values and the class, push class(*values)
+    "BUILD_ARRAY",
+    "TEXT",  # replace top with its text in a string template (python str)
+    "BUILD_STR",  # join arg strings into Str
+    "PRINT",
+    "ASSERT",  # consts[arg] is the asserted expression (for the message)
+    "IMPORT",
+    "EVAL",  # push consts[arg].eval(frame)
+]
+(
+    LOAD_NAME,
+    LOAD_CONST,
+    STORE_NAME,
+    POP,
+    BINARY,
+    JUMP_UNLESS,
+    JUMP_IF_FALSY,
+    JUMP,
+    CALL,
+    CALL_VALUE,
+    CALL_METHOD,
+    CALL0,
+    CHECK_CALLABLE,
+    RETURN,
+    RAISE_RETURN,
+    FOR_ITER,
+    GET_ITER,
+    ENTER_FRAME,
+    LEAVE_FRAME,
+    PUT,
+    GET_ATTR,
+    SET_ATTR,
+    GET_ITEM,
+    SET_ITEM,
+    AND,
+    OR,
+    NOT,
+    MINUS,
+    BUILD_SEQ,
+    BUILD_ARRAY,
+    TEXT,
+    BUILD_STR,
+    PRINT,
+    ASSERT,
+    IMPORT,
+    EVAL,
+) = range(len(OPNAMES))
+
+JUMPS = {JUMP_UNLESS, JUMP_IF_FALSY, JUMP, FOR_ITER, AND, OR}
+NAMES = {LOAD_NAME, STORE_NAME, GET_ATTR, SET_ATTR, IMPORT}
+CONSTS = {LOAD_CONST, ASSERT, EVAL}
+
+# operator node -> argument of BINARY
+BINARY_OPS = [Add, Sub, Mul, Eq, NotEq, Gt, Lt, Append]
+# what the operators do when both operands are Int
+INT_OPS = [cls.int_op for cls in BINARY_OPS]
+
+
+class Code:
+    """Compiled block.
+
+    ops -- instructions, opcode and argument for each,
+    lines -- line of the source for each instruction,
+    consts, names -- objects and names the arguments refer to,
+    returns -- ret returns from the code (it's a function body).
+    """
+
+    def __init__(self, name, ops, lines, consts, names, returns=True):
+        self.name = name
+        self.ops = ops
+        self.lines = lines
+        self.consts = consts
+        self.names = names
+        self.returns = returns
+
+    def __repr__(self):
+        return "<code %s>" % self.name
+
+
+############
+# COMPILER #
+############
+
+
+class Compiler:
+    """Compiles a block into Code."""
+
+    def __init__(self, name, returns=True):
+        self.name = name
+        self.returns = returns
+        self.ops = array("i")
+        self.lines = array("i")
+        self.lineno = 0
+        self.consts = []
+        self.const_index = {}  # id(obj) -> index in consts
+        self.names = []
+        self.name_index = {}
+
+    def emit(self, op, arg=0):
+        """Add the instruction, returns its position."""
+        self.ops.append(op)
+        self.ops.append(arg)
+        self.lines.append(self.lineno)
+        return len(self.ops) - 2
+
+    def target(self, at):
+        """Make the jump at the position go to the next instruction."""
+        self.ops[at + 1] = len(self.ops)
+
+    def const(self, obj):
+        try:
+            return self.const_index[id(obj)]
+        except KeyError:
+            self.consts.append(obj)
+            index = self.const_index[id(obj)] = len(self.consts) - 1
+            return index
+
+    def name_(self, name):
+        try:
+            return self.name_index[name]
+        except KeyError:
+            self.names.append(name)
+            index = self.name_index[name] = len(self.names) - 1
+            return index
+
+    def code(self, block):
+        self.block(block)
+        self.emit(RETURN)
+        return Code(
+            self.name, self.ops, self.lines, self.consts, self.names, self.returns
+        )
+
+    def block(self, block):
+        """Compile statements, the value of the last one stays on the stack."""
+        if not block:
+            self.emit(LOAD_CONST, self.const(NONE))
+        for i, node in enumerate(block):
+            if i:
+                self.emit(POP)
+            self.lineno = getattr(node, "lineno", None) or self.lineno
+            self.expr(node)
+
+    def expr(self, node):
+        """Compile the node, its value is pushed on the stack."""
+        emit, cls = self.emit, type(node)
+        if cls is Var:
+            emit(LOAD_NAME, self.name_(node.value))
+        elif isinstance(node, Value) and cls.eval in (Value.eval, Bool.eval):
+            emit(LOAD_CONST, self.const(node))
+        elif cls in BINARY_OPS:
+            self.expr(node.left)
+            self.expr(node.right)
+            emit(BINARY, BINARY_OPS.index(cls))
+        elif cls is Assign and isinstance(node.left, Var):
+            self.expr(node.right)
+            emit(STORE_NAME, self.name_(node.left.value))
+        elif cls is Assign and isinstance(node.left, Subscript):
+            self.expr(node.right)
+            self.expr(node.left.left)
+            self.expr(node.left.right)
+            emit(SET_ITEM)
+        elif cls is Parens:
+            self.expr(node.arg)
+        elif cls is If:
+            self.expr(node.clause)
+            skip = emit(JUMP_UNLESS)
+            self.block(node.body)
+            end = emit(JUMP)
+            self.target(skip)
+            emit(LOAD_CONST, self.const(None))
+            self.target(end)
+        elif cls is IfElse:
+            self.expr(node.cond)
+            skip = emit(JUMP_UNLESS)
+            self.expr(node.then)
+            end = emit(JUMP)
+            self.target(skip)
+            self.expr(node.otherwise)
+            self.target(end)
+        elif cls is WhileLoop:
+            start = len(self.ops)
+            self.expr(node.expr)
+            end = emit(JUMP_IF_FALSY)
+            self.block(node.body)
+            emit(POP)
+            emit(JUMP, start)
+            self.target(end)
+            emit(LOAD_CONST, self.const(None))
+        elif cls is ForLoop and isinstance(node.var, Var):
+            # the stack holds the result and the iterator
+            emit(LOAD_CONST, self.const(NONE))
+            self.expr(node.expr)
+            emit(GET_ITER)
+            emit(ENTER_FRAME)
+            start = emit(FOR_ITER)
+            emit(STORE_NAME, self.name_(node.var.value))
+            emit(POP)
+            self.block(node.body)
+            emit(PUT, 2)
+            emit(JUMP, start)
+            self.target(start)
+            emit(LEAVE_FRAME)
+        elif cls is Ret:
+            self.expr(node.arg)
+            emit(RETURN if self.returns else RAISE_RETURN)
+        elif cls is Call:
+            self.expr(node.left)
+            emit(CHECK_CALLABLE)
+            if isinstance(node.right, Comma):
+                for arg in node.right:
+                    self.expr(arg)
+                emit(CALL, len(node.right))
+            else:
+                self.expr(node.right)
+                emit(CALL_VALUE)
+        elif cls is Call0 and isinstance(node.arg, Var):
+            self.expr(node.arg)
+            emit(CALL0)
+        elif cls is CallObj and isinstance(node.args, Comma) and len(node.args) < 256:
+            self.expr(node.obj)
+            for arg in node.args:
+                self.expr(arg)
+            emit(CALL_METHOD, self.name_(node.meth_name) << 8 | len(node.args))
+        elif cls is GetAttr and isinstance(node.attr_name, str):
+            self.expr(node.obj)
+            emit(GET_ATTR, self.name_(node.attr_name))
+        elif cls is Attr:
+            self.expr(node.left)
+            emit(GET_ATTR, self.name_(node.right.value))
+        elif cls is SetAttr and isinstance(node.attr_name, str):
+            self.expr(node.obj)
+            self.expr(node.value)
+            emit(SET_ATTR, self.name_(node.attr_name))
+        elif cls is Subscript:
+            self.expr(node.left)
+            self.expr(node.right)
+            emit(GET_ITEM)
+        elif cls is And or cls is Or:
+            self.expr(node.left)
+            end = emit(AND if cls is And else OR)
+            self.expr(node.right)
+            self.target(end)
+        elif cls is Not:
+            self.expr(node.arg)
+            emit(NOT)
+        elif cls is Minus:
+            self.expr(node.arg)
+            emit(MINUS)
+        elif isinstance(node, CharSepVals):
+            emit(LOAD_CONST, self.const(cls))
+            for item in node:
+                self.expr(item)
+            emit(BUILD_SEQ, len(node))
+        elif cls is ArrayNode:
+            for item in node:
+                self.expr(item)
+            emit(BUILD_ARRAY, len(node))
+        elif cls is StrTemplate:
+            chunks = node.chunks
+            emit(LOAD_CONST, self.const(chunks[0]))
+            for expr, chunk in zip(node, chunks[1:]):
+                self.expr(expr)
+                emit(TEXT)
+                emit(LOAD_CONST, self.const(chunk))
+            emit(BUILD_STR, 2 * len(node) + 1)
+        elif cls is Print:
+            self.expr(node.arg)
+            emit(PRINT)
+        elif cls is Assert:
+            self.expr(node.arg)
+            emit(ASSERT, self.const(node.arg))
+        elif cls is Import:
+            emit(IMPORT, self.name_(node.name))
+        elif cls is Func or cls is Class:
+            emit(LOAD_CONST, self.const(node))
+            emit(STORE_NAME, self.name_(node.name))
+        else:
+            emit(EVAL, self.const(node))
+
+
+def compile_block(block, name="<main>"):
+    """Compile the block (loading it if it's lazy) and keep the Code in it."""
+    if isinstance(block, LazyBlock):
+        block.load()
+    code = block.code = Compiler(name, block.catch_ret).code(block)
+    return code
+
+
+def code_of(block, name):
+    code = block.__dict__.get("code")
+    if code is None:
+        code = compile_block(block, name)
+        install(block, name)  # functions defined in the block
+    return code
+
+
+def bodies(node, prefix=""):
+    """(Block, name) of the bodies of functions defined in the tree,
+    bodies that are not loaded yet are not looked into.
+    """
+    if isinstance(node, Func):
+        yield node.body, prefix + node.name
+        if not (isinstance(node.body, LazyBlock) and not node.body.loaded):
+            yield from bodies(node.body)
+    elif isinstance(node, Class):
+        for member in node.body:
+            yield from bodies(member, node.name + ".")
+    elif isinstance(node, BaseNode):
+        for child in node:
+            yield from bodies(child)
+
+
+def compile_tree(tree):
+    """Compile the tree and the bodies of its functions in advance
+    (e.g., before the tree is cached).
+    """
+    if "code" not in tree.__dict__:
+        compile_block(tree)
+    for body, name in bodies(tree):
+        if "code" not in body.__dict__:
+            if not (isinstance(body, LazyBlock) and not body.loaded):
+                compile_block(body, name)
+
+
+def install(tree, name="<main>"):
+    """Make run() of the Code eval() of the tree and of function bodies."""
+    for block, name in [(tree, name)] + list(bodies(tree)):
+        if "eval" not in block.__dict__:
+            block.eval = partial(run_block, block, name)
+
+
+def run_block(block, name, frame):
+    return run(code_of(block, name), frame)
+
+
+###########
+# RUNNING #
+###########
+
+
+def lookup(frame, name):
+    """frame[name] without recursion."""
+    while True:
+        scope = frame.dict
+        if name in scope:
+            return scope[name]
+        frame = frame.parent
+        if frame is None:
+            raise KeyError(name)
+
+
+def run(code, frame):
+    """Run the code in the frame, returns the value."""
+    stack = []
+    calls = []  # (code, position, stack, frame) of the callers
+    ops, consts, names = code.ops, code.consts, code.names
+    pc = 0
+    while True:
+        try:
+            while True:
+                op = ops[pc]
+                arg = ops[pc + 1]
+                pc += 2
+                if op == LOAD_NAME:
+                    name = names[arg]
+                    scope = frame.dict
+                    if name in scope:
+                        stack.append(scope[name])
+                    else:
+                        stack.append(lookup(frame, name))
+                elif op == LOAD_CONST:
+                    stack.append(consts[arg])
+                elif op == STORE_NAME:
+                    frame.dict[names[arg]] = stack[-1]
+                elif op == POP:
+                    stack.pop()
+                elif op == BINARY:
+                    right = stack.pop()
+                    left = stack[-1]
+                    if type(left) is Int and type(right) is Int and INT_OPS[arg]:
+                        stack[-1] = INT_OPS[arg](left.value, right.value)
+                    else:
+                        cls = BINARY_OPS[arg]
+                        stack[-1] = binop(left, right, cls.methname, cls.sym)
+                elif op == JUMP_UNLESS:
+                    value = stack.pop().to_bool()
+                    if value is not TRUE and (value is FALSE or not value):
+                        pc = arg
+                elif op == JUMP_IF_FALSY:
+                    value = stack.pop()
+                    # Bool.__bool__() is slow, check the constants first
+                    if value is not TRUE and (value is FALSE or not value):
+                        pc = arg
+                elif op == JUMP:
+                    pc = arg
+                elif op == CALL or op == CALL_VALUE or op == CALL_METHOD:
+                    if op == CALL_METHOD:
+                        count = arg & 0xFF
+                        values = stack[len(stack) - count :]
+                        del stack[len(stack) - count :]
+                        this = stack.pop()
+                        newframe = Frame(frame)
+                        newframe.dict["this"] = this
+                        func = this.GetAttr(names[arg >> 8])
+                    else:
+                        if op == CALL:
+                            values = stack[len(stack) - arg :]
+                            del stack[len(stack) - arg :]
+                        else:
+                            values = stack.pop()
+                            if isinstance(values, Comma):
+                                values = list(values)
+                            else:
+                                values = [values]
+                        func = stack.pop()
+                        newframe = Frame(frame)
+                    if type(func) is not Func or len(values) != len(func.args):
+                        args = Comma(*values, flatten=False)
+                        stack.append(func.Call(args, newframe))
+                        continue
+                    scope = newframe.dict
+                    for name, value in zip(func.args, values):
+                        scope[name] = value
+                    calls.append((code, pc, stack, frame))
+                    code = code_of(func.body, func.name)
+                    ops, consts, names = code.ops, code.consts, code.names
+                    pc, stack, frame = 0, [], newframe
+                elif op == RETURN:
+                    value = stack.pop()
+                    if not calls:
+                        return value
+                    code, pc, stack, frame = calls.pop()
+                    ops, consts, names = code.ops, code.consts, code.names
+                    stack.append(value)
+                elif op == FOR_ITER:
+                    value = stack[-1].next()
+                    if value is None:
+                        stack.pop()
+                        pc = arg
+                    else:
+                        stack.append(value)
+                elif op == PUT:
+                    value = stack.pop()
+                    stack[-arg] = value
+                elif op == GET_ATTR:
+                    stack[-1] = stack[-1].GetAttr(names[arg])
+                elif op == SET_ATTR:
+                    value = stack.pop()
+                    stack[-1].SetAttr(names[arg], value)
+                    stack[-1] = None
+                elif op == GET_ITEM:
+                    key = stack.pop()
+                    stack[-1] = stack[-1].GetItem(key)
+                elif op == SET_ITEM:
+                    key = stack.pop()
+                    owner = stack.pop()
+                    owner.SetItem(key, stack[-1])
+                elif op == CHECK_CALLABLE:
+                    callable_(stack[-1])
+                elif op == CALL0:
+                    func = stack.pop()
+                    newframe = Frame(frame)
+                    if hasattr(func, "Call"):
+                        stack.append(func.Call([], newframe))
+                    else:
+                        stack.append(func(newframe))
+                elif op == AND:
+                    if stack[-1].to_bool():
+                        stack.pop()
+                    else:
+                        stack[-1] = FALSE
+                        pc = arg
+                elif op == OR:
+                    if stack[-1].to_bool():
+                        pc = arg
+                    else:
+                        stack.pop()
+                elif op == NOT:
+                    stack[-1] = FALSE if stack[-1].to_bool() else TRUE
+                elif op == MINUS:
+                    stack[-1] = stack[-1].Minus()
+                elif op == GET_ITER:
+                    stack[-1] = stack[-1].Iter()
+                elif op == ENTER_FRAME:
+                    frame = Frame(frame)
+                elif op == LEAVE_FRAME:
+                    frame = frame.parent
+                elif op == BUILD_SEQ:
+                    values = stack[len(stack) - arg :]
+                    del stack[len(stack) - arg :]
+                    stack[-1] = stack[-1](*values, flatten=False)
+                elif op == BUILD_ARRAY:
+                    values = stack[len(stack) - arg :]
+                    del stack[len(stack) - arg :]
+                    stack.append(Array(*values))
+                elif op == TEXT:
+                    stack[-1] = text(stack[-1], frame)
+                elif op == BUILD_STR:
+                    values = stack[len(stack) - arg :]
+                    del stack[len(stack) - arg :]
+                    stack.append(Str("".join(values)))
+                elif op == PRINT:
+                    show(stack[-1], frame)
+                elif op == ASSERT:
+                    assert_(stack[-1], consts[arg])
+                elif op == IMPORT:
+                    name = names[arg]
+                    module = frame[name] = interpreter.import_module(name)
+                    install(module.tree, "<module %s>" % name)
+                    stack.append(module)
+                elif op == EVAL:
+                    stack.append(consts[arg].eval(frame))
+                elif op == RAISE_RETURN:
+                    raise ReturnException(stack.pop())
+                else:
+                    raise ValueError("unknown opcode %d in %s" % (op, code))
+        except ReturnException as e:
+            # ret in a node run by EVAL
+            if not code.returns:
+                raise
+            stack.append(e.args[0])
+            pc = len(ops) - 2  # RETURN at the end
+
+
+################
+# DISASSEMBLER #
+################
+
+
+def dis(tree, file=None):
+    """Print instructions of the tree and of all functions it defines."""
+    codes = [code_of(tree, "<main>")]
+    seen = set()
+    while codes:
+        code = codes.pop(0)
+        if id(code) in seen:
+            continue
+        seen.add(id(code))
+        dis_code(code, file)
+        for const in code.consts:
+            if isinstance(const, Func):
+                codes.append(code_of(const.body, const.name))
+            elif isinstance(const, Class):
+                for member in const.body:
+                    if isinstance(member, Func):
+                        name = "%s.%s" % (const.name, member.name)
+                        codes.append(code_of(member.body, name))
+
+
+def dis_code(code, file=None):
+    print("Disassembly of %s:" % code.name, file=file)
+    ops, lineno = code.ops, None
+    targets = {ops[i + 1] for i in range(0, len(ops), 2) if ops[i] in JUMPS}
+    for i in range(0, len(ops), 2):
+        op, arg = ops[i], ops[i + 1]
+        line = code.lines[i // 2]
+        show_line = "%4d" % line if line != lineno else ""
+        lineno = line
+        mark = ">>" if i in targets else ""
+        out = "%4s %2s %5d %-16s" % (show_line, mark, i, OPNAMES[op])
+        if op in JUMPS:
+            out += " %5d" % arg
+        elif op in NAMES:
+            out += " %5d (%s)" % (arg, code.names[arg])
+        elif op in CONSTS:
+            out += " %5d (%s)" % (arg, short(code.consts[arg]))
+        elif op == BINARY:
+            out += " %5d (%s)" % (arg, BINARY_OPS[arg].sym)
+        elif op == CALL_METHOD:
+            out += " %5d (%s, %d values)" % (arg, code.names[arg >> 8], arg & 0xFF)
+        elif op in (CALL, PUT, BUILD_SEQ, BUILD_ARRAY, BUILD_STR):
+            out += " %5d" % arg
+        print(out.rstrip(), file=file)
+    print(file=file)
+
+
+def short(obj):
+    if isinstance(obj, Func):
+        return "<func %s>" % obj.name
+    if isinstance(obj, type):
+        return obj.__name__
+    text = repr(obj)
+    return text if len(text) <= 40 else text[:37] + "..."
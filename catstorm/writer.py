@@ -23,8 +23,9 @@ class Block:
     def to_str(self):
         lines = []
         indent = f"{'  '*self._lvl}"
+        outer = f"{'  '*(self._lvl - 1)}" if self._lvl else ""
         if self._prepend:
-            lines.append(self._prepend)
+            lines.append(outer + self._prepend)
 
         for data in self.content:
             if isinstance(data, Block):
@@ -34,7 +35,7 @@ class Block:
                 lines.append(data)
 
         if self._append:
-            lines.append(self._append)
+            lines.append(outer + self._append)
 
         return lines
 
@@ -55,8 +56,10 @@ class CBlock(Block):
         self.kwargs = kwargs
         super().__init__(*args, **kwargs)
 
-    def cblock(self):
-        return self.newblock(prepend="{", append="}", sep=";", lvl=self._lvl + 1)
+    def cblock(self, head=None):
+        """Nested block in braces, head goes before "{" (e.g., "if (x)")."""
+        prepend = f"{head} {{" if head else "{"
+        return self.newblock(prepend=prepend, append="}", sep=";", lvl=self._lvl + 1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,68 @@
+"""Program shared by the tests of the engines (closures, transpile, vm)."""
+
+from catstorm import closures, interpreter, transpile, vm
+from catstorm.frame import Frame
+from catstorm.interpreter import LazyBlock
+from catstorm.storm import load_body, parse_text
+
+source = """\
+::class Box
+    New = v ->
+        @v = v
+    get = ->
+        @v
+fib = n ->
+    if n < 2
+        ret n
+    a = fib . (n - 1)
+    b = fib . (n - 2)
+    a + b
+join = a, b -> a + b
+main = ->
+    b = Box . 3
+    xs = [0, 0]
+    xs[1] = b@get!
+    s = 0
+    i = 0
+    while i < 5
+        s = s + i * 2
+        i = i + 1
+    for x in [1, 2]
+        p "x={x} s={s}"
+    ok = not (s == 1) and (s > 1 or s < 0)
+    t = join . "a", "b"
+    u = join . 1, 2
+    f = fib . 10
+    [f, xs, s, ok, t, u]
+"""
+# what main of the source returns
+expected = "[55, [0, 3], 20, TRUE, 'ab', 3]"
+
+# engine -> function installing it in the tree
+ENGINES = {
+    "closures": closures.install,
+    "transpile": lambda tree: transpile.install(tree, "<test>"),
+    "vm": vm.install,
+}
+
+
+def run(tree, install=None):
+    """Install the engine (if given) and return the result of main."""
+    if install:
+        install(tree)
+    with Frame() as frame:
+        tree.eval(frame)
+        return frame["main"].Call((), frame).to_str().to_py_str()
+
+
+def lazy_fib(monkeypatch, install):
+    """Run the source with lazily loaded bodies, returns fib."""
+    monkeypatch.setattr(interpreter, "lazy_loader", load_body)
+    tree = parse_text(source).tree
+    fib = tree[1]
+    assert isinstance(fib.body, LazyBlock) and not fib.body.loaded
+    install(tree)
+    assert not fib.body.loaded
+    assert run(tree) == expected
+    assert fib.body.loaded
+    return fib
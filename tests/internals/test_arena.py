@@ -0,0 +1,66 @@
+from catstorm import interpreter
+from catstorm.arena import Arena, ArenaBlock
+from catstorm.frame import Frame
+from catstorm.interpreter import Int
+from catstorm.storm import parse_text, parse_to_arena
+from catstorm.syntax_tree import pprint
+import pytest
+
+
+source = """\
+::class Box
+    New = v ->
+        @v = v
+f = x -> x + 1
+g = x ->
+    y = f . x
+    if y > 2
+        y = y - 1
+    z = [y, y, x]
+    y
+main = ->
+    b = Box . 2
+    v = b@v
+    w = g . 2
+    v + w
+"""
+
+
+@pytest.fixture
+def packed():
+    arena = Arena()
+    arena.put(parse_text(source).tree)
+    return arena.root()
+
+
+def test_same_tree(packed):
+    tree = parse_text(source).tree
+    assert pprint(packed).replace("ArenaBlock", "Block") == pprint(tree)
+
+
+def test_interned(packed):
+    y1, y2, x = packed[2].body[-2].right
+    assert y1 is y2 and y1.value == "y"
+    assert packed[1].body[0].right is not x  # (Int 1) and (Var 'x')
+
+
+def test_lazy(packed, monkeypatch):
+    monkeypatch.setattr(interpreter, "classes", {})
+    assert isinstance(packed, ArenaBlock) and not packed.loaded
+    box, f, g, main = packed
+    assert interpreter.classes == {"Box": box}
+    with Frame() as frame:
+        packed.eval(frame)
+        assert not g.body.loaded
+        assert main.Call((), frame).value == 4
+        assert g.body.loaded
+        assert f.Call([Int(1)], frame).value == 2
+
+
+def test_parse_to_arena(tmp_path):
+    path = tmp_path / "prog.ls"
+    path.write_text(source)
+    packed = parse_to_arena(str(path))
+    with Frame() as frame:
+        packed.eval(frame)
+        assert frame["main"].Call((), frame).value == 4
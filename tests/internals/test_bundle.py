@@ -0,0 +1,63 @@
+from catstorm import bundle, cache, interpreter, storm
+from catstorm.frame import Frame
+from catstorm.storm import load_bundle, make_bundle
+import pytest
+
+
+source = """\
+inc = x -> x + 1
+main = name, args ->
+    y = inc . 1
+    y * 10
+"""
+
+
+@pytest.fixture
+def app(tmp_path):
+    path = tmp_path / "app.ls"
+    path.write_text(source)
+    return make_bundle(str(path))
+
+
+def run(tree):
+    with Frame() as frame:
+        tree.eval(frame)
+        return frame["main"].Call((None, None), frame).value
+
+
+def test_bundle(app):
+    assert app.endswith("app" + bundle.SUFFIX)
+    assert bundle.is_bundle(app)
+    assert bundle.Bundle(app).manifest["modules"] == {"app": ["app/0", "app/1"]}
+    tree = load_bundle(app)
+    assert [type(f.body) for f in tree] == [bundle.BundledBlock] * 2
+    assert not any(f.body.loaded for f in tree)
+    assert run(tree) == 20
+    assert all(f.body.loaded for f in tree)
+
+
+def test_stale(app, monkeypatch):
+    monkeypatch.setattr(cache, "_stamp", "other catstorm")
+    assert bundle.Bundle(app).module("app") is None
+    assert run(load_bundle(app)) == 20
+
+
+def test_not_a_bundle(tmp_path):
+    path = tmp_path / "app.ls"
+    path.write_text(source)
+    assert not bundle.is_bundle(str(path))
+
+
+def test_modules(tmp_path, monkeypatch):
+    (tmp_path / "lib").mkdir()
+    (tmp_path / "lib" / "helpers.ls").write_text("inc = x -> x + 1\n")
+    (tmp_path / "app.ls").write_text(
+        "::import helpers\nmain = name, args ->\n    helpers@inc . 19\n"
+    )
+    monkeypatch.setattr(storm, "module_path", [str(tmp_path / "lib")])
+    app = make_bundle(str(tmp_path / "app.ls"))
+    assert list(bundle.Bundle(app).manifest["modules"]) == ["app", "helpers"]
+    (tmp_path / "lib" / "helpers.ls").unlink()
+    monkeypatch.setattr(interpreter, "module_loader", None)
+    monkeypatch.setattr(interpreter, "modules", {})
+    assert run(load_bundle(app)) == 20
@@ -0,0 +1,86 @@
+import shutil
+import subprocess
+
+import pytest
+
+from catstorm import cgen
+from catstorm.frame import Frame
+from catstorm.interpreter import Array, Str
+from catstorm.storm import parse_text
+
+
+source = """\
+::class Box
+    New = v ->
+        @v = v
+    add = x ->
+        t = @v
+        @v = t + x
+        this
+    to_str = ->
+        "Box({@v})"
+fib = n ->
+    if n < 2
+        ret n
+    a = fib . (n - 1)
+    b = fib . (n - 2)
+    a + b
+main = name, args ->
+    b = Box . 3
+    b@add . 4
+    xs = [1, 2, 3]
+    xs[0] = 10
+    xs <<< 7
+    s = 0
+    for x in xs
+        s = s + x
+        p "x={x} s={s}"
+    i = 0
+    while i < 3
+        i = i + 1
+    count = n -> 0 if n == 0 else 1 + (count . (n - 1))
+    ok = not (s == 1) and (i > 1 or i < 0)
+    p "{b} {xs[1:3]} {ok} {count . 5} {fib . 15} {args}"
+    i
+"""
+
+
+def run_tree(capsys):
+    with Frame() as frame:
+        parse_text(source).tree.eval(frame)
+        args = Array(Str("a"), Str("b"))
+        status = frame["main"].Call((Str("prog"), args), frame).value
+    return capsys.readouterr().out, status
+
+
+def test_emit():
+    code = cgen.generate(parse_text(source).tree, "prog.ls")
+    assert '#include "cgen.h"' in code
+    assert "int main(int argc, char **argv)" in code
+    # calls of functions that are never reassigned are direct
+    assert "fn_fib(this, cs_sub(v_n, cs_int(1LL)))" in code
+    assert "fn_count(this, cs_sub(v_n, cs_int(1LL)))" in code
+
+
+@pytest.mark.skipif(not shutil.which("cc"), reason="needs a C compiler")
+def test_same_as_tree(tmp_path, capsys):
+    expected, status = run_tree(capsys)
+    program = str(tmp_path / "prog")
+    cgen.build(parse_text(source).tree, program, "prog.ls")
+    result = subprocess.run(
+        [program, "a", "b"], capture_output=True, text=True, cwd=tmp_path
+    )
+    assert result.stdout == expected
+    assert result.returncode == status == 3
+
+
+def test_dynamic_scoping():
+    tree = parse_text("f = -> x\nmain = name, args ->\n    x = 1\n    f!\n").tree
+    with pytest.raises(cgen.CompileError, match="dynamic scoping"):
+        cgen.generate(tree)
+
+
+def test_unsupported():
+    tree = parse_text('main = name, args ->\n    d = {"a": 1}\n    0\n').tree
+    with pytest.raises(cgen.CompileError, match="not supported"):
+        cgen.generate(tree)
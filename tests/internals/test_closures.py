@@ -0,0 +1,29 @@
+from catstorm import closures
+from catstorm.frame import Frame
+from catstorm.interpreter import Block, Int, Str
+from catstorm.storm import parse_text
+from engines import source
+import pytest
+
+
+def test_installed():
+    tree = parse_text(source).tree
+    closures.install(tree)
+    box, fib, join, main = tree
+    assert "eval" in tree.__dict__
+    assert "eval" in fib.body.__dict__
+    assert "eval" in box["get"].body.__dict__
+
+
+def test_operator_types():
+    # the method cached for one type is not used for another one
+    tree = parse_text("f = a, b -> a + b\n").tree
+    closures.install(tree)
+    with Frame() as frame:
+        tree.eval(frame)
+        f = frame["f"]
+        assert f.Call([Str("x"), Str("y")], Frame(frame)).value == "xy"
+        assert f.Call([Int(1), Int(2)], Frame(frame)).value == 3
+        assert f.Call([Str("z"), Str("z")], Frame(frame)).value == "zz"
+        with pytest.raises(Exception, match="does not have Add method"):
+            f.Call([Block(), Int(1)], Frame(frame))
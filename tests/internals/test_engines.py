@@ -0,0 +1,30 @@
+from catstorm.frame import Frame
+from catstorm.storm import parse_text
+from engines import ENGINES, expected, lazy_fib, run, source
+import pytest
+
+
+@pytest.fixture(params=sorted(ENGINES))
+def install(request):
+    return ENGINES[request.param]
+
+
+def test_same_as_tree(install, capsys):
+    assert run(parse_text(source).tree) == expected
+    tree_output = capsys.readouterr().out
+    assert run(parse_text(source).tree, install) == expected
+    assert capsys.readouterr().out == tree_output
+
+
+def test_lazy(install, monkeypatch):
+    lazy_fib(monkeypatch, install)
+
+
+def test_ret_from_loop(install):
+    tree = parse_text(
+        "f = ->\n    for x in [1, 2, 3]\n        if x > 1\n            ret x\n    0\n"
+    ).tree
+    install(tree)
+    with Frame() as frame:
+        tree.eval(frame)
+        assert frame["f"].Call([], Frame(frame)).value == 2
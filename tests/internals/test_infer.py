@@ -0,0 +1,129 @@
+from catstorm.frame import Frame
+from catstorm.infer import infer
+from catstorm.interpreter import Add, Array, Call, CallObj, Str
+from catstorm.storm import parse_text
+from trees import nodes
+import pytest
+
+
+def load(source):
+    tree = parse_text(source).tree  # rewritten by parse_text()
+    return tree, infer(tree)
+
+
+def run(tree, *args):
+    with Frame() as frame:
+        tree.eval(frame)
+        return frame["main"].Call((Str("x"), Array(*args)), frame).to_py_str()
+
+
+source = """\
+::class Box
+    New = v ->
+        @v = v
+    get = ->
+        @v
+add = a, b -> a + b
+main = name, args ->
+    b = Box . 1
+    i = 0
+    s = 0
+    while i < 10
+        t = b@get!
+        s = add . s, t
+        i = i + 1
+    s
+"""
+
+
+def test_annotations():
+    tree, issues = load(source)
+    assert issues == []
+    assert [type(add) for add in nodes(tree, Add)] == [Add, Add]
+    assert ["static" in add.__dict__ for add in nodes(tree, Add)].count(True) == 1
+    calls = [call for call in nodes(tree, Call) if "callee" in call.__dict__]
+    assert len(calls) == 1  # add . s, t -- classes are not annotated
+    (meth,) = nodes(tree, CallObj)
+    assert "method" in meth.__dict__
+    assert run(tree) == "10"
+    assert type(meth) is CallObj.Known
+    assert type(calls[0]) is Call.Known
+
+
+def test_callee_changed():
+    tree, issues = load("f = a -> a\nmain = name, args ->\n    f . 1\n")
+    assert issues == []
+    (call,) = nodes(tree, Call)
+    with Frame() as frame:
+        tree.eval(frame)
+        main = frame["main"]
+        assert main.Call((Str("x"), Array()), frame).to_py_str() == "1"
+        assert type(call) is Call.Known
+        frame["f"] = parse_text("g = a -> a + 1").tree[0].eval(frame)
+        assert main.Call((Str("x"), Array()), frame).to_py_str() == "2"
+    assert type(call) is Call and "callee" not in call.__dict__
+
+
+def test_arity():
+    _, issues = load("g = -> 2\nmain = name, args ->\n    g . 1\n")
+    assert issues == ["line 3: g takes 0 arguments, got 1"]
+
+
+def test_issues():
+    source = """\
+::class Box
+    New = v ->
+        @v = v
+    get = ->
+        @v
+main = name, args ->
+    x = 1
+    y = x + "a"
+    b = Box . 1
+    b@put . 2
+    n = 5
+    n . 1
+    -"s"
+    0
+"""
+    _, issues = load(source)
+    assert issues == [
+        "line 8: unsupported operation Int + Str",
+        'line 10: class Box has no member "put"',
+        "line 12: Int can't be called",
+        "line 13: Str does not support unary minus",
+    ]
+
+
+def test_rebound_names_are_not_trusted():
+    tree, issues = load(
+        "f = a -> a + 1\nmain = name, args ->\n    r = f . 1\n    f = -> 0\n    r\n"
+    )
+    assert issues == []
+    assert not [call for call in nodes(tree, Call) if "callee" in call.__dict__]
+    assert run(tree) == "2"
+
+
+def test_guards():
+    # the proofs assume the names keep their values, the nodes check them
+    tree, issues = load(source)
+    assert issues == []
+    (meth,) = nodes(tree, CallObj)
+    (add,) = [add for add in nodes(tree, Add) if "static" in add.__dict__]
+    other = parse_text("::class Box\n    New = v ->\n        @v = v + 1\n").tree
+    other[0].body.extend(tree[0].body[1:])  # the same get
+    with Frame() as frame:
+        tree.eval(frame)
+        main = frame["main"]
+        assert main.Call((Str("x"), Array()), frame).to_py_str() == "10"
+        assert type(meth) is CallObj.Known and type(add) is Add.Int
+        frame["Box"] = other[0]  # rebound as another module would do
+        assert main.Call((Str("x"), Array()), frame).to_py_str() == "20"
+        assert type(meth) is CallObj.Cached and meth.cls is other[0]
+        assert "method" not in meth.__dict__
+        with Frame(frame) as inner:
+            inner["i"] = Str("a")
+            with pytest.raises(TypeError, match="concatenate"):
+                add.eval(inner)  # as the generic node does, not int_op
+    assert type(add) is Add.Typed and add.cls is Str and add.misses == 1
+    assert "static" not in add.__dict__
@@ -0,0 +1,61 @@
+from catstorm.grammar import SKIP
+from catstorm.lexer import lex_file, lex_text
+import pytest
+
+
+def structure(lines):
+    """Tags of every line (as strings), values are left out."""
+    return [[repr(tokens.tag(pos)) for pos in range(len(tokens))] for tokens in lines]
+
+
+class Test_lex:
+    def test_blocks(self):
+        data = """\
+        a
+            b \\
+            c
+        d
+        """
+        assert structure(lex_text(data)) == [
+            ["INDENT", "ID", "NEWLINE"],
+            ["INDENT", "ID", "ID", "NEWLINE"],
+            ["DEDENT", "ID", "NEWLINE"],
+            ["DEDENT"],
+        ]
+
+    def test_line_numbers(self):
+        data = "a\nb \\\nc\n\nd"
+        assert [tokens.lineno for tokens in lex_text(data)] == [1, 2, 5]
+
+    def test_comments_are_skipped(self):
+        data = "a # comment\n    # comment\nb"
+        assert structure(lex_text(data, skip=SKIP)) == [
+            ["ID", "NEWLINE"],
+            ["ID", "NEWLINE"],
+        ]
+
+    def test_unaligned_dedent(self):
+        data = "a\n  b\n    c\n d\n  e"
+        assert structure(lex_text(data)) == [
+            ["ID", "NEWLINE"],
+            ["INDENT", "ID", "NEWLINE"],
+            ["INDENT", "ID", "NEWLINE"],
+            ["DEDENT", "DEDENT", "ID", "NEWLINE"],
+            ["INDENT", "ID", "NEWLINE"],
+            ["DEDENT"],
+        ]
+
+    def test_last_line_has_slash(self):
+        with pytest.raises(ValueError):
+            list(lex_text("test \\"))
+
+    def test_file(self, tmp_path):
+        path = tmp_path / "test.ls"
+        path.write_text("a\n  b\r\n")
+        assert structure(lex_file(path)) == [
+            ["ID", "NEWLINE"],
+            ["INDENT", "ID", "NEWLINE"],
+            ["DEDENT"],
+        ]
+        path.write_text("")
+        assert list(lex_file(path)) == []
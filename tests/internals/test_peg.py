@@ -0,0 +1,235 @@
+from catstorm import grammar  # noqa: F401 (registers the symbols)
+from catstorm import peg
+from catstorm.grammar import SKIP
+from catstorm.lexer import lex_text
+from catstorm.peg import NoMatch, symbols, tokenize
+import pytest
+
+
+def tokenize_one_by_one(text, pos=0):
+    """Reference implementation: try every symbol in turn."""
+    result = []
+    mysymbols = sorted(
+        (x for x in symbols if x.pattern),
+        key=lambda x: (x.prio, x.pattern.pattern),
+        reverse=True,
+    )
+    while pos < len(text):
+        for p in mysymbols:
+            try:
+                r, pos = p.tokenize(text, pos)
+                result.append((r, p))
+                break
+            except NoMatch:
+                pass
+        else:
+            raise NoMatch("cannot tokenize at pos %s, text: %s" % (pos, text))
+    return result
+
+
+def as_tags(tokens):
+    return [(repr(datum), tag) for datum, tag in tokens]
+
+
+class Test_tokenize:
+    @pytest.mark.parametrize(
+        "text",
+        [
+            'main = progname, argv -> p "Hello, {argv}"',
+            "assert succ . 0 $ succ $ succ == 3",
+            "for type, value in stream",
+            "::class Op",
+            "x = [1, 2.5, `ls`, /re/] # comment",
+            "add = val,i -> add . (val+1),(i-1) if i>0 else val  ",
+            "tokens <<< (traverse . stream)",
+            's = "\\"!\\""',
+        ],
+    )
+    def test_same_as_one_by_one(self, text):
+        assert as_tags(tokenize(text)) == as_tags(tokenize_one_by_one(text))
+
+    def test_untokenizable(self):
+        with pytest.raises(NoMatch):
+            tokenize("a = ~")
+
+
+class Test_Tokens:
+    def test_values_are_cached(self):
+        tokens = tokenize("a + 1")
+        assert len(tokens) == 3
+        assert tokens.value(2) is tokens.value(2)
+        assert tokens.text[tokens.starts[2] : tokens.ends[2]] == "1"
+
+    def test_operators_are_shared(self):
+        tokens = tokenize("1 + 2 + 3")
+        assert tokens.value(1) is tokens.value(3)
+
+    def test_span(self):
+        tokens = tokenize("x = y")
+        span = tokens.span(1, 3, wrap={grammar.ID.id: str.upper})
+        assert len(span) == 2
+        assert span[1] == "Y"
+
+
+class Test_packrat:
+    lines = [
+        "add = val,i -> add . (val+1),(i-1) if i>0 else val",
+        "x = [1, 2] + [3]",
+        "for i, j in data",
+        "::class Op",
+    ]
+
+    def parse(self, line):
+        from catstorm.syntax_tree import pprint
+
+        prog, pos = grammar.PROG.match(tokenize(line))
+        return pprint(prog), pos
+
+    @pytest.mark.parametrize("maxsize", [0, 2])
+    def test_same_results(self, monkeypatch, maxsize):
+        plain = [self.parse(line) for line in self.lines]
+        monkeypatch.setattr(peg, "packrat", maxsize)
+        assert [self.parse(line) for line in self.lines] == plain
+
+    def test_memo_is_bounded(self, monkeypatch):
+        monkeypatch.setattr(peg, "packrat", 3)
+        tokens = tokenize(self.lines[0])
+        grammar.PROG.match(tokens)
+        assert 0 < len(tokens.memo.table) <= 3
+
+
+class Test_first_sets:
+    @pytest.mark.parametrize("line", ["for e in list", "while x", "::class A", "# c"])
+    def test_prog_skips_func_and_expr(self, line):
+        tokens = tokenize(line)
+        alternatives = grammar.PROG.alternatives(tokens, 0)
+        assert alternatives
+        for rule in alternatives:
+            assert grammar.FUNC not in rule.things
+            assert grammar.EXPR not in rule.things
+
+    def test_nullable(self):
+        first, nullable = grammar.FUNC.first()
+        assert first == {grammar.ID.id} and not nullable
+        assert peg.MAYBE(grammar.ID).first()[1]
+
+
+class Test_failures:
+    def test_parse_returns_fail(self):
+        assert grammar.FUNC.parse(tokenize("1 + 2"), 0) is peg.FAIL
+
+    def test_match_reports_furthest_position(self):
+        with pytest.raises(NoMatch) as err:
+            grammar.FUNC.match(tokenize("f = a, b c"))
+        assert err.value.args[0] == "syntax error"
+        assert err.value.pos == 5
+        assert grammar.LAMBDA.things[0] in err.value.expected
+
+    def test_message_format(self):
+        # the same as before the FAIL protocol (the line without the
+        # tokens made by the lexer, position where the match started)
+        tokens = list(lex_text("main = ->\n    ::class 1\n", skip=SKIP))[1]
+        with pytest.raises(NoMatch) as err:
+            grammar.PROG.match(tokens, 1)
+        assert str(err.value) == (
+            "('syntax error', [('::class', SYM('::class')), (1, INT)], 0)"
+        )
+        assert err.value.pos == 2
+
+    def test_terminal_message(self):
+        with pytest.raises(NoMatch, match="ID != INT for x"):
+            grammar.INTCONST.match(tokenize("x"), 0)
+
+
+class Test_compiled:
+    lines = Test_packrat.lines + [
+        "::adt Op = Lit x | Neg x | Add a, b",
+        "::class",
+        "while i < 10",
+        "f = a, b c",
+    ]
+
+    def parse(self, rule, line):
+        from catstorm.syntax_tree import pprint
+
+        try:
+            prog, pos = rule.match(tokenize(line))
+        except NoMatch as err:
+            return err.args[0], err.pos, err.expected
+        return pprint(prog), pos
+
+    @pytest.mark.parametrize("packrat", [None, 0])
+    def test_same_results(self, monkeypatch, packrat):
+        monkeypatch.setattr(peg, "packrat", packrat)
+        for line in self.lines:
+            expected = self.parse(grammar.PROG, line)
+            assert self.parse(grammar.PARSER, line) == expected
+
+    def test_cached(self):
+        from catstorm.peg_compiler import compile_grammar
+
+        assert compile_grammar(grammar.PROG).source == grammar.PARSER.source
+        assert compile_grammar(grammar.PROG)._plain is grammar.PARSER._plain
+
+    def test_recompiled_on_change(self):
+        from catstorm.peg_compiler import compile_grammar
+
+        rule = peg.ANY(grammar.INTCONST)
+        before = compile_grammar(rule)
+        rule | grammar.ID
+        after = compile_grammar(rule)
+        assert after.key != before.key
+        assert after.match(tokenize("x"))[0] == "x"
+
+    def test_code_saved(self, monkeypatch, tmp_path):
+        import sys
+
+        from catstorm.peg_compiler import _compile
+
+        monkeypatch.setattr(sys, "pycache_prefix", str(tmp_path))
+        monkeypatch.setattr(sys, "dont_write_bytecode", False)
+        code = _compile("x = 1\n", "<test>")
+        assert len(list(tmp_path.rglob("grammar.*.marshal"))) == 1
+        assert _compile("x = 1\n", "<test>") == code
+
+
+class Test_profile:
+    lines = Test_compiled.lines
+
+    @pytest.fixture
+    def profile(self, monkeypatch):
+        profile = peg.Profile(peg.rule_names(vars(grammar)))
+        monkeypatch.setattr(peg, "profile", profile)
+        return profile
+
+    @pytest.mark.parametrize("packrat", [None, 0])
+    def test_same_results(self, monkeypatch, packrat):
+        monkeypatch.setattr(peg, "packrat", packrat)
+        parse = Test_compiled().parse
+        plain = [parse(grammar.PARSER, line) for line in self.lines]
+        monkeypatch.setattr(peg, "profile", peg.Profile(peg.rule_names(vars(grammar))))
+        for rule in (grammar.PROG, grammar.PARSER):
+            assert [parse(rule, line) for line in self.lines] == plain
+
+    @pytest.mark.parametrize("rule", ["PROG", "PARSER"])
+    def test_stats(self, profile, rule):
+        getattr(grammar, rule).match(tokenize("f = a, b c"))  # FUNC, then EXPR
+        attempts, matches, failures, tokens, seconds = profile.stats["FUNC"]
+        assert (attempts, matches, failures, tokens) == (1, 0, 1, 5)
+        assert profile.stats["EXPR"][:3] == [1, 1, 0]
+        assert profile.stats["PROG"][:3] == [1, 1, 0] and seconds > 0
+
+    def test_report(self, profile, capsys):
+        grammar.PARSER.match(tokenize("::class A"))
+        profile.report()
+        lines = capsys.readouterr().err.splitlines()
+        assert lines[0].split() == [
+            "rule",
+            "attempts",
+            "matches",
+            "failures",
+            "backtrack",
+            "time",
+        ]
+        assert lines[1].split()[:4] == ["PROG", "1", "1", "0"]
+        assert "CLASS" in {line.split()[0] for line in lines}
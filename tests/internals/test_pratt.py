@@ -0,0 +1,26 @@
+from catstorm.grammar import EXPR
+from catstorm.interpreter import Case, Parens
+from catstorm.peg import tokenize
+from catstorm.pratt import Parser, pratt_parse1
+
+
+def parse(text):
+    span, _ = EXPR.match(tokenize(text))
+    return pratt_parse1(span)
+
+
+class Test_Parser:
+    def test_nested_parse(self):
+        # Case parses its operands again while "+ 1" is still to be parsed
+        expr = parse("(a => b) + 1")
+        assert expr.__class__.__name__ == "Add"
+        assert isinstance(expr.left, Parens)
+        assert isinstance(expr.left.arg, Case)
+
+    def test_state_is_per_parser(self):
+        first = Parser(EXPR.match(tokenize("1 + 2"))[0])
+        second = Parser(EXPR.match(tokenize("x"))[0])
+        first.advance()
+        second.parse()
+        assert first.pos == 1 and first.nxt is first.tokens[0]
+        assert first.expr().__class__.__name__ == "Add"
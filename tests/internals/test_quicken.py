@@ -0,0 +1,79 @@
+from catstorm import interpreter
+from catstorm.frame import Frame
+from catstorm.interpreter import (
+    QUICKEN_LIMIT,
+    Add,
+    CallObj,
+    GetAttr,
+    Int,
+    Lt,
+    Str,
+)
+from catstorm.storm import parse_text
+from trees import nodes
+
+
+def run(source, *args):
+    tree = parse_text(source).tree
+    with Frame() as frame:
+        tree.eval(frame)
+        func = frame["f"]
+        results = [func.Call(arg, frame).to_py_str() for arg in args]
+    return tree, results
+
+
+def test_int_and_typed():
+    tree, results = run(
+        "f = a, b -> a + b",
+        (Int(1), Int(2)),
+        (Int(3), Int(4)),
+    )
+    (add,) = nodes(tree, Add)
+    assert type(add) is Add.Int and results == ["3", "7"]
+    tree, results = run("f = a, b -> a + b", (Str("a"), Str("b")))
+    (add,) = nodes(tree, Add)
+    assert type(add) is Add.Typed and add.cls is Str and results == ["ab"]
+
+
+def test_deoptimize():
+    args = [(Int(1), Int(2)), (Str("a"), Str("b"))] * QUICKEN_LIMIT
+    tree, results = run("f = a, b -> a + b", *args)
+    assert results == ["3", "ab"] * QUICKEN_LIMIT
+    (add,) = nodes(tree, Add)
+    assert type(add) is Add.Megamorphic
+
+
+def test_methods():
+    source = """\
+::class A
+    New = ->
+        @x = 1
+    get = ->
+        "A{@x}"
+::class B
+    New = ->
+        @x = 2
+    get = ->
+        "B{@x}"
+f = obj -> obj@get!
+"""
+    tree = parse_text(source).tree
+    with Frame() as frame:
+        tree.eval(frame)
+        a = frame["A"].Call([], frame)
+        b = frame["B"].Call([], frame)
+        call = lambda obj: frame["f"].Call([obj], frame).to_py_str()  # noqa: E731
+        assert call(a) == "A1"
+        (meth,), attrs = nodes(tree, CallObj), nodes(tree, GetAttr)
+        assert type(meth) is CallObj.Cached and meth.cls is frame["A"]
+        assert [type(attr) for attr in attrs] == [GetAttr, GetAttr.Cached]
+        assert attrs[1].member is None
+        assert [call(a), call(b), call(b)] == ["A1", "B2", "B2"]
+        assert meth.cls is frame["B"] and meth.misses == 1
+
+
+def test_disabled(monkeypatch):
+    monkeypatch.setattr(interpreter, "quicken", False)
+    tree, results = run("f = a, b -> a < b", (Int(1), Int(2)), (Str("b"), Str("a")))
+    (lt,) = nodes(tree, Lt)
+    assert type(lt) is Lt and results == ["True", "False"]
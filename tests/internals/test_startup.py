@@ -0,0 +1,17 @@
+import importlib.util
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent.parent
+
+spec = importlib.util.spec_from_file_location(
+    "startup", ROOT / "benchmarks" / "startup.py"
+)
+startup = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(startup)
+
+
+def test_no_slow_imports():
+    lines = startup.startup_output()
+    assert lines[0] == "result of expr 1: 1"
+    modules = lines[-1].split()
+    assert [name for name in startup.SLOW_IMPORTS if name in modules] == []
@@ -0,0 +1,292 @@
+from catstorm import cache, interpreter, storm
+from catstorm.frame import Frame
+from catstorm.grammar import SKIP
+from catstorm.interpreter import Block, Int, StrTemplate, StrTPL
+from catstorm.lexer import lex_text
+from catstorm.storm import (
+    check,
+    eval_stream,
+    find_scripts,
+    find_imports,
+    load_body,
+    load_module,
+    load_program,
+    parse,
+    parse_text,
+    reparse,
+)
+from catstorm.syntax_tree import pprint
+import pytest
+
+
+@pytest.fixture
+def scripts(tmp_path):
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "a.ls").write_text("x = 1\n")
+    (tmp_path / "sub" / "b.ls").write_text("main = ->\n    x = (1 +\n")
+    (tmp_path / "sub" / "notes.txt").write_text("not a script")
+    return tmp_path
+
+
+class Test_check:
+    def test_find_scripts(self, scripts):
+        found = list(find_scripts([str(scripts)]))
+        assert found == [str(scripts / "a.ls"), str(scripts / "sub" / "b.ls")]
+
+    @pytest.mark.parametrize("jobs", [1, 2])
+    def test_errors_per_file(self, scripts, capsys, jobs):
+        assert check([str(scripts)], jobs) == 1
+        out, err = capsys.readouterr()
+        errors = [line for line in err.splitlines() if ".ls:" in line]
+        assert errors == [str(scripts / "sub" / "b.ls") + ": line 2: x = (1 +"]
+        assert out == "checked 2 files, 1 failed\n"
+
+    def test_types_only_when_asked(self, scripts, capsys):
+        (scripts / "a.ls").write_text('x = 1 + "a"\n')
+        assert check([str(scripts / "a.ls")], 1) == 0
+        assert check([str(scripts / "a.ls")], 1, check_types=True) == 1
+        err = capsys.readouterr().err
+        assert "a.ls: line 1: unsupported operation Int + Str" in err
+
+
+class Test_lazy:
+    source = """\
+f = x -> x + 1
+g = x ->
+    y = x * 2
+    if y > 2
+        y = y - 1
+    y
+h = ->
+    x = (1 +
+main = ->
+    0
+"""
+
+    @pytest.fixture
+    def mainblk(self, monkeypatch):
+        monkeypatch.setattr(interpreter, "lazy_loader", load_body)
+        mainblk = Block()
+        parse(lex_text(self.source, skip=SKIP), mainblk)
+        return mainblk
+
+    def test_bodies_are_not_parsed(self, mainblk):
+        assert [func.name for func in mainblk] == ["f", "g", "h", "main"]
+        for func in mainblk:
+            assert not func.body.loaded and len(func.body) == 0
+        assert [t.lineno for t in mainblk[1].body.lines] == [3, 4, 5, 6]
+
+    def test_parsed_on_call(self, mainblk):
+        with Frame() as frame:
+            mainblk.eval(frame)
+            assert mainblk[0].Call([Int(1)], frame).value == 2
+            assert mainblk[1].Call([Int(3)], frame).value == 5
+        assert len(mainblk[1].body) == 3
+
+    def test_errors_on_load(self, mainblk):
+        with pytest.raises(Exception, match="line 8: x = \\(1 \\+"):
+            mainblk[2].body.load()
+
+
+class Test_reparse:
+    source = """\
+f = x ->
+    y = x * 2
+    y
+
+g = x -> x + 1
+# comment
+h = -> 1
+"""
+
+    def check(self, start, end, text):
+        result = parse_text(self.source)
+        tree = result.tree
+        reparse(result, start, end, text)
+        expected = parse_text("\n".join(result.lines))
+        assert result.tree is tree
+        assert pprint(result.tree) == pprint(expected.tree)
+        assert result.units == expected.units
+        return result
+
+    def test_units(self):
+        result = parse_text(self.source)
+        assert result.units == [[4, 1], [2, 1], [2, 1]]
+
+    def test_edit_body(self):
+        result = self.check((1, 13), (1, 13), " + 1")
+        assert result.lines[1] == "    y = x * 2 + 1"
+
+    def test_new_statement(self):
+        result = self.check((3, 0), (3, 0), "z = 1")
+        assert result.units == [[3, 1], [1, 1], [2, 1], [2, 1]]
+
+    def test_join_with_previous(self):
+        result = self.check((4, 0), (4, 0), "    ")
+        assert result.units == [[6, 1], [2, 1]]
+
+    def test_multiline(self):
+        self.check((2, 0), (4, 5), "    z = y\n    z\nk = x")
+
+    def test_error(self):
+        result = parse_text(self.source)
+        before = pprint(result.tree)
+        with pytest.raises(Exception, match="line 2:"):
+            reparse(result, (1, 5), (1, 5), "= (")
+        assert pprint(result.tree) == before
+        assert result.lines == self.source.split("\n")
+
+
+class Test_cache:
+    source = """\
+::class Point
+    New = x ->
+        @x = x
+    next = ->
+        x = @x
+        x + 1
+main = ->
+    pt = Point . 1
+    pt@next!
+"""
+
+    @pytest.fixture
+    def script(self, tmp_path):
+        path = tmp_path / "prog.ls"
+        path.write_text(self.source)
+        return str(path)
+
+    def run(self, tree):
+        with Frame() as frame:
+            tree.eval(frame)
+            return frame["main"].Call((), frame)
+
+    def test_hit_and_miss(self, script, capsys):
+        tree = load_program(script, report=True)
+        cached = load_program(script, report=True)
+        assert pprint(cached) == pprint(tree)
+        assert self.run(cached).value == self.run(tree).value == 2
+        err = capsys.readouterr().err
+        assert err == f"cache miss: {script} (stored)\ncache hit: {script}\n"
+
+    def test_source_changed(self, script, capsys):
+        load_program(script)
+        with open(script, "a") as f:
+            f.write("x = 1\n")
+        tree = load_program(script, report=True)
+        assert "cache miss" in capsys.readouterr().err
+        assert len(tree) == 3
+
+    def test_clear(self, script, tmp_path):
+        load_program(script)
+        assert (tmp_path / cache.CACHE_DIR).is_dir()
+        cache.clear(script)
+        assert not (tmp_path / cache.CACHE_DIR).exists()
+        assert cache.load(script, "whatever") is None
+
+
+class Test_import:
+    helpers = """\
+::import other
+inc = x -> x + 1
+twice = x ->
+    y = inc . x
+    inc . y
+p "not run"
+"""
+    main = """\
+::import helpers
+main = ->
+    helpers@twice . 1
+"""
+
+    @pytest.fixture
+    def path(self, tmp_path, monkeypatch):
+        (tmp_path / "helpers.ls").write_text(self.helpers)
+        (tmp_path / "other.ls").write_text("x = 1\n")
+        monkeypatch.setattr(storm, "module_path", [str(tmp_path)])
+        monkeypatch.setattr(storm, "module_cache", False)
+        monkeypatch.setattr(interpreter, "module_loader", load_module)
+        monkeypatch.setattr(interpreter, "modules", {})
+        return tmp_path
+
+    def test_import(self, path, capsys):
+        tree = parse_text(self.main).tree
+        assert list(find_imports(tree)) == ["helpers"]
+        with Frame() as frame:
+            tree.eval(frame)
+            module = frame["helpers"]
+            assert module.frame is None
+            assert frame["main"].Call((), frame).value == 3
+        assert list(module.namespace) == ["other", "inc", "twice"]
+        assert capsys.readouterr().out == ""
+
+    def test_once_per_process(self, path):
+        helpers = interpreter.import_module("helpers")
+        assert interpreter.import_module("helpers") is helpers
+
+    def test_not_found(self, path):
+        with pytest.raises(ImportError):
+            interpreter.import_module("nothing")
+
+
+class Test_stream:
+    source = """\
+f = x -> x + 1
+g = x ->
+    y = f . x
+    y * 2
+p "between"
+main = ->
+    g . 1
+"""
+
+    @pytest.mark.parametrize("batch_time", [0, 10])
+    def test_stream(self, tmp_path, monkeypatch, capsys, batch_time):
+        monkeypatch.setattr(storm, "STREAM_BATCH_TIME", batch_time)
+        path = tmp_path / "prog.ls"
+        path.write_text(self.source)
+        with Frame() as frame:
+            eval_stream(str(path), frame)
+            assert frame["main"].Call((), frame).value == 4
+        assert capsys.readouterr().out == "P> 'between'\n"
+
+    def test_syntax_error(self, tmp_path, capsys):
+        path = tmp_path / "prog.ls"
+        path.write_text(self.source + "x = (1 +\n")
+        with Frame() as frame:
+            with pytest.raises(Exception, match="line 8"):
+                eval_stream(str(path), frame)
+            assert frame["g"].Call([Int(1)], frame).value == 4
+        assert capsys.readouterr().out == "P> 'between'\n"
+
+
+class Test_template:
+    source = """\
+::class Box
+    New = v ->
+        @v = v
+main = ->
+    b = Box . 2
+    n = b@v
+    "v={b@v}, \\"{n + 1}\\"\\t{b@v}"
+"""
+
+    def test_compiled(self):
+        tree = parse_text(self.source).tree
+        template = tree[1].body[-1]
+        assert isinstance(template, StrTemplate)
+        assert template.chunks == ["v=", ', "', '"\t', ""]
+        assert [type(e).__name__ for e in template] == ["Attr", "Add", "Attr"]
+        with Frame() as frame:
+            tree.eval(frame)
+            result = frame["main"].Call((), frame)
+        assert result.value == 'v=2, "3"\t2'
+
+    def test_same_as_eval(self):
+        with Frame() as frame:
+            frame["x"] = Int(1)
+            tpl = StrTPL(r"{x} + {x}\n = {x + x}")
+            assert tpl.compile().eval(frame).value == tpl.eval(frame).value
+            assert tpl.eval(frame).value == "1 + 1\n = 2"
+            assert StrTPL("no {").eval(frame).value == "no {"
@@ -0,0 +1,73 @@
+from catstorm.syntax_tree import Binary, Leaf, ListNode, Rewriter, Unary
+
+
+class Num(Leaf):
+    pass
+
+
+class Add(Binary):
+    pass
+
+
+class Neg(Unary):
+    pass
+
+
+class Seq(ListNode):
+    pass
+
+
+class Test_Rewriter:
+    def test_post_order(self):
+        rewriter = Rewriter()
+        seen = []
+
+        @rewriter.register(object)
+        def visit(node):
+            seen.append(type(node).__name__)
+            return node
+
+        rewriter.rewrite(Seq(Add(Num(1), Neg(Num(2))), Num(3)))
+        assert seen == ["Num", "Num", "Neg", "Add", "Num", "Seq"]
+
+    def test_order_of_dependent_rewrites(self):
+        rewriter = Rewriter()
+
+        @rewriter.register(Neg)
+        def fold_neg(node):
+            return Num(-node.arg.value) if isinstance(node.arg, Num) else node
+
+        @rewriter.register(Add)
+        def fold_add(node):
+            if isinstance(node.left, Num) and isinstance(node.right, Num):
+                return Num(node.left.value + node.right.value)
+            return node
+
+        @rewriter.register(Leaf)
+        def double(node):
+            return Num(node.value * 2)
+
+        tree = Seq(Add(Num(1), Neg(Num(2))))
+        assert rewriter.rewrite(tree) is tree
+        # leaves are doubled and so are the results of folding
+        # (they are leaves too): ((1 * 2) + (-(2 * 2) * 2)) * 2
+        assert tree[0].value == -12
+
+    def test_new_node_gets_only_later_transforms(self):
+        rewriter = Rewriter()
+
+        @rewriter.register(Num)
+        def to_neg(node):
+            return Neg(node)
+
+        @rewriter.register(Neg)
+        def mark(node):
+            node.arg.value = "marked"
+            return node
+
+        @rewriter.register(Unary)
+        def to_num(node):
+            return Num(node.arg.value) if isinstance(node, Neg) else node
+
+        result = rewriter.rewrite(Num(1))
+        assert isinstance(result, Num) and result.value == "marked"
@@ -0,0 +1,37 @@
+import traceback
+
+from catstorm import interpreter, transpile
+from catstorm.frame import Frame
+from catstorm.storm import parse_text
+from engines import ENGINES, lazy_fib, source
+import pytest
+
+
+def test_source():
+    code, transpiler = transpile.transpile(parse_text(source).tree)
+    assert "def func_fib(frame):" in code
+    assert "def method_Box_get(frame):" in code
+    assert "    while lt(" in code
+    compile(code, "<test>", "exec")
+    assert len(transpiler.linemap) == len(code.splitlines())
+
+
+def test_lazy(monkeypatch):
+    fib = lazy_fib(monkeypatch, ENGINES["transpile"])
+    assert fib.body.eval.__name__ == "program"
+
+
+def test_traceback(tmp_path):
+    path = tmp_path / "fail.ls"
+    path.write_text("f = x ->\n    y = x + 1\n    assert y == 3\n    y\n")
+    tree = parse_text(path.read_text()).tree
+    transpile.install(tree, str(path))
+    with Frame() as frame:
+        tree.eval(frame)
+        assert frame["f"].Call([interpreter.Int(2)], Frame(frame)).value == 3
+        with pytest.raises(Exception, match="Assertion failed") as info:
+            frame["f"].Call([interpreter.Int(5)], Frame(frame))
+    frames = traceback.extract_tb(info.tb)
+    (line,) = [f for f in frames if f.filename == str(path)]
+    assert line.lineno == 3
+    assert line.line == "assert y == 3"
@@ -0,0 +1,48 @@
+import io
+import pickle
+
+from catstorm import vm
+from catstorm.frame import Frame
+from catstorm.interpreter import Int
+from catstorm.storm import parse_text
+from engines import expected, lazy_fib, run, source
+
+
+def test_lazy(monkeypatch):
+    fib = lazy_fib(monkeypatch, vm.install)
+    assert "code" in fib.body.__dict__
+
+
+def test_deep_recursion():
+    tree = parse_text(
+        "count = n ->\n    if n == 0\n        ret 0\n"
+        "    r = count . (n - 1)\n    r + 1\n"
+    ).tree
+    vm.install(tree)
+    with Frame() as frame:
+        tree.eval(frame)
+        assert frame["count"].Call([Int(3000)], Frame(frame)).value == 3000
+
+
+def test_pickle():
+    tree = parse_text(source).tree
+    vm.compile_tree(tree)
+    box, fib, join, main = tree
+    assert "eval" not in fib.body.__dict__  # only installed when it's run
+    tree = pickle.loads(pickle.dumps(tree))
+    box, fib, join, main = tree
+    code = fib.body.code
+    assert code.ops.typecode == "i" and code.names == ["n", "fib", "a", "b"]
+    assert code.consts[0] is not None and code.consts[0].value == 2
+    assert run(tree, vm.install) == expected
+    assert fib.body.code is code
+
+
+def test_dis():
+    out = io.StringIO()
+    vm.dis(parse_text(source).tree, out)
+    text = out.getvalue()
+    for name in ("<main>", "Box.New", "Box.get", "fib", "join", "main"):
+        assert "Disassembly of %s:" % name in text
+    assert "STORE_NAME           2 (a)" in text
+    assert "BINARY               6 (<)" in text
@@ -0,0 +1,14 @@
+"""Helpers for the tests looking into syntax trees."""
+
+
+def nodes(tree, cls):
+    """Nodes of the class or of its variants."""
+    found = []
+    todo = list(tree)
+    while todo:
+        node = todo.pop()
+        if isinstance(node, cls):
+            found.append(node)
+        if isinstance(node, (list, tuple)) or hasattr(node, "fields"):
+            todo.extend(node)
+    return found